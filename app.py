@@ -6,495 +6,5246 @@ Versión: 3.0.0
 Desarrolladores: Santiago Valenzuela & Juan Ortiz
 """
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
-from datetime import datetime, timedelta
+from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for, stream_with_context, g
+from flask import before_render_template, template_rendered
+from flask.json.provider import DefaultJSONProvider
+from datetime import datetime
+import os
+import math
+import threading
 import random
+import time
 import uuid
 import json
+import base64
+import csv
+import io
+import zlib
+import hashlib
+import cProfile
+import sqlite3
+import bisect
+import asyncio
+import struct
+import shutil
+import socket
+import socketserver
+from array import array
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from itertools import chain
+
+import click
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin instantánea compartida entre workers
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # se serializa con el módulo json estándar
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # las respuestas solo se comprimen con gzip
+    brotli = None
+
+# ============================================================================
+# CONFIGURACIÓN DE LA APLICACIÓN
+# ============================================================================
+
+app = Flask(__name__)
+app.config['SECRET_KEY'] = 'agrotrace-2025-secret-key-dev'
+app.config['JSON_AS_ASCII'] = False
+
+# Animales del hato simulado (configurable para pruebas de carga) y semilla
+# del generador; con la misma semilla se generan los mismos datos
+app.config['HERD_SIZE'] = int(os.environ.get('AGROTRACE_HERD_SIZE', 155))
+app.config['DATA_SEED'] = int(os.environ['AGROTRACE_SEED']) if os.environ.get('AGROTRACE_SEED') else None
+
+# Segundos en los que las lecturas repetidas de un arete en el mismo lector
+# se agrupan en un solo evento
+app.config['RFID_DEDUP_WINDOW'] = 2.0
+
+# Pasarela de lectores RFID (TCP y UDP en host:puerto, p. ej. 0.0.0.0:7070;
+# sin valor queda desactivada): lecturas máximas en cola antes de frenar a
+# los lectores y tamaño y espera máxima (segundos) de cada micro-lote
+app.config['RFID_GATEWAY'] = os.environ.get('AGROTRACE_RFID_GATEWAY') or None
+app.config['RFID_GATEWAY_QUEUE'] = int(os.environ.get('AGROTRACE_RFID_GATEWAY_QUEUE', 50000))
+app.config['RFID_GATEWAY_BATCH'] = 2000
+app.config['RFID_GATEWAY_FLUSH'] = 0.05
+
+# Caché de respuestas de estadísticas y gráficos: vigencia en segundos y
+# número máximo de entradas
+app.config['RESPONSE_CACHE_TTL'] = 30
+app.config['RESPONSE_CACHE_SIZE'] = 256
+
+# Compresión de respuestas según Accept-Encoding: tamaño mínimo en bytes,
+# nivel de gzip y calidad de brotli (bajos porque se comprime en cada
+# solicitud que no sale de la caché de respuestas)
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('AGROTRACE_COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_GZIP_LEVEL'] = 3
+app.config['COMPRESS_BROTLI_QUALITY'] = 4
+
+# Arreglos JSON con al menos estos elementos se serializan por bloques
+# mientras se envían
+app.config['JSON_STREAM_MIN_ITEMS'] = 1000
+
+# Filas por página en las vistas de animales, salud y RFID, y registros
+# serializados que se conservan entre páginas
+app.config['PAGE_SIZE'] = 10
+app.config['ROW_CACHE_SIZE'] = 4096
+
+# Métricas por solicitud (/metrics). Con PROFILE_SAMPLE_RATE > 0 se perfila
+# esa fracción de solicitudes y se guardan en PROFILE_DIR las que superan
+# PROFILE_SLOW_MS
+app.config['METRICS_ENABLED'] = os.environ.get('AGROTRACE_METRICS', '1') == '1'
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('AGROTRACE_PROFILE_RATE', 0))
+app.config['PROFILE_SLOW_MS'] = float(os.environ.get('AGROTRACE_PROFILE_SLOW_MS', 500))
+app.config['PROFILE_DIR'] = os.environ.get('AGROTRACE_PROFILE_DIR', 'profiles')
+
+# Base SQLite donde persisten hato, salud, lecturas y actividad. Al arrancar
+# se cargan en memoria las lecturas de los últimos READINGS_MEMORY_DAYS días;
+# las anteriores se consultan directamente en la base
+app.config['DATABASE'] = os.environ.get('AGROTRACE_DATABASE', 'agrotrace.db')
+app.config['READINGS_MEMORY_DAYS'] = int(os.environ.get('AGROTRACE_READINGS_DAYS', 90))
+
+# Hilos con que /api/analytics/query recorre las tablas grandes por bloques
+app.config['ANALYTICS_WORKERS'] = int(os.environ.get('AGROTRACE_ANALYTICS_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Instantánea compartida entre workers (p. ej. /dev/shm/agrotrace): un solo
+# worker carga la base y escribe, y cada SNAPSHOT_INTERVAL segundos publica
+# las columnas que los demás mapean en memoria sin copiarlas. Sin directorio
+# cada proceso carga su propio hato
+app.config['SNAPSHOT_DIR'] = os.environ.get('AGROTRACE_SNAPSHOT_DIR') or None
+app.config['SNAPSHOT_INTERVAL'] = float(os.environ.get('AGROTRACE_SNAPSHOT_INTERVAL', 1.0))
+
+# ============================================================================
+# CONTEXT PROCESSOR - Variables globales para templates
+# ============================================================================
+
+@app.context_processor
+def inject_globals():
+    """
+    Inyecta variables globales en todos los templates
+    Esto evita el error 'undefined' en Jinja2
+    """
+    return {
+        'app_name': 'AgroTrace',
+        'app_version': '3.0.0',
+        'current_year': datetime.now().year
+    }
+
+# ============================================================================
+# MODELO DE DATOS
+# ============================================================================
+
+# Catálogos del módulo RFID
+RFID_LOCATIONS = [
+    'Entrada Principal', 'Sector A - Pastoreo', 'Sector B - Pastoreo', 
+    'Corral 1', 'Corral 2', 'Corral 3', 'Establo Norte', 'Establo Sur',
+    'Zona de Alimentación', 'Zona de Ordeño', 'Báscula de Pesaje', 
+    'Clínica Veterinaria', 'Zona de Cuarentena', 'Salida/Carga'
+]
+
+RFID_READERS = [
+    'RFID-001', 'RFID-002', 'RFID-003', 'RFID-004', 'RFID-005',
+    'RFID-006', 'RFID-007', 'RFID-008'
+]
+
+RFID_READ_STATUSES = [
+    {'name': 'Exitoso', 'class': 'success', 'icon': 'check-circle'},
+    {'name': 'Error de Lectura', 'class': 'danger', 'icon': 'exclamation-circle'},
+    {'name': 'Señal Débil', 'class': 'warning', 'icon': 'signal'}
+]
+
+RFID_EVENT_TYPES = [
+    {'name': 'Entrada', 'icon': 'sign-in-alt', 'color': '#10B981'},
+    {'name': 'Salida', 'icon': 'sign-out-alt', 'color': '#EF4444'},
+    {'name': 'Pesaje', 'icon': 'weight', 'color': '#F59E0B'},
+    {'name': 'Control', 'icon': 'clipboard-check', 'color': '#3B82F6'},
+    {'name': 'Alimentación', 'icon': 'utensils', 'color': '#8B5CF6'},
+    {'name': 'Ordeño', 'icon': 'droplet', 'color': '#06B6D4'}
+]
+
+# Estados de los registros veterinarios
+HEALTH_STATUSES = [
+    {'name': 'Completado', 'class': 'success'},
+    {'name': 'Pendiente', 'class': 'warning'},
+    {'name': 'Urgente', 'class': 'danger'},
+    {'name': 'Programado', 'class': 'info'}
+]
+
+# Tipos de evento del feed de actividad
+ACTIVITY_TYPES = {
+    'scan': {'type': 'scan', 'icon': 'wifi', 'color': 'blue', 'template': 'Escaneo RFID: {0} en {1}'},
+    'health': {'type': 'health', 'icon': 'heart-pulse', 'color': 'red', 'template': 'Alerta de salud: {0} requiere atención'},
+    'vaccination': {'type': 'vaccination', 'icon': 'syringe', 'color': 'green', 'template': 'Vacunación completada: {0}'},
+    'movement': {'type': 'movement', 'icon': 'truck', 'color': 'purple', 'template': 'Traslado: {0} → {1}'},
+    'weight': {'type': 'weight', 'icon': 'weight-scale', 'color': 'yellow', 'template': 'Pesaje registrado: {0} - {1}kg'},
+    'treatment': {'type': 'treatment', 'icon': 'pills', 'color': 'orange', 'template': 'Tratamiento iniciado: {0}'},
+}
+
+# Ubicación fija de cada lector físico
+READER_LOCATIONS = {
+    'RFID-001': 'Entrada Principal',
+    'RFID-002': 'Sector A - Pastoreo',
+    'RFID-003': 'Sector B - Pastoreo',
+    'RFID-004': 'Zona de Alimentación',
+    'RFID-005': 'Zona de Ordeño',
+    'RFID-006': 'Báscula de Pesaje',
+    'RFID-007': 'Clínica Veterinaria',
+    'RFID-008': 'Salida/Carga'
+}
+
+# Tipo de evento que se asume según la ubicación del lector
+LOCATION_EVENTS = {
+    'Báscula de Pesaje': 'Pesaje',
+    'Zona de Ordeño': 'Ordeño',
+    'Zona de Alimentación': 'Alimentación',
+    'Clínica Veterinaria': 'Control',
+    'Salida/Carga': 'Salida'
+}
+
+# Catálogos y pesos del hato simulado
+ANIMAL_BREEDS = ['Holstein', 'Brahman', 'Angus', 'Simmental', 'Charolais', 'Hereford', 'Jersey']
+
+ANIMAL_STATUSES = [
+    {'name': 'Saludable', 'class': 'success', 'color': 'green'},
+    {'name': 'En Observación', 'class': 'warning', 'color': 'yellow'},
+    {'name': 'Tratamiento', 'class': 'danger', 'color': 'red'},
+    {'name': 'Cuarentena', 'class': 'info', 'color': 'blue'}
+]
+ANIMAL_STATUS_WEIGHTS = [75, 12, 8, 5]
+
+ANIMAL_LOCATIONS = [
+    'Sector A - Pastoreo', 'Sector B - Pastoreo', 'Sector C - Alimentación',
+    'Corral 1', 'Corral 2', 'Corral 3', 'Zona Norte', 'Zona Sur'
+]
+
+FARMS = ['Finca El Paraíso', 'Finca La Esperanza', 'Finca San José', 'Finca Villa Rica']
+
+AVATAR_COLORS = ['#3B82F6', '#10B981', '#F59E0B', '#EF4444', '#8B5CF6', '#EC4899', '#14B8A6', '#F97316']
+
+ANIMAL_NOTES = [
+    'Sin observaciones',
+    'Control veterinario pendiente',
+    'Programado para vacunación',
+    'En seguimiento',
+    ''
+]
+
+VACCINES = [
+    'Fiebre Aftosa', 'Brucelosis', 'Rabia Bovina', 'Carbunco',
+    'Clostridiosis', 'IBR/DVB', 'Leptospirosis', 'Triple'
+]
+
+TREATMENTS = [
+    'Desparasitación interna', 'Desparasitación externa', 'Antibiótico general',
+    'Vitaminas y minerales', 'Tratamiento respiratorio', 'Tratamiento digestivo',
+    'Cicatrización de heridas', 'Control de garrapatas', 'Ninguno'
+]
+
+VETERINARIANS = ['Dr. García', 'Dra. Martínez', 'Dr. López', 'Dra. Fernández', 'Dr. Rodríguez']
+
+HEALTH_OBSERVATIONS = [
+    'Animal en condiciones óptimas',
+    'Requiere seguimiento en 15 días',
+    'Programar próxima vacunación',
+    'Control de peso recomendado',
+    'Sin observaciones',
+    'Revisar alimentación',
+    'Monitorear temperatura',
+    ''
+]
+
+DIAGNOSES = [
+    'Saludable', 'Parasitosis leve', 'En recuperación',
+    'Control rutinario', 'Tratamiento preventivo', 'Normal'
+]
+
+HEALTH_STATUS_WEIGHTS = [60, 20, 10, 10]
+
+RFID_NOTES = [
+    'Lectura exitosa',
+    'Animal identificado correctamente',
+    'Requiere mantenimiento del tag',
+    'Señal óptima',
+    'Tag en buen estado',
+    ''
+]
+
+RFID_STATUS_WEIGHTS = [4, 1, 1]
+
+ACTIVITY_USERS = ['Admin', 'Veterinario', 'Operador', 'Sistema']
+
+def time_ago(dt):
+    """Convierte datetime a formato 'hace X tiempo'"""
+    now = datetime.now()
+    diff = now - dt
+    
+    if diff.total_seconds() < 60:
+        return 'Hace unos segundos'
+    elif diff.total_seconds() < 3600:
+        minutes = int(diff.total_seconds() / 60)
+        return f'Hace {minutes} minuto{"s" if minutes > 1 else ""}'
+    elif diff.total_seconds() < 86400:
+        hours = int(diff.total_seconds() / 3600)
+        return f'Hace {hours} hora{"s" if hours > 1 else ""}'
+    else:
+        days = int(diff.total_seconds() / 86400)
+        return f'Hace {days} día{"s" if days > 1 else ""}'
+
+
+class BatchGenerator:
+    """
+    Generador vectorizado y reproducible del hato simulado y de las pruebas
+    de carga. Produce los datos por columnas numpy y en bloques: cada bloque
+    es un dict columna → array, con las columnas categóricas como
+    (catálogo, índices). Con la misma semilla
+    y el mismo `now` genera exactamente los mismos datos.
+    """
+
+    def __init__(self, seed=None, now=None):
+        self.rng = np.random.default_rng(seed)
+        self.now = int(time.time() if now is None else now)
+
+    def _pick(self, catalog, count, weights=None):
+        """Índices de `catalog` elegidos al azar (con pesos opcionales)"""
+        if weights is None:
+            return catalog, self.rng.integers(0, len(catalog), count).astype(np.uint8)
+        p = np.asarray(weights, dtype=np.float64)
+        return catalog, self.rng.choice(len(catalog), count, p=p / p.sum()).astype(np.uint8)
+
+    def _unique_tags(self, count):
+        """Aretes 'RF-XXXXXXXX' sin repetidos"""
+        values = np.unique(self.rng.integers(0, 1 << 32, count, dtype=np.uint64))
+        while len(values) < count:
+            extra = self.rng.integers(0, 1 << 32, count - len(values), dtype=np.uint64)
+            values = np.unique(np.concatenate([values, extra]))
+        values = self.rng.permutation(values)
+        return np.char.mod('RF-%08X', values).astype('S16')
+
+    def animals(self, count, first_id=1):
+        """Columnas de `count` animales con ids consecutivos desde `first_id`"""
+        rng = self.rng
+        ids = np.arange(first_id, first_id + count, dtype=np.int32)
+        statuses, status = self._pick(ANIMAL_STATUSES, count, ANIMAL_STATUS_WEIGHTS)
+        healthy = status == 0
+        age_months = rng.integers(8, 85, count).astype(np.int16)
+        return {
+            'id': ids,
+            'code': np.char.mod('AG%04d', ids).astype('S12'),
+            'rfid': self._unique_tags(count),
+            'name': np.char.mod('Animal-%03d', ids).astype('S32'),
+            'breed': self._pick(ANIMAL_BREEDS, count),
+            'status': (statuses, status),
+            'location': self._pick(ANIMAL_LOCATIONS, count),
+            'owner': self._pick(FARMS, count),
+            'notes': self._pick(ANIMAL_NOTES, count),
+            'avatar_color': self._pick(AVATAR_COLORS, count),
+            'age_months': age_months,
+            'weight': rng.integers(180, 651, count).astype(np.float32),
+            'weight_gain': np.round(rng.uniform(-2, 5, count), 1).astype(np.float32),
+            'health_score': np.where(healthy, rng.integers(75, 101, count), rng.integers(40, 86, count)).astype(np.uint8),
+            'vaccinated': rng.random(count) < 0.5,
+            'temperature': np.round(rng.uniform(37.5, 39.5, count), 1).astype(np.float32),
+            'last_scan': self.now - rng.integers(1, 4321, count) * 60,
+            'birth_date': self.now - age_months.astype(np.int64) * 30 * 86400,
+        }
+
+    def health_records(self, count, animals, chunk=1_000_000):
+        """Bloques de registros de salud sobre los animales dados (columnas de `animals`)"""
+        rng = self.rng
+        today = local_midnight(local_day(self.now))
+        for offset in range(0, count, chunk):
+            size = min(chunk, count - offset)
+            picked = rng.integers(0, len(animals['id']), size)
+            checkup = self.now - rng.integers(0, 181, size) * 86400
+            yield {
+                'animal_id': animals['id'][picked],
+                'checkup_date': checkup - checkup % 60,
+                'next_checkup': today + rng.integers(15, 91, size) * 86400,
+                'weight': (animals['weight'][picked] + rng.integers(-20, 31, size)).astype(np.float32),
+                'temperature': np.round(rng.uniform(37.5, 39.8, size), 1).astype(np.float32),
+                'heart_rate': rng.integers(55, 86, size).astype(np.uint8),
+                'respiratory_rate': rng.integers(20, 41, size).astype(np.uint8),
+                'status': self._pick([status['class'] for status in HEALTH_STATUSES], size, HEALTH_STATUS_WEIGHTS),
+                'vaccine': self._pick(VACCINES, size),
+                'treatment': self._pick(TREATMENTS, size),
+                'veterinarian': self._pick(VETERINARIANS, size),
+                'observations': self._pick(HEALTH_OBSERVATIONS, size),
+                'diagnosis': self._pick(DIAGNOSES, size),
+                'cost': np.round(rng.uniform(15000, 85000, size), 2),
+            }
+
+    def rfid_readings(self, count, animals, days=7, chunk=1_000_000):
+        """
+        Bloques de lecturas RFID de los animales dados, repartidas en los
+        últimos `days` días (más las horas sueltas, como el generador original)
+        """
+        rng = self.rng
+        for offset in range(0, count, chunk):
+            size = min(chunk, count - offset)
+            picked = rng.integers(0, len(animals['id']), size)
+            statuses, status = self._pick([status['name'] for status in RFID_READ_STATUSES], size, RFID_STATUS_WEIGHTS)
+            success = status == 0
+            yield {
+                'timestamp': self.now - rng.integers(0, days + 1, size) * 86400 - rng.integers(0, 86400, size),
+                'animal_id': animals['id'][picked],
+                'tag': animals['rfid'][picked],
+                'reader': self._pick(RFID_READERS, size),
+                'location': self._pick(RFID_LOCATIONS, size),
+                'event': self._pick([event['name'] for event in RFID_EVENT_TYPES], size),
+                'status': (statuses, status),
+                'signal_strength': np.where(success, rng.integers(45, 101, size), rng.integers(20, 61, size)).astype(np.uint8),
+                'tag_temperature': np.round(rng.uniform(18.0, 32.0, size), 1).astype(np.float32),
+                'battery_level': rng.integers(60, 101, size).astype(np.uint8),
+                'read_count': rng.integers(1, 51, size).astype(np.uint32),
+                'duration_ms': rng.integers(50, 501, size).astype(np.uint16),
+                'distance_meters': np.round(rng.uniform(0.5, 5.0, size), 1).astype(np.float32),
+                'notes': self._pick(RFID_NOTES, size),
+            }
+
+    def weighings(self, count, animals, days=730, chunk=1_000_000):
+        """
+        Bloques de pesajes de báscula de los animales dados en los últimos
+        `days` días; el peso crece en línea recta desde 40 kg al nacer hasta
+        el peso actual del animal, con un 2% de ruido
+        """
+        rng = self.rng
+        for offset in range(0, count, chunk):
+            size = min(chunk, count - offset)
+            picked = rng.integers(0, len(animals['id']), size)
+            age = np.maximum(self.now - animals['birth_date'][picked], 86400)
+            ago = (rng.random(size) * np.minimum(age, days * 86400)).astype(np.int64)
+            weight = animals['weight'][picked].astype(np.float64)
+            expected = 40 + (weight - 40) * (age - ago) / age
+            yield {
+                'animal_id': animals['id'][picked],
+                'timestamp': self.now - ago,
+                'weight': np.round(expected * rng.normal(1, 0.02, size), 1).astype(np.float32),
+            }
+
+    def activity(self, count, animals):
+        """Eventos de actividad (tipo, mensaje, usuario, fecha) en orden cronológico"""
+        rng = self.rng
+        kinds = list(ACTIVITY_TYPES)
+        picked = rng.integers(0, len(animals['id']), count)
+        kind = rng.integers(0, len(kinds), count)
+        place = rng.random(count)
+        user = rng.integers(0, len(ACTIVITY_USERS), count)
+        minutes = np.sort(rng.integers(1, 721, count))[::-1]
+        places = ['Sector A', 'Sector B', 'Corral 1', 'Zona Norte', 'Establo']
+        events = []
+        for i in range(count):
+            name = animals['name'][picked[i]].decode('utf-8')
+            activity_type = ACTIVITY_TYPES[kinds[kind[i]]]
+            if activity_type['type'] in ('movement', 'scan'):
+                # Los traslados no tienen como destino el establo
+                location = places[int(place[i] * (4 if activity_type['type'] == 'movement' else 5))]
+                message = activity_type['template'].format(name, location)
+            elif activity_type['type'] == 'weight':
+                message = activity_type['template'].format(name, _to_number(animals['weight'][picked[i]]))
+            else:
+                message = activity_type['template'].format(name)
+            events.append((activity_type['type'], message, ACTIVITY_USERS[user[i]],
+                           datetime.fromtimestamp(self.now - int(minutes[i]) * 60)))
+        return events
+
+
+# ============================================================================
+# HORA LOCAL
+# ============================================================================
+
+# Días y horas se cortan en hora local con el desfase vigente en cada instante
+# (horario de verano incluido); todas las particiones y acumulados usan estas
+# funciones para que sus días coincidan
+
+def utc_offset(timestamp):
+    """Desfase de la hora local respecto a UTC en el instante dado, en segundos"""
+    return time.localtime(min(max(int(timestamp), 0), MAX_TIMESTAMP)).tm_gmtoff
+
+@lru_cache(maxsize=64)
+def _offset_changes(first_day, last_day):
+    """Instantes en que cambia el desfase entre dos días UTC y el desfase desde cada uno"""
+    edges, offsets = [], [utc_offset(first_day * 86400)]
+    for day in range(first_day + 1, last_day + 2):
+        offset = utc_offset(day * 86400)
+        if offset != offsets[-1]:
+            # Búsqueda binaria del primer segundo con el nuevo desfase
+            low, high = (day - 1) * 86400, day * 86400
+            while high - low > 1:
+                middle = (low + high) // 2
+                low, high = (middle, high) if utc_offset(middle) == offsets[-1] else (low, middle)
+            edges.append(high)
+            offsets.append(offset)
+    return np.array(edges, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+def utc_offsets(timestamps):
+    """Desfase UTC de cada epoch de un arreglo"""
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if not timestamps.size:
+        return np.zeros(timestamps.shape, dtype=np.int64)
+    first = min(max(int(timestamps.min()), 0), MAX_TIMESTAMP) // 86400
+    last = min(max(int(timestamps.max()), 0), MAX_TIMESTAMP) // 86400
+    edges, offsets = _offset_changes(first, last)
+    return offsets[np.searchsorted(edges, timestamps, side='right')]
+
+def local_day(timestamp):
+    """Día local de un epoch (días desde 1970-01-01 en hora local)"""
+    timestamp = int(timestamp)
+    return (timestamp + utc_offset(timestamp)) // 86400
+
+def local_days(timestamps):
+    """Día local de cada epoch de un arreglo"""
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    return (timestamps + utc_offsets(timestamps)) // 86400
+
+def local_midnight(day):
+    """Epoch de la medianoche local del día local `day`"""
+    midnight = int(day) * 86400
+    return midnight - utc_offset(midnight - utc_offset(midnight))
+
+def day_start(timestamps):
+    """Epoch de la medianoche local del día de cada epoch de un arreglo"""
+    midnight = local_days(timestamps) * 86400
+    return midnight - utc_offsets(midnight - utc_offsets(midnight))
+
+def hour_start(timestamp):
+    """Epoch del inicio de la hora local de un epoch (horas contadas desde la medianoche)"""
+    timestamp = int(timestamp)
+    return timestamp - (timestamp - local_midnight(local_day(timestamp))) % 3600
+
+
+# ============================================================================
+# ALMACENAMIENTO COLUMNAR
+# ============================================================================
+
+class Dictionary:
+    """
+    Codificación por diccionario: asigna un código entero a cada valor
+    distinto. Las columnas codificadas son uint8, así que por defecto no se
+    registran más de 256 valores (un código mayor se truncaría en la columna)
+    """
+
+    LIMIT = 256
+
+    def __init__(self, values=(), limit=LIMIT):
+        self.values = []
+        self._codes = {}
+        self.limit = limit
+        for value in values:
+            self.encode(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        """Retorna el código del valor, registrándolo si es nuevo"""
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            if code >= self.limit:
+                raise ValueError(f'Demasiados valores distintos ({self.limit}); no se registra: {value}')
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+    def lookup(self, value):
+        """Código de un valor existente o None si nunca se registró"""
+        return self._codes.get(value)
+
+    def decode(self, code):
+        return self.values[code]
+
+
+class ColumnTable:
+    """
+    Tabla de columnas numpy con capacidad que crece por duplicación.
+    Todas las columnas comparten el mismo número de filas; `version`
+    aumenta con cada escritura y cada fila guarda la versión de su último cambio.
+    """
+
+    def __init__(self, schema, capacity=1024):
+        self.schema = dict(schema)
+        self.version = 0
+        self._size = 0
+        self._capacity = max(int(capacity), 16)
+        self._data = {name: np.zeros(self._capacity, dtype=dtype) for name, dtype in self.schema.items()}
+        self._stamps = np.zeros(self._capacity, dtype=np.uint64)
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, name):
+        """Vista de la columna limitada a las filas ocupadas"""
+        return self._data[name][:self._size]
+
+    def reserve(self, extra):
+        """Garantiza espacio para `extra` filas adicionales"""
+        needed = self._size + extra
+        if needed <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        for name, column in self._data.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._data[name] = grown
+        stamps = np.zeros(capacity, dtype=np.uint64)
+        stamps[:self._size] = self._stamps[:self._size]
+        self._stamps = stamps
+        self._capacity = capacity
+
+    def append(self, values):
+        """Agrega una fila a partir de un dict columna → valor; retorna su índice"""
+        self.reserve(1)
+        row = self._size
+        for name, value in values.items():
+            self._data[name][row] = value
+        self._size += 1
+        self.version += 1
+        self._stamps[row] = self.version
+        return row
+
+    def extend(self, columns):
+        """Agrega un bloque de filas a partir de arrays por columna"""
+        count = len(next(iter(columns.values())))
+        self.reserve(count)
+        start = self._size
+        for name, values in columns.items():
+            self._data[name][start:start + count] = values
+        self._size += count
+        self.version += 1
+        self._stamps[start:start + count] = self.version
+        return range(start, start + count)
+
+    def set(self, name, row, value):
+        self._data[name][row] = value
+        self.version += 1
+        self._stamps[row] = self.version
+
+    def touch(self, rows):
+        """Marca como modificadas filas cuyos valores se cambiaron directamente en el buffer"""
+        self.version += 1
+        self._stamps[rows] = self.version
+
+    def map(self, columns, size, version):
+        """
+        Reemplaza los buffers por arreglos externos de solo lectura (p. ej.
+        np.memmap de una instantánea compartida) sin copiarlos. Todas las
+        filas quedan con la versión recibida.
+        """
+        self._data.update(columns)
+        self._size = self._capacity = size
+        self.version = version
+        self._stamps = np.broadcast_to(np.uint64(version), (size,))
+
+    def row_versions(self, rows):
+        """Versión del último cambio de cada fila"""
+        return self._stamps[:self._size][rows]
+
+    def nbytes(self):
+        """Memoria ocupada por los buffers de las columnas"""
+        return sum(column.nbytes for column in self._data.values())
+
+
+class KeyIndex:
+    """
+    Índice ordenado sobre una columna de claves únicas (código, RFID).
+    Las filas nuevas se guardan en un dict pendiente y el arreglo ordenado
+    se reconstruye cuando ese dict crece demasiado.
+    """
+
+    def __init__(self, table, column):
+        self._table = table
+        self._column = column
+        self._order = np.zeros(0, dtype=np.int64)
+        self._keys = np.zeros(0, dtype=table.schema[column])
+        self._pending = {}
+
+    def add(self, key, row):
+        if self.find(key) is not None:
+            raise ValueError(f"Clave duplicada en {self._column}: {key!r}")
+        self._pending[key] = row
+        if len(self._pending) > max(1024, len(self._order) // 8):
+            self.rebuild()
+
+    def rebuild(self):
+        keys = self._table[self._column]
+        self._order = np.argsort(keys, kind='stable')
+        self._keys = keys[self._order]
+        self._pending = {}
+
+    def find(self, key):
+        """Fila asociada a la clave o None"""
+        row = self._pending.get(key)
+        if row is not None:
+            return row
+        pos = int(np.searchsorted(self._keys, key))
+        if pos < len(self._keys) and self._keys[pos] == key:
+            return int(self._order[pos])
+        return None
+
+
+# ============================================================================
+# ÍNDICES DE BÚSQUEDA
+# ============================================================================
+
+class BitmapIndex:
+    """
+    Índice secundario de una columna categórica: un bitmap empaquetado por código.
+    Los filtros se combinan con AND/OR sobre los bitmaps sin recorrer la tabla.
+    """
+
+    def __init__(self, capacity=1024):
+        self._nbytes = max(capacity // 8 + 1, 16)
+        self._bitmaps = {}
+
+    def _bitmap(self, code):
+        bitmap = self._bitmaps.get(code)
+        if bitmap is None:
+            bitmap = self._bitmaps[code] = np.zeros(self._nbytes, dtype=np.uint8)
+        return bitmap
+
+    def _reserve(self, row):
+        if row // 8 < self._nbytes:
+            return
+        nbytes = self._nbytes
+        while row // 8 >= nbytes:
+            nbytes *= 2
+        for code, bitmap in self._bitmaps.items():
+            grown = np.zeros(nbytes, dtype=np.uint8)
+            grown[:self._nbytes] = bitmap
+            self._bitmaps[code] = grown
+        self._nbytes = nbytes
+
+    def add(self, code, row):
+        self._reserve(row)
+        self._bitmap(int(code))[row >> 3] |= np.uint8(1 << (row & 7))
+
+    def remove(self, code, row):
+        self._bitmap(int(code))[row >> 3] &= np.uint8(~(1 << (row & 7)) & 0xFF)
+
+    def move(self, row, old_code, new_code):
+        self.remove(old_code, row)
+        self.add(new_code, row)
+
+    def build(self, column):
+        """Reconstruye todos los bitmaps a partir de la columna completa"""
+        self._nbytes = max(len(column) // 8 + 1, self._nbytes)
+        self._bitmaps = {}
+        for code in np.unique(column):
+            packed = np.packbits(column == code, bitorder='little')
+            bitmap = self._bitmap(int(code))
+            bitmap[:len(packed)] = packed
+
+    def union(self, codes):
+        """Bitmap con las filas de cualquiera de los códigos"""
+        result = np.zeros(self._nbytes, dtype=np.uint8)
+        for code in codes:
+            bitmap = self._bitmaps.get(int(code))
+            if bitmap is not None:
+                result |= bitmap
+        return result
+
+
+def unpack_rows(bitmap, count):
+    """Máscara booleana de `count` filas a partir de un bitmap empaquetado"""
+    return np.unpackbits(bitmap, count=count, bitorder='little').astype(bool)
+
+
+class TrigramIndex:
+    """
+    Índice de trigramas para búsqueda por subcadena sobre campos de texto.
+    Cada trigrama apunta a la lista ordenada de filas que lo contienen;
+    la consulta intersecta esas listas y verifica solo los candidatos
+    contra una copia en minúsculas de cada campo.
+    """
+
+    def __init__(self, fields, capacity=1024):
+        self.fields = dict(fields)
+        self._folded = ColumnTable(self.fields, capacity)
+        self._postings = {name: {} for name in self.fields}
+
+    @staticmethod
+    def fold(value):
+        return value.lower().encode('utf-8')
+
+    @classmethod
+    def fold_column(cls, values):
+        """
+        `fold` vectorizado sobre una columna UTF-8: np.char.lower solo pasa a
+        minúsculas ASCII, así que las filas con bytes no ASCII se decodifican y
+        pasan por `fold` para que coincidan con add() y con la consulta
+        """
+        folded = np.char.lower(values)
+        if len(values) and values.dtype.itemsize:
+            wide = np.flatnonzero((values.view(np.uint8).reshape(len(values), -1) >= 0x80).any(axis=1))
+            if len(wide):
+                folded[wide] = [cls.fold(value.decode('utf-8', 'ignore')) for value in values[wide].tolist()]
+        return folded
+
+    @staticmethod
+    def grams(folded):
+        """Códigos enteros de los trigramas de una cadena de bytes"""
+        return {folded[i] << 16 | folded[i + 1] << 8 | folded[i + 2] for i in range(len(folded) - 2)}
+
+    def add(self, row, values):
+        """Indexa una fila nueva; las filas deben llegar en orden creciente"""
+        folded = {name: self.fold(values[name]) for name in self.fields}
+        if self._folded.append(folded) != row:
+            raise ValueError(f"Fila fuera de orden en el índice de texto: {row}")
+        for name, text in folded.items():
+            postings = self._postings[name]
+            for gram in self.grams(text):
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('I')
+                posting.append(row)
+
+    def build(self, columns):
+        """Indexa en bloque columnas ya codificadas en UTF-8 (vectorizado)"""
+        folded = {name: self.fold_column(np.asarray(columns[name], dtype=self.fields[name])) for name in self.fields}
+        start = self._folded.extend(folded).start
+        for name, values in folded.items():
+            width = values.dtype.itemsize
+            view = values.view(np.uint8).reshape(len(values), width).astype(np.uint32)
+            rows = np.arange(start, start + len(values), dtype=np.uint32)
+            grams, gram_rows = [], []
+            for offset in range(width - 2):
+                codes = view[:, offset] << 16 | view[:, offset + 1] << 8 | view[:, offset + 2]
+                valid = (view[:, offset] > 0) & (view[:, offset + 1] > 0) & (view[:, offset + 2] > 0)
+                grams.append(codes[valid])
+                gram_rows.append(rows[valid])
+            keys = np.concatenate(grams).astype(np.uint64) << 32 | np.concatenate(gram_rows)
+            keys.sort()
+            keys = keys[np.r_[True, keys[1:] != keys[:-1]]]
+            gram_codes = (keys >> 32).astype(np.uint32)
+            posting_rows = (keys & 0xFFFFFFFF).astype(np.uint32)
+            bounds = np.flatnonzero(np.diff(gram_codes)) + 1
+            postings = self._postings[name]
+            for gram, chunk in zip(gram_codes[np.r_[0, bounds]], np.split(posting_rows, bounds)):
+                posting = postings.get(int(gram))
+                if posting is None:
+                    posting = postings[int(gram)] = array('I')
+                posting.frombytes(chunk.tobytes())
+
+    def _posting(self, name, gram):
+        posting = self._postings[name].get(gram)
+        if posting is None:
+            return np.zeros(0, dtype=np.uint32)
+        return np.frombuffer(posting, dtype=np.uint32)
+
+    def search(self, text):
+        """Filas cuyo algún campo contiene `text` (sin distinguir mayúsculas)"""
+        needle = self.fold(text)
+        count = len(self._folded)
+        found = np.zeros(count, dtype=bool)
+        for name in self.fields:
+            column = self._folded[name]
+            postings = sorted((self._posting(name, gram) for gram in self.grams(needle)), key=len)
+            if not postings or len(postings[0]) * 4 > count:
+                # Consultas muy cortas o poco selectivas: es más barato recorrer la columna
+                found |= np.char.find(column, needle) >= 0
+                continue
+            candidates = postings[0]
+            for posting in postings[1:]:
+                if not len(candidates):
+                    break
+                pos = np.searchsorted(posting, candidates)
+                pos[pos == len(posting)] = 0
+                candidates = candidates[posting[pos] == candidates]
+            if len(needle) > 3 and len(candidates):
+                candidates = candidates[np.char.find(column[candidates], needle) >= 0]
+            found[candidates] = True
+        return np.flatnonzero(found)
+
+    def similar(self, text, field, min_overlap=0.5):
+        """
+        Búsqueda tolerante a errores: filas que comparten al menos
+        `min_overlap` de los trigramas de la consulta en el campo indicado.
+        """
+        grams = self.grams(self.fold(text))
+        if not grams:
+            return np.zeros(0, dtype=np.int64)
+        postings = [self._posting(field, gram) for gram in grams]
+        hits = np.bincount(np.concatenate(postings).astype(np.int64), minlength=len(self._folded))
+        return np.flatnonzero(hits >= max(1, int(np.ceil(len(grams) * min_overlap))))
+
+
+class SortIndex:
+    """
+    Índice presorteado de una columna numérica para paginación por cursor.
+    Cada entrada es un uint64 compuesto (clave << 32 | fila), así que el orden
+    es estable ante empates y el cursor es simplemente la última entrada vista.
+    Las filas modificadas se marcan y se reubican en bloque en la siguiente consulta.
+    """
+
+    def __init__(self, encode):
+        self._encode = encode
+        self._keys = np.zeros(0, dtype=np.uint64)
+        self._count = 0
+        self._dirty = set()
+
+    def touch(self, row):
+        """Marca una fila cuya clave cambió"""
+        if row < self._count:
+            self._dirty.add(row)
+
+    def composite(self, rows):
+        rows = np.asarray(rows, dtype=np.uint64)
+        return self._encode(rows.astype(np.int64)).astype(np.uint64) << np.uint64(32) | rows
+
+    def keys(self, count):
+        """Entradas ordenadas para las primeras `count` filas"""
+        fresh = count - self._count
+        if fresh < 0 or len(self._dirty) + fresh > max(1024, count // 16):
+            self._keys = np.sort(self.composite(np.arange(count)))
+        elif fresh or self._dirty:
+            changed = np.array(sorted(self._dirty), dtype=np.int64)
+            if len(changed):
+                stale = np.zeros(self._count, dtype=bool)
+                stale[changed] = True
+                rows = (self._keys & ROW_MASK).astype(np.int64)
+                self._keys = self._keys[~stale[rows]]
+            moved = np.sort(self.composite(np.concatenate([changed, np.arange(self._count, count)])))
+            self._keys = np.insert(self._keys, np.searchsorted(self._keys, moved), moved)
+        self._count = count
+        self._dirty = set()
+        return self._keys
+
+
+ROW_MASK = np.uint64(0xFFFFFFFF)
+
+# Mayor timestamp representable en las claves (timestamp << 32 | fila)
+MAX_TIMESTAMP = (1 << 32) - 1
+
+
+def sortable_key(values):
+    """
+    Transforma una columna numérica en uint32 que conserva el orden. Los
+    enteros de hasta 32 bits se desplazan al rango sin signo; los int64 son
+    epochs y, como en las claves de las lecturas, van de 0 a MAX_TIMESTAMP
+    (fuera de ese rango se lanza ValueError en vez de desbordar)
+    """
+    if values.dtype == np.float32:
+        bits = values.view(np.uint32)
+        return np.where(bits & np.uint32(0x80000000), ~bits, bits | np.uint32(0x80000000))
+    if values.dtype.kind == 'i' and values.dtype.itemsize <= 4:
+        return (values.astype(np.int64) + (1 << 31)).astype(np.uint32)
+    if values.dtype.kind == 'i' and len(values) and (values.min() < 0 or values.max() > MAX_TIMESTAMP):
+        raise ValueError(f'Epoch fuera del rango ordenable (0 a {MAX_TIMESTAMP})')
+    return values.astype(np.uint32)
+
+
+# ============================================================================
+# PERSISTENCIA
+# ============================================================================
+
+class Database:
+    """
+    Persistencia del hato en SQLite (modo WAL).
+    Los almacenes en memoria siguen atendiendo las consultas; cada escritura
+    se replica aquí en lote con executemany y al arrancar los almacenes se
+    reconstruyen desde la base. Las lecturas se recorren por clave (keyset),
+    nunca con OFFSET, para que la latencia no dependa del tamaño del histórico.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS animals (
+            id INTEGER PRIMARY KEY,
+            code TEXT NOT NULL UNIQUE,
+            rfid TEXT NOT NULL UNIQUE,
+            name TEXT NOT NULL,
+            breed TEXT NOT NULL,
+            status TEXT NOT NULL,
+            status_name TEXT NOT NULL,
+            status_color TEXT NOT NULL,
+            location TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            notes TEXT NOT NULL DEFAULT '',
+            observations TEXT NOT NULL DEFAULT '',
+            avatar_color TEXT NOT NULL,
+            age_months INTEGER NOT NULL,
+            weight REAL NOT NULL,
+            weight_gain REAL NOT NULL,
+            health_score INTEGER NOT NULL,
+            vaccinated INTEGER NOT NULL,
+            temperature REAL NOT NULL,
+            last_scan INTEGER NOT NULL,
+            birth_date INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS animals_status ON animals (status, id);
+        CREATE INDEX IF NOT EXISTS animals_breed ON animals (breed, id);
+        CREATE INDEX IF NOT EXISTS animals_location ON animals (location, id);
+        CREATE INDEX IF NOT EXISTS animals_owner ON animals (owner, id);
+        CREATE INDEX IF NOT EXISTS animals_weight ON animals (weight, id);
+        CREATE INDEX IF NOT EXISTS animals_age ON animals (age_months, id);
+        CREATE INDEX IF NOT EXISTS animals_last_scan ON animals (last_scan, id);
+        CREATE INDEX IF NOT EXISTS animals_health_score ON animals (health_score, id);
+
+        CREATE TABLE IF NOT EXISTS health_records (
+            id INTEGER PRIMARY KEY,
+            animal_id INTEGER,
+            checkup_date INTEGER NOT NULL,
+            next_checkup INTEGER NOT NULL,
+            weight REAL NOT NULL,
+            temperature REAL NOT NULL,
+            heart_rate INTEGER NOT NULL,
+            respiratory_rate INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            vaccine TEXT NOT NULL,
+            treatment TEXT NOT NULL,
+            veterinarian TEXT NOT NULL,
+            observations TEXT NOT NULL,
+            diagnosis TEXT NOT NULL,
+            cost REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS health_checkup ON health_records (checkup_date, id);
+        CREATE INDEX IF NOT EXISTS health_animal ON health_records (animal_id, checkup_date);
+        CREATE INDEX IF NOT EXISTS health_status ON health_records (status, checkup_date);
+        CREATE INDEX IF NOT EXISTS health_next ON health_records (next_checkup);
+
+        CREATE TABLE IF NOT EXISTS rfid_readings (
+            id INTEGER PRIMARY KEY,
+            timestamp INTEGER NOT NULL,
+            animal_id INTEGER,
+            tag TEXT NOT NULL,
+            reader_id TEXT NOT NULL,
+            location TEXT NOT NULL,
+            event TEXT NOT NULL,
+            status TEXT NOT NULL,
+            signal_strength INTEGER NOT NULL,
+            tag_temperature REAL NOT NULL,
+            battery_level INTEGER NOT NULL,
+            read_count INTEGER NOT NULL,
+            duration_ms INTEGER NOT NULL,
+            distance_meters REAL NOT NULL,
+            notes TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS readings_time ON rfid_readings (timestamp, id);
+        CREATE INDEX IF NOT EXISTS readings_reader ON rfid_readings (reader_id, timestamp, id);
+        CREATE INDEX IF NOT EXISTS readings_location ON rfid_readings (location, timestamp, id);
+        CREATE INDEX IF NOT EXISTS readings_animal ON rfid_readings (animal_id, timestamp);
+        CREATE INDEX IF NOT EXISTS readings_tag ON rfid_readings (tag, timestamp);
+
+        CREATE TABLE IF NOT EXISTS activity_events (
+            id INTEGER PRIMARY KEY,
+            timestamp REAL NOT NULL,
+            type TEXT NOT NULL,
+            message TEXT NOT NULL,
+            user TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS activity_time ON activity_events (timestamp);
+
+        CREATE TABLE IF NOT EXISTS weighings (
+            id INTEGER PRIMARY KEY,
+            animal_id INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            weight REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS weighings_animal ON weighings (animal_id, timestamp);
+    """
+
+    # Columnas de cada tabla en el orden en que los almacenes entregan las filas
+    COLUMNS = {
+        'animals': (
+            'id', 'code', 'rfid', 'name', 'breed', 'status', 'status_name', 'status_color', 'location',
+            'owner', 'notes', 'observations', 'avatar_color', 'age_months', 'weight', 'weight_gain',
+            'health_score', 'vaccinated', 'temperature', 'last_scan', 'birth_date',
+        ),
+        'health_records': (
+            'id', 'animal_id', 'checkup_date', 'next_checkup', 'weight', 'temperature', 'heart_rate',
+            'respiratory_rate', 'status', 'vaccine', 'treatment', 'veterinarian', 'observations',
+            'diagnosis', 'cost',
+        ),
+        'rfid_readings': (
+            'id', 'timestamp', 'animal_id', 'tag', 'reader_id', 'location', 'event', 'status',
+            'signal_strength', 'tag_temperature', 'battery_level', 'read_count', 'duration_ms',
+            'distance_meters', 'notes',
+        ),
+        'activity_events': ('id', 'timestamp', 'type', 'message', 'user'),
+        'weighings': ('id', 'animal_id', 'timestamp', 'weight'),
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        for pragma in ('journal_mode = WAL', 'synchronous = NORMAL', 'temp_store = MEMORY', 'cache_size = -65536'):
+            self._conn.execute(f'PRAGMA {pragma}')
+        with self._lock, self._conn:
+            self._conn.executescript(self.SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def insert(self, table, rows):
+        """Inserta filas (tuplas en el orden de COLUMNS) en una sola transacción"""
+        columns = self.COLUMNS[table]
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        with self._lock, self._conn:
+            self._conn.executemany(sql, rows)
+
+    def update(self, table, columns, rows):
+        """Actualiza `columns` por id; cada fila es (valores..., id)"""
+        sql = f"UPDATE {table} SET {', '.join(f'{name} = ?' for name in columns)} WHERE id = ?"
+        with self._lock, self._conn:
+            self._conn.executemany(sql, rows)
+
+    def add_read_counts(self, rows):
+        """Suma lecturas repetidas a eventos ya guardados; cada fila es (cantidad, id)"""
+        with self._lock, self._conn:
+            self._conn.executemany('UPDATE rfid_readings SET read_count = read_count + ? WHERE id = ?', rows)
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def scan(self, table, where='1', params=(), chunk=50000):
+        """Filas de una tabla en bloques ordenados por id, paginados por clave"""
+        columns = ', '.join(self.COLUMNS[table])
+        last_id = -1
+        while True:
+            rows = self.query(
+                f'SELECT {columns} FROM {table} WHERE id > ? AND ({where}) ORDER BY id LIMIT ?',
+                (last_id, *params, chunk)
+            )
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield rows
+
+    def max_id(self, table):
+        return self.query(f'SELECT COALESCE(MAX(id), 0) FROM {table}')[0][0]
+
+    def is_empty(self):
+        return not self.query('SELECT 1 FROM animals LIMIT 1')
+
+    @contextmanager
+    def bulk_load(self):
+        """
+        Carga masiva: quita los índices secundarios y los vuelve a crear al
+        terminar, que ordena cada índice una sola vez en lugar de fila a fila
+        """
+        with self._lock, self._conn:
+            indexes = self._conn.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+            ).fetchall()
+            for name, _ in indexes:
+                self._conn.execute(f'DROP INDEX {name}')
+        try:
+            yield self
+        finally:
+            with self._lock, self._conn:
+                for _, sql in indexes:
+                    self._conn.execute(sql)
+                self._conn.execute('ANALYZE')
+
+    def clear(self):
+        """Borra todos los datos (se conserva el esquema)"""
+        with self._lock, self._conn:
+            for table in self.COLUMNS:
+                self._conn.execute(f'DELETE FROM {table}')
+
+
+# ============================================================================
+# BUS DE ACTIVIDAD
+# ============================================================================
+
+class ActivityBus:
+    """
+    Bus de difusión en proceso para el feed de actividad.
+    Cada evento recibe un id secuencial y queda en un buffer circular,
+    de modo que un cliente SSE que se reconecta puede retomar desde su
+    último id (Last-Event-ID) sin consultar de nuevo el feed.
+    """
+
+    def __init__(self, replay=500):
+        self._events = deque(maxlen=replay)
+        self._condition = threading.Condition()
+        self.last_id = 0
+        self.db = None
+
+    def publish(self, kind, message, user='Sistema', timestamp=None):
+        """Publica un evento de actividad y despierta a los suscriptores"""
+        self.publish_many([(kind, message, user, timestamp)])
+
+    def publish_many(self, items):
+        with self._condition:
+            events = [self._event(self.last_id + offset, kind, message, user, timestamp or datetime.now())
+                      for offset, (kind, message, user, timestamp) in enumerate(items, 1)]
+            if not events:
+                return
+            if self.db is not None:
+                self.db.insert('activity_events', (
+                    (event['id'], event['timestamp'].timestamp(), event['type'], event['message'], event['user'])
+                    for event in events
+                ))
+            self._events.extend(events)
+            self.last_id = events[-1]['id']
+            self._condition.notify_all()
+
+    def load(self, rows):
+        """Restaura los últimos eventos guardados (id, timestamp, tipo, mensaje, usuario)"""
+        with self._condition:
+            for event_id, timestamp, kind, message, user in rows:
+                self._events.append(self._event(event_id, kind, message, user, datetime.fromtimestamp(timestamp)))
+                self.last_id = max(self.last_id, event_id)
+
+    def sync(self, rows):
+        """Agrega los eventos publicados por otro proceso que aún no se tienen y despierta a los suscriptores"""
+        with self._condition:
+            self.load([row for row in rows if row[0] > self.last_id])
+            self._condition.notify_all()
+
+    def shared_state(self):
+        """Último id y eventos del buffer como filas (id, timestamp, tipo, mensaje, usuario)"""
+        with self._condition:
+            return self.last_id, [(event['id'], event['timestamp'].timestamp(), event['type'], event['message'],
+                                   event['user']) for event in self._events]
+
+    @staticmethod
+    def _event(event_id, kind, message, user, timestamp):
+        activity_type = ACTIVITY_TYPES[kind]
+        return {
+            'id': event_id,
+            'type': kind,
+            'icon': activity_type['icon'],
+            'color': activity_type['color'],
+            'message': message,
+            'timestamp': timestamp,
+            'user': user
+        }
+
+    def since(self, last_id):
+        """
+        Eventos posteriores a `last_id`; None si ya salieron del buffer
+        o si el id no corresponde a este proceso (p. ej. tras un reinicio)
+        """
+        with self._condition:
+            if last_id > self.last_id or (self._events and last_id < self._events[0]['id'] - 1):
+                return None
+            return [event for event in self._events if event['id'] > last_id]
+
+    def wait(self, last_id, timeout=15.0):
+        """Bloquea hasta que haya eventos posteriores a `last_id` o venza el timeout"""
+        with self._condition:
+            if last_id <= self.last_id:
+                self._condition.wait_for(lambda: self.last_id > last_id, timeout=timeout)
+        return self.since(last_id)
+
+    def recent(self, limit=15):
+        """Últimos eventos, del más reciente al más antiguo"""
+        with self._condition:
+            events = list(self._events)[-limit:]
+        return events[::-1]
+
+    @staticmethod
+    def to_dict(event):
+        return {
+            **event,
+            'timestamp': event['timestamp'].isoformat(),
+            'time_ago': time_ago(event['timestamp'])
+        }
+
+
+# ============================================================================
+# ALMACÉN DEL HATO
+# ============================================================================
+
+class HerdAggregates:
+    """
+    Contadores y sumas del hato mantenidos de forma incremental.
+    Cada alta, cambio de estado, pesaje o escaneo los actualiza en O(1),
+    de modo que las estadísticas de las vistas no recorren el hato.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.status = {'success': 0, 'warning': 0, 'danger': 0, 'info': 0}
+        self.weight_sum = 0.0
+        self.health_score_sum = 0
+        self.vaccinated = 0
+        # Último escaneo de cada animal agrupado por minuto y por hora (epoch)
+        self._scan_minutes = {}
+        self._scan_hours = {}
+
+    def _scan_delta(self, last_scan, delta):
+        minute = int(last_scan) // 60
+        for buckets, key in ((self._scan_minutes, minute), (self._scan_hours, minute // 60)):
+            count = buckets.get(key, 0) + delta
+            if count:
+                buckets[key] = count
+            else:
+                buckets.pop(key, None)
+
+    def on_add(self, status_class, weight, health_score, vaccinated, last_scan):
+        self.total += 1
+        self.status[status_class] = self.status.get(status_class, 0) + 1
+        self.weight_sum += float(weight)
+        self.health_score_sum += int(health_score)
+        self.vaccinated += 1 if vaccinated else 0
+        self._scan_delta(last_scan, 1)
+
+    def on_add_many(self, status_classes, weights, health_scores, vaccinated, last_scans):
+        """Equivalente a on_add para un bloque de animales (arrays)"""
+        self.total += len(weights)
+        for status_class, count in zip(*np.unique(status_classes, return_counts=True)):
+            self.status[str(status_class)] = self.status.get(str(status_class), 0) + int(count)
+        self.weight_sum += float(np.sum(weights, dtype=np.float64))
+        self.health_score_sum += int(np.sum(health_scores, dtype=np.int64))
+        self.vaccinated += int(np.count_nonzero(vaccinated))
+        minutes = np.asarray(last_scans, dtype=np.int64) // 60
+        for buckets, keys in ((self._scan_minutes, minutes), (self._scan_hours, minutes // 60)):
+            for key, count in zip(*np.unique(keys, return_counts=True)):
+                buckets[int(key)] = buckets.get(int(key), 0) + int(count)
+
+    def on_status_change(self, old_class, new_class):
+        self.status[old_class] -= 1
+        self.status[new_class] = self.status.get(new_class, 0) + 1
+
+    def on_weight_change(self, old_weight, new_weight):
+        self.weight_sum += float(new_weight) - float(old_weight)
+
+    def on_scan(self, old_scan, new_scan):
+        self._scan_delta(old_scan, -1)
+        self._scan_delta(new_scan, 1)
+
+    def scans_since(self, since, now=None):
+        """
+        Animales con último escaneo posterior a `since`, con precisión de minuto.
+        Suma a lo sumo 60 minutos sueltos y las horas completas hasta `now`.
+        """
+        now = int(time.time() if now is None else now)
+        first_minute = int(since) // 60 + 1
+        first_hour = -(-first_minute // 60)
+        count = sum(self._scan_minutes.get(m, 0) for m in range(first_minute, min(first_hour * 60, now // 60 + 1)))
+        count += sum(self._scan_hours.get(h, 0) for h in range(first_hour, now // 3600 + 1))
+        return count
+
+    def snapshot(self):
+        """Estadísticas del hato listas para plantillas y API"""
+        total = self.total
+        healthy = self.status.get('success', 0)
+        return {
+            'total': total,
+            'healthy': healthy,
+            'warning': self.status.get('warning', 0),
+            'critical': self.status.get('danger', 0),
+            'quarantine': self.status.get('info', 0),
+            'healthy_percentage': round((healthy / total * 100) if total > 0 else 0),
+            'recent_scans_24h': self.scans_since(time.time() - 86400),
+            'avg_weight': round(self.weight_sum / total, 1) if total else 0,
+            'avg_health_score': round(self.health_score_sum / total, 1) if total else 0,
+            'vaccination_rate': round(self.vaccinated / total * 100, 1) if total else 0,
+        }
+
+
+class HerdStore:
+    """
+    Almacén columnar del hato, vivo durante todo el proceso.
+    Las categorías (raza, estado, ubicación, finca) se guardan codificadas
+    por diccionario y las fechas como epoch int64; los dicts que consumen
+    las plantillas y la API solo se construyen al serializar cada fila.
+    """
+
+    SCHEMA = {
+        'id': np.int32,
+        'code': 'S12',
+        'rfid': 'S16',
+        'name': 'S32',
+        'breed': np.uint8,
+        'status': np.uint8,
+        'location': np.uint8,
+        'owner': np.uint8,
+        'notes': np.uint8,
+        'avatar_color': np.uint8,
+        'age_months': np.int16,
+        'weight': np.float32,
+        'weight_gain': np.float32,
+        'health_score': np.uint8,
+        'vaccinated': np.bool_,
+        'temperature': np.float32,
+        'last_scan': np.int64,
+        'birth_date': np.int64,
+    }
+
+    # Columnas categóricas y su diccionario
+    CATEGORIES = ('breed', 'location', 'owner', 'notes', 'avatar_color')
+
+    # Columnas que cambian después del alta; la instantánea compartida las
+    # publica completas en cada versión y agrega al final las demás
+    SHARED_MUTABLE = ('status', 'weight', 'weight_gain', 'temperature', 'last_scan')
+
+    # Columnas por las que se puede ordenar /api/animals
+    SORT_KEYS = ('weight', 'age_months', 'last_scan', 'health_score')
+
+    # Campos de los registros serializados, en orden (proyectables con ?fields=)
+    FIELDS = ('id', 'code', 'rfid', 'name', 'breed', 'age_months', 'age', 'weight', 'weight_gain', 'status',
+              'location', 'last_scan', 'health_score', 'vaccinated', 'temperature', 'birth_date', 'owner',
+              'avatarColor', 'observations', 'notes')
+
+    def __init__(self, animals=None, capacity=1024):
+        self._lock = threading.RLock()
+        self._table = ColumnTable(self.SCHEMA, capacity)
+        self._dicts = {name: Dictionary() for name in self.CATEGORIES}
+        # El estado se codifica por su clase; se conserva el dict completo para serializar
+        self._status = Dictionary()
+        self._status_info = []
+        self._by_code = KeyIndex(self._table, 'code')
+        self._by_rfid = KeyIndex(self._table, 'rfid')
+        self._bitmaps = {name: BitmapIndex(capacity) for name in ('status', 'breed', 'location')}
+        self._text = TrigramIndex({'code': 'S12', 'rfid': 'S16', 'name': 'S32'}, capacity)
+        self._sorted = {
+            name: SortIndex(lambda rows, name=name: sortable_key(self._table[name][rows]))
+            for name in self.SORT_KEYS
+        }
+        self._observations = {}
+        self.aggregates = HerdAggregates()
+        self.readings = ReadingStore(self)
+        self.health = HealthStore(self)
+        self.weights = WeightSeries(self)
+        self.activity = ActivityBus()
+        self.vitals = VitalsMonitor(self)
+        self.db = None
+        for animal in animals or []:
+            self.add(animal)
+
+    @classmethod
+    def from_generator(cls, generator, count=155, health=None, readings=None, days=7, weighings=None):
+        """
+        Construye el almacén con datos simulados (BatchGenerator); los
+        registros de salud, lecturas y pesajes crecen con el tamaño del hato.
+        """
+        health = max(120, count * 120 // 155) if health is None else health
+        readings = max(200, count * 200 // 155) if readings is None else readings
+        weighings = count * 24 if weighings is None else weighings
+        store = cls(capacity=count)
+        animals = generator.animals(count)
+        store.add_batch(animals)
+        for batch in generator.health_records(health, animals):
+            store.health.add_batch(batch)
+        for batch in generator.rfid_readings(readings, animals, days=days):
+            store.readings.add_batch(batch)
+        for batch in generator.weighings(weighings, animals):
+            store.weights.add_batch(batch)
+        store.activity.publish_many(generator.activity(15, animals))
+        return store
+
+    @classmethod
+    def from_database(cls, db, since=0):
+        """
+        Reconstruye el almacén desde la base: hato, registros de salud,
+        pesajes, lecturas desde `since` (epoch) y los últimos eventos de actividad
+        """
+        store = cls()
+        for rows in db.scan('animals'):
+            store.add_batch(cls._batch_from_db(rows))
+        for rows in db.scan('health_records'):
+            store.health.load(rows)
+        store.health.next_id = db.max_id('health_records') + 1
+        for rows in db.scan('weighings'):
+            store.weights.load(rows)
+        store.weights.next_id = db.max_id('weighings') + 1
+        for rows in db.scan('rfid_readings', 'timestamp >= ?', (int(since),)):
+            store.readings.load(rows)
+        store.readings.next_id = store.readings.archived_below = db.max_id('rfid_readings') + 1
+        store.readings.horizon = int(since)
+        events = db.query(f"SELECT {', '.join(Database.COLUMNS['activity_events'])} FROM activity_events "
+                          f"ORDER BY id DESC LIMIT ?", (store.activity._events.maxlen,))
+        store.activity.load(events[::-1])
+        return store
+
+    @classmethod
+    def open(cls, db, generator, count=155, memory_days=90):
+        """Carga el hato guardado; si la base está vacía la siembra con datos simulados"""
+        if db.is_empty():
+            store = cls.from_generator(generator, count)
+            store.save(db)
+        else:
+            store = cls.from_database(db, since=time.time() - memory_days * 86400)
+        store.attach(db)
+        # Lo cargado solo forma las líneas base; desde aquí se emiten alertas
+        store.vitals.live = True
+        return store
+
+    def save(self, db):
+        """Escribe el contenido completo del almacén en la base"""
+        count = len(self._table)
+        for offset in range(0, count, 5000):
+            db.insert('animals', self._db_rows(range(offset, min(offset + 5000, count))))
+        self.health.save(db)
+        self.weights.save(db)
+        self.readings.save(db)
+        db.insert('activity_events', (
+            (event['id'], event['timestamp'].timestamp(), event['type'], event['message'], event['user'])
+            for event in self.activity.recent(self.activity._events.maxlen)[::-1]
+        ))
+
+    def attach(self, db):
+        """A partir de aquí cada escritura del hato, lecturas, salud, pesajes y actividad se replica en `db`"""
+        self.db = self.readings.db = self.health.db = self.weights.db = self.activity.db = db
+
+    def shared_state(self):
+        """
+        Columnas (copia de las modificables), versión y estado auxiliar
+        (diccionarios, estados y observaciones) para la instantánea compartida
+        """
+        with self._lock:
+            columns = {name: self._table[name].copy() if name in self.SHARED_MUTABLE else self._table[name]
+                       for name in self.SCHEMA}
+            state = {
+                'dictionaries': {name: list(dictionary.values) for name, dictionary in self._dicts.items()},
+                'statuses': [dict(info) for info in self._status_info],
+                'observations': dict(self._observations),
+            }
+            return columns, self._table.version, state
+
+    def map_shared(self, columns, size, version, state):
+        """
+        Adopta una versión de la instantánea compartida. Las filas nuevas se
+        indexan en bloque; de las existentes solo se aplican a bitmaps, orden y
+        agregados los cambios de estado, peso y último escaneo.
+        """
+        with self._lock:
+            t = self._table
+            start = len(t)
+            previous = {name: t[name] for name in ('status', 'weight', 'last_scan')}
+            if state is not None:
+                self._dicts = {name: Dictionary(values) for name, values in state['dictionaries'].items()}
+                self._status = Dictionary(info['class'] for info in state['statuses'])
+                self._status_info = state['statuses']
+                self._observations = {int(row): text for row, text in state['observations'].items()}
+            t.map(columns, size, version)
+            for row in np.flatnonzero(previous['status'] != t['status'][:start]).tolist():
+                old_code, new_code = previous['status'][row], t['status'][row]
+                self._bitmaps['status'].move(row, old_code, new_code)
+                self.aggregates.on_status_change(self._status.decode(old_code), self._status.decode(new_code))
+            for row in np.flatnonzero(previous['weight'] != t['weight'][:start]).tolist():
+                self._sorted['weight'].touch(row)
+                self.aggregates.on_weight_change(previous['weight'][row], t['weight'][row])
+            for row in np.flatnonzero(previous['last_scan'] != t['last_scan'][:start]).tolist():
+                self._sorted['last_scan'].touch(row)
+                self.aggregates.on_scan(previous['last_scan'][row], t['last_scan'][row])
+            if size > start:
+                block = slice(start, size)
+                self._by_code.rebuild()
+                self._by_rfid.rebuild()
+                for name, bitmap in self._bitmaps.items():
+                    bitmap.build(t[name])
+                self._text.build({name: t[name][block] for name in ('code', 'rfid', 'name')})
+                self.aggregates.on_add_many(
+                    np.array([info['class'] for info in self._status_info])[t['status'][block]], t['weight'][block],
+                    t['health_score'][block], t['vaccinated'][block], t['last_scan'][block]
+                )
+
+    def __len__(self):
+        return len(self._table)
+
+    def __iter__(self):
+        return (self.to_dict(row) for row in range(len(self._table)))
+
+    def column(self, name):
+        """Vista numpy de una columna (solo lectura por convención)"""
+        return self._table[name]
+
+    @property
+    def version(self):
+        """Cambia con cualquier escritura en el hato, las lecturas, los registros de salud o los pesajes"""
+        return (self._table.version, self.readings.version, self.health.version, self.weights.version)
+
+    def row_versions(self, rows):
+        return self._table.row_versions(rows).tolist()
+
+    def animal_versions(self, rows):
+        """Versión de las filas del hato referenciadas (-1 = animal desconocido)"""
+        rows = np.asarray(rows)
+        return np.where(rows >= 0, self._table.row_versions(np.maximum(rows, 0)), 0)
+
+    def nbytes(self):
+        return self._table.nbytes()
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+
+    def _encode_status(self, status):
+        code = self._status.lookup(status['class'])
+        if code is None:
+            code = self._status.encode(status['class'])
+            self._status_info.append(dict(status))
+        return code
+
+    def add(self, animal):
+        """Registra un animal (dict del generador) y actualiza los índices"""
+        code = _to_bytes(animal['code'], 12)
+        rfid = _to_bytes(animal['rfid'], 16)
+        with self._lock:
+            if len(self._table) and animal['id'] <= int(self._table['id'][-1]):
+                raise ValueError(f"Animal duplicado o fuera de orden: {animal['id']}")
+            row = self._table.append({
+                'id': animal['id'],
+                'code': code,
+                'rfid': rfid,
+                'name': _to_bytes(animal['name'], 32),
+                'breed': self._dicts['breed'].encode(animal['breed']),
+                'status': self._encode_status(animal['status']),
+                'location': self._dicts['location'].encode(animal['location']),
+                'owner': self._dicts['owner'].encode(animal['owner']),
+                'notes': self._dicts['notes'].encode(animal.get('notes', '')),
+                'avatar_color': self._dicts['avatar_color'].encode(animal['avatarColor']),
+                'age_months': animal['age_months'],
+                'weight': animal['weight'],
+                'weight_gain': animal['weight_gain'],
+                'health_score': animal['health_score'],
+                'vaccinated': animal['vaccinated'],
+                'temperature': animal['temperature'],
+                'last_scan': _to_epoch(animal['last_scan']),
+                'birth_date': _to_epoch(animal['birth_date']),
+            })
+            self._by_code.add(code, row)
+            self._by_rfid.add(rfid, row)
+            for name, bitmap in self._bitmaps.items():
+                bitmap.add(self._table[name][row], row)
+            self._text.add(row, animal)
+            if animal.get('observations'):
+                self._observations[row] = animal['observations']
+            t = self._table
+            self.aggregates.on_add(
+                animal['status']['class'], t['weight'][row], t['health_score'][row],
+                t['vaccinated'][row], t['last_scan'][row]
+            )
+            if self.db is not None:
+                self.db.insert('animals', self._db_rows([row]))
+        self.vitals.observe([row], [t['last_scan'][row]], {'temperature': [t['temperature'][row]]})
+        return row
+
+    def add_batch(self, batch):
+        """
+        Alta en bloque de animales por columnas (BatchGenerator). Los índices
+        se reconstruyen una vez por bloque en lugar de actualizarse por fila.
+        """
+        statuses, status = batch['status']
+        columns = {name: batch[name] for name in self.SCHEMA if name not in self.CATEGORIES and name != 'status'}
+        for name in self.CATEGORIES:
+            columns[name] = _recode(self._dicts[name], batch[name])
+        ids = np.asarray(batch['id'])
+        with self._lock:
+            if (len(ids) > 1 and np.any(np.diff(ids) <= 0)) or (len(self._table) and ids[0] <= self._table['id'][-1]):
+                raise ValueError('Ids de animales duplicados o fuera de orden')
+            for name in ('code', 'rfid'):
+                merged = np.concatenate([self._table[name], np.asarray(columns[name], dtype=self.SCHEMA[name])])
+                if len(np.unique(merged)) != len(merged):
+                    raise ValueError(f"Clave duplicada en {name}")
+            columns['status'] = np.array([self._encode_status(value) for value in statuses], dtype=np.uint8)[status]
+            rows = self._table.extend(columns)
+            self._by_code.rebuild()
+            self._by_rfid.rebuild()
+            for name, bitmap in self._bitmaps.items():
+                bitmap.build(self._table[name])
+            self._text.build({name: columns[name] for name in ('code', 'rfid', 'name')})
+            for row, observations in zip(rows, batch.get('observations', ())):
+                if observations:
+                    self._observations[row] = observations
+            self.aggregates.on_add_many(
+                np.array([value['class'] for value in statuses])[status], columns['weight'],
+                columns['health_score'], columns['vaccinated'], columns['last_scan']
+            )
+            if self.db is not None:
+                for offset in range(rows.start, rows.stop, 5000):
+                    self.db.insert('animals', self._db_rows(range(offset, min(offset + 5000, rows.stop))))
+        self.vitals.observe(np.arange(rows.start, rows.stop), columns['last_scan'], {'temperature': columns['temperature']})
+        return rows
+
+    def _require_row(self, animal_id):
+        row = self.row_of(animal_id)
+        if row is None:
+            raise KeyError(f"Animal no encontrado: {animal_id}")
+        return row
+
+    def update_status(self, animal_id, status):
+        """Cambia el estado sanitario de un animal"""
+        with self._lock:
+            row = self._require_row(animal_id)
+            old_code = self._table['status'][row]
+            new_code = self._encode_status(status)
+            self._table.set('status', row, new_code)
+            self._bitmaps['status'].move(row, old_code, new_code)
+            self.aggregates.on_status_change(self._status.decode(old_code), status['class'])
+            if self.db is not None:
+                self.db.update('animals', ('status', 'status_name', 'status_color'),
+                               [(status['class'], status['name'], status.get('color', ''), int(animal_id))])
+        if status['class'] != 'success':
+            self.activity.publish('health', ACTIVITY_TYPES['health']['template'].format(self.brief(row)['name']))
+
+    def reweigh(self, animal_id, weight):
+        """Registra un nuevo pesaje; la ganancia se calcula contra el peso anterior"""
+        with self._lock:
+            row = self._require_row(animal_id)
+            old_weight = float(self._table['weight'][row])
+            self._table.set('weight', row, weight)
+            self._table.set('weight_gain', row, round(weight - old_weight, 1))
+            self._sorted['weight'].touch(row)
+            self.aggregates.on_weight_change(old_weight, weight)
+            if self.db is not None:
+                self.db.update('animals', ('weight', 'weight_gain'),
+                               [(float(weight), round(weight - old_weight, 1), int(animal_id))])
+        self.activity.publish('weight', ACTIVITY_TYPES['weight']['template'].format(
+            self.brief(row)['name'], _to_number(weight)))
+
+    def record_weighings(self, rows, timestamps, weights):
+        """Registra pesajes de báscula; el peso del animal sigue a su pesaje más reciente"""
+        for row in self.weights.append({'animal': rows, 'timestamp': timestamps, 'weight': weights}):
+            self.reweigh(int(self._table['id'][row]), self.weights.latest(row))
+
+    def record_vitals(self, rows, timestamps, values):
+        """
+        Mediciones de sensores (filas del hato, epoch y signo → valores): se
+        evalúan en el monitor y la temperatura del animal pasa a la más reciente
+        """
+        alerts = self.vitals.observe(rows, timestamps, values)
+        latest = {}
+        for row, timestamp, temperature in zip(rows, timestamps, values.get('temperature', ())):
+            if row < 0 or np.isnan(temperature):
+                continue
+            if row not in latest or timestamp >= latest[row][0]:
+                latest[row] = (timestamp, temperature)
+        if latest:
+            with self._lock:
+                for row, (_, temperature) in latest.items():
+                    self._table.set('temperature', row, temperature)
+                if self.db is not None:
+                    self.db.update('animals', ('temperature',), [(round(float(temperature), 1), int(self._table['id'][row]))
+                                                                 for row, (_, temperature) in latest.items()])
+        return alerts
+
+    def record_scan(self, animal_id, when=None):
+        """Actualiza la fecha del último escaneo RFID de un animal"""
+        self.record_scans([self._require_row(animal_id)], [int(time.time() if when is None else _to_epoch(when))])
+
+    def record_scans(self, rows, timestamps):
+        """Actualiza el último escaneo de varias filas (-1 = arete desconocido)"""
+        with self._lock:
+            changed = {}
+            for row, scanned in zip(rows, timestamps):
+                if row >= 0 and self._record_scan(row, int(scanned)):
+                    changed[row] = int(scanned)
+            if changed and self.db is not None:
+                ids = self._table['id']
+                self.db.update('animals', ('last_scan',), [(scanned, int(ids[row])) for row, scanned in changed.items()])
+
+    def _record_scan(self, row, scanned):
+        old_scan = int(self._table['last_scan'][row])
+        if scanned <= old_scan:
+            return False
+        self._table.set('last_scan', row, scanned)
+        self._sorted['last_scan'].touch(row)
+        self.aggregates.on_scan(old_scan, scanned)
+        return True
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    def row_of(self, animal_id):
+        """Fila de un id; los ids se registran en orden creciente"""
+        ids = self._table['id']
+        pos = int(np.searchsorted(ids, animal_id))
+        if pos < len(ids) and ids[pos] == animal_id:
+            return pos
+        return None
+
+    def rows_of(self, animal_ids):
+        """Filas de varios ids (None o desconocido = -1)"""
+        ids = self._table['id']
+        if isinstance(animal_ids, np.ndarray):
+            wanted = animal_ids.astype(np.int64)
+        else:
+            wanted = np.array([-1 if animal_id is None else animal_id for animal_id in animal_ids], dtype=np.int64)
+        if not len(ids):
+            return np.full(len(wanted), -1, dtype=np.int32)
+        pos = np.minimum(np.searchsorted(ids, wanted), len(ids) - 1)
+        return np.where(ids[pos] == wanted, pos, -1).astype(np.int32)
+
+    def get(self, animal_id):
+        """Busca un animal por su id numérico"""
+        row = self.row_of(animal_id)
+        return None if row is None else self.to_dict(row)
+
+    def get_by_code(self, code):
+        """Busca un animal por su código (ej. AG0042)"""
+        row = self._by_code.find(_to_bytes(code, 12, strict=False))
+        return None if row is None else self.to_dict(row)
+
+    def row_of_code(self, code):
+        """Fila del animal con ese código (ej. AG0042), o None"""
+        return self._by_code.find(_to_bytes(code, 12, strict=False))
+
+    def row_of_rfid(self, rfid):
+        """Fila del animal con ese arete, o -1 si no está registrado"""
+        row = self._by_rfid.find(_to_bytes(rfid, 16, strict=False))
+        return -1 if row is None else row
+
+    def get_by_rfid(self, rfid):
+        """Busca un animal por el código de su arete RFID"""
+        row = self._by_rfid.find(_to_bytes(rfid, 16, strict=False))
+        return None if row is None else self.to_dict(row)
+
+    def status_counts(self):
+        """Conteo de animales por clase de estado"""
+        return dict(self.aggregates.status)
+
+    def status_distribution(self):
+        """Conteo de animales por nombre de estado, en orden de aparición"""
+        counts = np.bincount(self._table['status'], minlength=len(self._status))
+        return {self._status_info[code]['name']: int(count) for code, count in enumerate(counts)}
+
+    def category_codes(self, name, predicate):
+        """Códigos de una columna categórica cuyo valor cumple el predicado"""
+        if name == 'status':
+            return [code for code, value in enumerate(self._status.values) if predicate(value)]
+        return [code for code, value in enumerate(self._dicts[name].values) if predicate(value)]
+
+    def category_values(self, name, codes):
+        """Valores de una columna categórica a partir de sus códigos"""
+        return [self._dicts[name].decode(code) for code in codes]
+
+    def labels(self, name):
+        """Valores de una columna categórica en orden de código (el estado por su clase)"""
+        return list((self._status if name == 'status' else self._dicts[name]).values)
+
+    def category_code(self, name, value):
+        """Código de un valor categórico, o None si ningún animal lo tiene"""
+        return self._dicts[name].lookup(value)
+
+    def owned_by(self, rows, owners):
+        """Máscara de las filas (-1 = animal desconocido) cuyo propietario está en `owners`"""
+        rows = np.asarray(rows)
+        return (rows >= 0) & np.isin(self._table['owner'][np.maximum(rows, 0)], owners)
+
+    def export_rows(self, start=None, end=None, owners=None, chunk=5000):
+        """Filas del hato por bloques, filtradas por último escaneo y propietario"""
+        count = len(self._table)
+        for offset in range(0, count, chunk):
+            rows = np.arange(offset, min(offset + chunk, count))
+            last_scan = self._table['last_scan'][rows]
+            keep = np.ones(len(rows), dtype=bool)
+            if start is not None:
+                keep &= last_scan >= start
+            if end is not None:
+                keep &= last_scan < end
+            if owners is not None:
+                keep &= np.isin(self._table['owner'][rows], owners)
+            if keep.any():
+                yield rows[keep]
+
+    def search(self, text='', status=None, breed=None, location=None, fuzzy=False):
+        """
+        Filas que cumplen la búsqueda de texto y los filtros, en orden de registro.
+        El texto se resuelve con el índice de trigramas (nombre, RFID, código)
+        y los bitmaps de raza; los filtros se intersectan sobre los bitmaps.
+        """
+        count = len(self._table)
+        selected = None
+        filters = (
+            ('status', status and (lambda value: value == status)),
+            ('breed', breed and (lambda value: value == breed)),
+            ('location', location and (lambda value: location.lower() in value.lower())),
+        )
+        for name, predicate in filters:
+            if predicate:
+                bitmap = self._bitmaps[name].union(self.category_codes(name, predicate))
+                selected = bitmap if selected is None else selected & bitmap
+        mask = np.ones(count, dtype=bool) if selected is None else unpack_rows(selected, count)
+        if text:
+            text_lower = text.lower()
+            matched = unpack_rows(
+                self._bitmaps['breed'].union(self.category_codes('breed', lambda b: text_lower in b.lower())), count
+            )
+            rows = self._text.search(text)
+            if fuzzy and not len(rows) and not matched.any():
+                rows = self._text.similar(text, 'name')
+            matched[rows] = True
+            mask &= matched
+        return np.flatnonzero(mask)
+
+    def page(self, rows, sort=None, descending=False, after=None, limit=15, offset=0):
+        """
+        Página de `rows` (resultado de search) ordenada por `sort` o por registro.
+        `after` es la última entrada de la página anterior (cursor): se ubica con
+        búsqueda binaria sobre el índice presorteado, así que el costo no depende
+        de la profundidad de la página. Retorna (filas, siguiente cursor).
+        """
+        selected = None
+        if sort is None:
+            keys = np.asarray(rows, dtype=np.uint64)
+        else:
+            index = self._sorted[sort]
+            with self._lock:
+                keys = index.keys(len(self._table))
+            if len(rows) * 8 < len(keys):
+                # Resultado pequeño: se ordenan solo las filas seleccionadas
+                keys = np.sort(index.composite(rows))
+            else:
+                selected = np.zeros(len(keys), dtype=bool)
+                selected[rows] = True
+        if after is None:
+            position = 0
+        elif descending:
+            position = len(keys) - int(np.searchsorted(keys, np.uint64(after), side='left'))
+        else:
+            position = int(np.searchsorted(keys, np.uint64(after), side='right'))
+        if descending:
+            keys = keys[::-1]
+        wanted = offset + limit + 1
+        found = []
+        while len(found) < wanted and position < len(keys):
+            chunk = keys[position:position + max(wanted * 4, 256)]
+            position += len(chunk)
+            if selected is not None:
+                chunk = chunk[selected[(chunk & ROW_MASK).astype(np.int64)]]
+            found.extend(chunk[:wanted - len(found)].tolist())
+        more = len(found) == wanted
+        found = found[offset:offset + limit]
+        next_cursor = found[-1] if more and found else None
+        if sort is not None:
+            found = [key & 0xFFFFFFFF for key in found]
+        return found, next_cursor
+
+    def sample(self, count):
+        """Muestra aleatoria de animales serializados"""
+        rows = random.sample(range(len(self._table)), min(count, len(self._table)))
+        return [self.to_dict(row) for row in rows]
+
+    def activity_feed(self, limit=15):
+        """Actividad más reciente del hato"""
+        return [ActivityBus.to_dict(event) for event in self.activity.recent(limit)]
+
+    # ------------------------------------------------------------------
+    # Serialización
+    # ------------------------------------------------------------------
+
+    def to_dict(self, row):
+        """Construye el dict de un animal con el formato que esperan plantillas y API"""
+        return self.to_dicts([row])[0]
+
+    def values(self, name, rows):
+        """Valores serializados del campo `name` (de FIELDS) para las filas `rows`, leyendo solo sus columnas"""
+        t = self._table
+        rows = np.asarray(rows, dtype=np.int64)
+        if name in ('breed', 'location', 'owner', 'notes', 'avatarColor'):
+            column = 'avatar_color' if name == 'avatarColor' else name
+            return [self._dicts[column].decode(code) for code in t[column][rows].tolist()]
+        if name in ('code', 'rfid', 'name'):
+            return [value.decode('utf-8') for value in t[name][rows].tolist()]
+        if name in ('id', 'age_months', 'health_score'):
+            return t[name][rows].tolist()
+        if name == 'age':
+            return (t['age_months'][rows] // 12).tolist()
+        if name == 'weight':
+            return [_to_number(value) for value in t['weight'][rows].tolist()]
+        if name in ('weight_gain', 'temperature'):
+            return [round(value, 1) for value in t[name][rows].tolist()]
+        if name == 'status':
+            return [dict(self._status_info[code]) for code in t['status'][rows].tolist()]
+        if name in ('last_scan', 'birth_date'):
+            return [datetime.fromtimestamp(value).isoformat() for value in t[name][rows].tolist()]
+        if name == 'vaccinated':
+            return t['vaccinated'][rows].tolist()
+        if name == 'observations':
+            return [self._observations.get(row, '') for row in rows.tolist()]
+        raise KeyError(name)
+
+    def joined(self, animals, name, default):
+        """Campo `name` del animal de cada registro; `default` en los registros sin animal (fila -1)"""
+        animals = np.asarray(animals, dtype=np.int64)
+        known = animals >= 0
+        if known.all():
+            return self.values(name, animals)
+        result = [default] * len(animals)
+        for index, value in zip(np.flatnonzero(known).tolist(), self.values(name, animals[known])):
+            result[index] = value
+        return result
+
+    def brief(self, row):
+        """Datos del animal que acompañan a lecturas y registros"""
+        t = self._table
+        return {
+            'id': int(t['id'][row]),
+            'code': t['code'][row].decode('utf-8'),
+            'rfid': t['rfid'][row].decode('utf-8'),
+            'name': t['name'][row].decode('utf-8'),
+            'breed': self._dicts['breed'].decode(t['breed'][row]),
+            'weight': _to_number(t['weight'][row]),
+            'status': dict(self._status_info[t['status'][row]]),
+            'avatarColor': self._dicts['avatar_color'].decode(t['avatar_color'][row]),
+        }
+
+    def to_dicts(self, rows=None, fields=None):
+        """Serializa las filas indicadas (o todo el hato); con `fields` solo lee y formatea esos campos"""
+        rows = np.arange(len(self._table)) if rows is None else np.asarray(rows, dtype=np.int64)
+        names = self.FIELDS if fields is None else [name for name in self.FIELDS if name in fields]
+        return make_records(names, [self.values(name, rows) for name in names], len(rows))
+
+    @classmethod
+    def _batch_from_db(cls, rows):
+        """Bloque por columnas (formato de add_batch) a partir de filas de `animals`"""
+        columns = dict(zip(Database.COLUMNS['animals'], zip(*rows)))
+        batch = {name: np.asarray(columns[name], dtype=cls.SCHEMA[name]) for name in (
+            'id', 'age_months', 'weight', 'weight_gain', 'health_score', 'vaccinated', 'temperature',
+            'last_scan', 'birth_date')}
+        for name in ('code', 'rfid', 'name'):
+            batch[name] = np.array([_to_bytes(value, int(cls.SCHEMA[name][1:])) for value in columns[name]],
+                                   dtype=cls.SCHEMA[name])
+        for name in cls.CATEGORIES:
+            catalog, indices = np.unique(np.array(columns[name], dtype=object), return_inverse=True)
+            batch[name] = (catalog.tolist(), indices)
+        statuses = list(zip(columns['status'], columns['status_name'], columns['status_color']))
+        catalog, indices = np.unique(np.array(statuses, dtype=object).astype(str), axis=0, return_inverse=True)
+        batch['status'] = ([{'name': name, 'class': status, 'color': color} for status, name, color in catalog.tolist()],
+                           indices.reshape(-1))
+        batch['observations'] = columns['observations']
+        return batch
+
+    def _db_rows(self, rows):
+        """Filas del hato como tuplas de la tabla `animals`"""
+        t = self._table
+        for row in rows:
+            status = self._status_info[t['status'][row]]
+            yield (
+                int(t['id'][row]), t['code'][row].decode('utf-8'), t['rfid'][row].decode('utf-8'),
+                t['name'][row].decode('utf-8'), self._dicts['breed'].decode(t['breed'][row]),
+                status['class'], status['name'], status.get('color', ''),
+                self._dicts['location'].decode(t['location'][row]), self._dicts['owner'].decode(t['owner'][row]),
+                self._dicts['notes'].decode(t['notes'][row]), self._observations.get(row, ''),
+                self._dicts['avatar_color'].decode(t['avatar_color'][row]), int(t['age_months'][row]),
+                float(t['weight'][row]), round(float(t['weight_gain'][row]), 1), int(t['health_score'][row]),
+                int(t['vaccinated'][row]), round(float(t['temperature'][row]), 1), int(t['last_scan'][row]),
+                int(t['birth_date'][row]),
+            )
+
+
+def _to_bytes(value, width, strict=True):
+    """Codifica texto en UTF-8 validando el ancho fijo de la columna"""
+    encoded = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+    if strict and len(encoded) > width:
+        raise ValueError(f"Valor demasiado largo ({len(encoded)} > {width} bytes): {value!r}")
+    return encoded
+
+
+def _recode(dictionary, column):
+    """Códigos del diccionario para una columna categórica dada como (catálogo, índices)"""
+    catalog, indices = column
+    return np.array([dictionary.encode(value) for value in catalog], dtype=np.uint8)[indices]
+
+
+def _to_epoch(value):
+    """Convierte datetime, cadena ISO o número a segundos epoch"""
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp())
+
+
+def _to_number(value):
+    """Float de numpy a int cuando no tiene decimales"""
+    value = round(float(value), 1)
+    return int(value) if value.is_integer() else value
+
+def make_records(names, columns, count):
+    """Dicts de `count` registros a partir de columnas ya serializadas, una por campo de `names`"""
+    if not names:
+        return [{} for _ in range(count)]
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+# ============================================================================
+# LECTURAS RFID
+# ============================================================================
+
+class DayPartition:
+    """
+    Lecturas de un día: claves (timestamp << 32 | fila) ordenadas y conteo
+    por hora desde la medianoche local (25 horas para los días de cambio
+    de horario)
+    """
+
+    def __init__(self, day):
+        self.day = day
+        self.start = local_midnight(day)
+        self._keys = array('Q')
+        self._sorted = True
+        self.hour_counts = np.zeros(25, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, keys, hours):
+        if len(self._keys) and int(keys.min()) < self._keys[-1]:
+            self._sorted = False
+        elif len(keys) > 1 and np.any(keys[1:] < keys[:-1]):
+            self._sorted = False
+        self._keys.frombytes(keys.astype(np.uint64).tobytes())
+        np.add.at(self.hour_counts, hours, 1)
+
+    def keys(self):
+        """Claves ordenadas; las lecturas tardías se ordenan al consultar"""
+        if not self._sorted:
+            self._keys = array('Q', np.sort(np.frombuffer(self._keys, dtype=np.uint64)).tobytes())
+            self._sorted = True
+        return np.frombuffer(self._keys, dtype=np.uint64)
+
+
+class TimePartitions:
+    """
+    Índice temporal de las lecturas particionado por día (hora local).
+    Los rangos se resuelven con búsqueda binaria dentro de cada partición
+    y los conteos por hora/día se leen de los contadores precalculados.
+    """
+
+    def __init__(self):
+        self._partitions = {}
+        self._days = []
+
+    def day_of(self, timestamp):
+        """Clave de partición (días desde epoch en hora local)"""
+        return local_day(timestamp)
+
+    def day_start(self, day):
+        """Epoch del inicio del día local `day`"""
+        return local_midnight(day)
+
+    def add(self, timestamps, rows):
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        days = local_days(timestamps)
+        keys = timestamps.astype(np.uint64) << np.uint64(32) | np.asarray(rows, dtype=np.uint64)
+        for day in np.unique(days):
+            selected = days == day
+            partition = self._partitions.get(int(day))
+            if partition is None:
+                partition = self._partitions[int(day)] = DayPartition(int(day))
+                bisect.insort(self._days, int(day))
+            partition.add(keys[selected], (timestamps[selected] - partition.start) // 3600)
+
+    def count_between(self, start, end):
+        """Lecturas con start <= timestamp < end, desde los conteos por hora"""
+        start, end = int(start), int(end)
+        first, last = hour_start(start), hour_start(end)
+        total = 0
+        lo = bisect.bisect_left(self._days, local_day(first))
+        hi = bisect.bisect_right(self._days, local_day(last))
+        for day in self._days[lo:hi]:
+            partition = self._partitions[day]
+            low = max((first - partition.start) // 3600, 0)
+            high = max(min((last - partition.start) // 3600, len(partition.hour_counts)), 0)
+            total += int(partition.hour_counts[low:high].sum())
+        # Horas incompletas en los extremos: búsqueda binaria en su partición
+        total -= self._count_keys(first, start)
+        total += self._count_keys(last, end)
+        return total
+
+    def _count_keys(self, start, end):
+        if end <= start:
+            return 0
+        partition = self._partitions.get(self.day_of(start))
+        if partition is None:
+            return 0
+        keys = partition.keys()
+        return int(np.searchsorted(keys, np.uint64(end) << np.uint64(32)) -
+                   np.searchsorted(keys, np.uint64(start) << np.uint64(32)))
+
+    def daily_counts(self, first_day, last_day):
+        """Total de lecturas por día local en [first_day, last_day]"""
+        return [int(self._partitions[day].hour_counts.sum()) if day in self._partitions else 0
+                for day in range(first_day, last_day + 1)]
+
+    def days_between(self, start, end):
+        """Particiones que cubren [start, end), en orden cronológico"""
+        lo = bisect.bisect_left(self._days, self.day_of(start))
+        hi = bisect.bisect_right(self._days, self.day_of(max(int(end) - 1, int(start))))
+        return self._days[lo:hi]
+
+    def scan(self, start, end, before=None):
+        """
+        Recorre las claves en [start, end) de la más reciente a la más antigua,
+        por bloques de una partición; `before` excluye las claves >= before.
+        """
+        low = np.uint64(min(max(int(start), 0), MAX_TIMESTAMP)) << np.uint64(32)
+        high = np.uint64(min(max(int(end), 0), MAX_TIMESTAMP)) << np.uint64(32)
+        if before is not None:
+            high = min(high, np.uint64(before))
+        for day in reversed(self.days_between(start, end)):
+            keys = self._partitions[day].keys()
+            block = keys[np.searchsorted(keys, low):np.searchsorted(keys, high)]
+            if len(block):
+                yield block[::-1]
+
+    def slice(self, day, low, high, limit):
+        """Copia de hasta `limit` claves de la partición con low <= clave < high"""
+        keys = self._partitions[day].keys()
+        first = int(np.searchsorted(keys, low))
+        last = min(int(np.searchsorted(keys, high)), first + limit)
+        return keys[first:last].copy()
+
+
+class OccupancyIndex:
+    """
+    Ocupación en vivo derivada de las lecturas: de cada animal la fila de su
+    lectura más reciente (último avistamiento) y por ubicación las cabezas
+    cuyo último avistamiento fue allí, más el total de lecturas. Cada bloque
+    nuevo se aplica en proporción a su tamaño, sin recorrer el historial.
+    Las lecturas con error (`ignore`) no cambian la posición del animal.
+    """
+
+    def __init__(self, table, ignore=None):
+        self._table = table
+        self._ignore = ignore
+        self._last = np.full(64, -1, dtype=np.int64)
+        self._last_time = np.full(64, -1, dtype=np.int64)
+        # Las ubicaciones se codifican en uint8
+        self.heads = np.zeros(256, dtype=np.int64)
+        self.reads = np.zeros(256, dtype=np.int64)
+
+    def add(self, rows):
+        """Aplica un bloque de lecturas recién agregadas (rango de filas)"""
+        if not len(rows):
+            return
+        t = self._table
+        block = slice(rows.start, rows.stop)
+        self.reads += np.bincount(t['location'][block], minlength=256)
+        animals, stamps = t['animal'][block], t['timestamp'][block]
+        valid = animals >= 0
+        if self._ignore is not None:
+            valid &= t['status'][block] != self._ignore
+        rows = np.arange(rows.start, rows.stop)[valid]
+        animals, stamps = animals[valid], stamps[valid]
+        if not len(rows):
+            return
+        needed = int(animals.max()) + 1
+        if needed > len(self._last):
+            size = max(len(self._last) * 2, needed)
+            for name in ('_last', '_last_time'):
+                grown = np.full(size, -1, dtype=np.int64)
+                grown[:len(getattr(self, name))] = getattr(self, name)
+                setattr(self, name, grown)
+        np.maximum.at(self._last_time, animals, stamps)
+        hit = stamps == self._last_time[animals]
+        moved = np.unique(animals[hit])
+        previous = self._last[moved]
+        # Con el mismo timestamp gana la fila más nueva (la última asignación)
+        self._last[animals[hit]] = rows[hit]
+        previous = previous[previous >= 0]
+        self.heads -= np.bincount(t['location'][previous], minlength=256)
+        self.heads += np.bincount(t['location'][self._last[moved]], minlength=256)
+
+    def last_seen(self, animal):
+        """Fila de la última lectura válida de una fila del hato, o None"""
+        row = self._last[animal] if 0 <= animal < len(self._last) else -1
+        return None if row < 0 else int(row)
+
+    def heads_since(self, since):
+        """Cabezas por ubicación contando solo los avistamientos desde `since` (epoch)"""
+        recent = self._last[(self._last >= 0) & (self._last_time >= since)]
+        return np.bincount(self._table['location'][recent], minlength=256)
+
+
+class ReadingStore:
+    """
+    Lecturas RFID en columnas. Cada lectura guarda solo la fila del animal;
+    nombre, código, raza y peso se toman del hato al serializar. Las filas
+    se indexan por día en `partitions` para las consultas por rango.
+    Las lecturas anteriores a `horizon` solo están en la base (archivo).
+    """
+
+    SCHEMA = {
+        'id': np.int64,
+        'timestamp': np.int64,
+        'animal': np.int32,
+        'tag': 'S16',
+        'reader': np.uint8,
+        'location': np.uint8,
+        'event': np.uint8,
+        'status': np.uint8,
+        'signal_strength': np.uint8,
+        'tag_temperature': np.float32,
+        'battery_level': np.uint8,
+        'read_count': np.uint32,
+        'duration_ms': np.uint16,
+        'distance_meters': np.float32,
+        'notes': np.uint8,
+    }
+
+    # Las repeticiones dentro de la ventana de deduplicación suman lecturas a eventos ya guardados
+    SHARED_MUTABLE = ('read_count',)
+
+    # Campos de los registros serializados, en orden (proyectables con ?fields=)
+    FIELDS = ('id', 'rfid_code', 'animal_id', 'animal_name', 'animal_code', 'breed', 'weight', 'status_animal',
+              'location', 'reader_id', 'event_type', 'scan_timestamp', 'status', 'signal_strength',
+              'tag_temperature', 'battery_level', 'read_count', 'duration_ms', 'distance_meters', 'notes',
+              'avatarColor')
+
+    # Campos que vienen del animal leído: campo del hato y valor si la lectura no tiene animal
+    HERD_FIELDS = {
+        'animal_id': ('id', None), 'animal_name': ('name', 'Desconocido'), 'animal_code': ('code', ''),
+        'breed': ('breed', ''), 'weight': ('weight', None), 'status_animal': ('status', None),
+        'avatarColor': ('avatarColor', '#6B7280'),
+    }
+
+    # Columna de la tabla de la que sale cada campo con otro nombre, y su nombre en `rfid_readings`
+    SOURCES = {'rfid_code': 'tag', 'reader_id': 'reader', 'event_type': 'event', 'scan_timestamp': 'timestamp'}
+    DB_NAMES = {'animal': 'animal_id', 'reader': 'reader_id'}
+
+    def __init__(self, herd, capacity=1024):
+        self.herd = herd
+        self._lock = threading.RLock()
+        self._table = ColumnTable(self.SCHEMA, capacity)
+        self.partitions = TimePartitions()
+        self.readers = Dictionary(RFID_READERS)
+        self.locations = Dictionary(RFID_LOCATIONS)
+        self.notes = Dictionary([''])
+        self.events = Dictionary(event['name'] for event in RFID_EVENT_TYPES)
+        self._event_info = {event['name']: event for event in RFID_EVENT_TYPES}
+        self.statuses = Dictionary(status['name'] for status in RFID_READ_STATUSES)
+        self._status_info = {status['name']: status for status in RFID_READ_STATUSES}
+        self.occupancy = OccupancyIndex(self._table, ignore=self.statuses.lookup('Error de Lectura'))
+        self.db = None
+        self.next_id = 1
+        # Lecturas con timestamp < horizon e id < archived_below solo están en la base
+        self.horizon = 0
+        self.archived_below = 0
+
+    def __len__(self):
+        return len(self._table)
+
+    def column(self, name):
+        return self._table[name]
+
+    @property
+    def version(self):
+        return self._table.version
+
+    def row_versions(self, rows):
+        """Versión de la fila junto con la del animal, que también se serializa"""
+        rows = np.asarray(rows, dtype=np.int64)
+        animals = self.herd.animal_versions(self._table['animal'][rows])
+        return list(zip(self._table.row_versions(rows).tolist(), animals.tolist()))
+
+    def add_many(self, readings):
+        """Carga lecturas con el formato del generador de datos"""
+        columns = {name: [] for name in self.SCHEMA}
+        for reading in readings:
+            animal = self.herd.row_of(reading['animal_id'])
+            columns['timestamp'].append(_to_epoch(datetime.strptime(reading['scan_timestamp'], '%Y-%m-%d %H:%M:%S')))
+            columns['animal'].append(-1 if animal is None else animal)
+            columns['tag'].append(_to_bytes(reading['rfid_code'], 16))
+            columns['reader'].append(self.readers.encode(reading['reader_id']))
+            columns['location'].append(self.locations.encode(reading['location']))
+            columns['event'].append(self.events.encode(reading['event_type']['name']))
+            columns['status'].append(self.statuses.encode(reading['status']['name']))
+            columns['notes'].append(self.notes.encode(reading['notes']))
+            for name in ('signal_strength', 'tag_temperature', 'battery_level', 'read_count',
+                         'duration_ms', 'distance_meters'):
+                columns[name].append(reading[name])
+        if columns['timestamp']:
+            self.append(columns)
+
+    def add_batch(self, batch):
+        """Agrega un bloque de lecturas por columnas (BatchGenerator)"""
+        columns = {name: batch[name] for name in ('timestamp', 'tag', 'signal_strength', 'tag_temperature',
+                                                   'battery_level', 'read_count', 'duration_ms', 'distance_meters')}
+        columns['animal'] = self.herd.rows_of(batch['animal_id'])
+        for name, dictionary in (('reader', self.readers), ('location', self.locations), ('event', self.events),
+                                 ('status', self.statuses), ('notes', self.notes)):
+            columns[name] = _recode(dictionary, batch[name])
+        return self.append(columns)
+
+    def append(self, columns):
+        """
+        Agrega un bloque de lecturas ya codificadas; retorna el rango de filas.
+        Si el bloque no trae ids se asignan a continuación del último.
+        """
+        columns = {name: np.asarray(values) for name, values in columns.items()}
+        with self._lock:
+            count = len(columns['timestamp'])
+            if len(columns.get('id', ())) != count:
+                columns['id'] = np.arange(self.next_id, self.next_id + count)
+            rows = self._table.extend(columns)
+            if count:
+                self.next_id = max(self.next_id, int(columns['id'].max()) + 1)
+            self._index(rows)
+            if self.db is not None:
+                self.db.insert('rfid_readings', self._db_rows(rows))
+        return rows
+
+    def _index(self, rows):
+        """Agrega un rango de filas nuevas a las particiones por día y a la ocupación"""
+        self.partitions.add(self._table['timestamp'][rows.start:rows.stop], np.arange(rows.start, rows.stop))
+        self.occupancy.add(rows)
+
+    def shared_state(self):
+        """Columnas (copia de las modificables), versión y estado auxiliar para la instantánea compartida"""
+        with self._lock:
+            columns = {name: self._table[name].copy() if name in self.SHARED_MUTABLE else self._table[name]
+                       for name in self.SCHEMA}
+            state = {
+                'dictionaries': {name: list(getattr(self, name).values)
+                                 for name in ('readers', 'locations', 'notes', 'events', 'statuses')},
+                'next_id': self.next_id,
+                'horizon': self.horizon,
+                'archived_below': self.archived_below,
+            }
+            return columns, self._table.version, state
+
+    def map_shared(self, columns, size, version, state):
+        """Adopta una versión de la instantánea compartida e indexa solo las lecturas nuevas"""
+        with self._lock:
+            start = len(self._table)
+            if state is not None:
+                for name, values in state['dictionaries'].items():
+                    setattr(self, name, Dictionary(values))
+                self.next_id, self.horizon, self.archived_below = state['next_id'], state['horizon'], state['archived_below']
+            self._table.map(columns, size, version)
+            if size > start:
+                self._index(range(start, size))
+
+    def add_reads(self, rows, counts):
+        """Suma lecturas repetidas a eventos ya almacenados"""
+        rows = np.asarray(rows, dtype=np.int64)
+        with self._lock:
+            np.add.at(self._table['read_count'], rows, np.asarray(counts, dtype=np.uint32))
+            self._table.touch(rows)
+            if self.db is not None:
+                self.db.add_read_counts(zip((int(count) for count in counts), self._table['id'][rows].tolist()))
+
+    def load(self, rows):
+        """Agrega filas leídas de la tabla `rfid_readings`"""
+        (ids, timestamps, animals, tags, readers, locations, events, statuses, signal, temperature,
+         battery, read_count, duration, distance, notes) = zip(*rows)
+        self.append({
+            'id': ids,
+            'timestamp': timestamps,
+            'animal': self.herd.rows_of(animals),
+            'tag': [_to_bytes(tag, 16) for tag in tags],
+            'reader': [self.readers.encode(value) for value in readers],
+            'location': [self.locations.encode(value) for value in locations],
+            'event': [self.events.encode(value) for value in events],
+            'status': [self.statuses.encode(value) for value in statuses],
+            'signal_strength': signal,
+            'tag_temperature': temperature,
+            'battery_level': battery,
+            'read_count': read_count,
+            'duration_ms': duration,
+            'distance_meters': distance,
+            'notes': [self.notes.encode(value) for value in notes],
+        })
+
+    def save(self, db):
+        for offset in range(0, len(self._table), 5000):
+            db.insert('rfid_readings', self._db_rows(range(offset, min(offset + 5000, len(self._table)))))
+
+    def _db_rows(self, rows):
+        """Filas de lecturas como tuplas de la tabla `rfid_readings`"""
+        t = self._table
+        rows = np.arange(rows.start, rows.stop) if isinstance(rows, range) else np.asarray(rows)
+        animals = t['animal'][rows]
+        animal_ids = self.herd.column('id')[np.maximum(animals, 0)] if len(self.herd) else np.zeros(len(rows))
+        return zip(
+            t['id'][rows].tolist(), t['timestamp'][rows].tolist(),
+            [int(animal_id) if animal >= 0 else None for animal, animal_id in zip(animals.tolist(), animal_ids.tolist())],
+            [tag.decode('utf-8') for tag in t['tag'][rows]],
+            [self.readers.values[code] for code in t['reader'][rows].tolist()],
+            [self.locations.values[code] for code in t['location'][rows].tolist()],
+            [self.events.values[code] for code in t['event'][rows].tolist()],
+            [self.statuses.values[code] for code in t['status'][rows].tolist()],
+            t['signal_strength'][rows].tolist(),
+            [round(value, 1) for value in t['tag_temperature'][rows].tolist()],
+            t['battery_level'][rows].tolist(), t['read_count'][rows].tolist(), t['duration_ms'][rows].tolist(),
+            [round(value, 1) for value in t['distance_meters'][rows].tolist()],
+            [self.notes.values[code] for code in t['notes'][rows].tolist()],
+        )
+
+    def status_counts(self):
+        """Conteo de lecturas por clase de estado"""
+        counts = np.bincount(self._table['status'], minlength=len(self.statuses))
+        result = {'success': 0, 'danger': 0, 'warning': 0}
+        for code, count in enumerate(counts):
+            status_class = self._status_info[self.statuses.decode(code)]['class']
+            result[status_class] = result.get(status_class, 0) + int(count)
+        return result
+
+    def location_counts(self):
+        """Conteo de lecturas por ubicación (mantenido por el índice de ocupación)"""
+        counts = self.occupancy.reads[:len(self.locations)]
+        return {self.locations.decode(code): int(count) for code, count in enumerate(counts) if count}
+
+    def occupancy_counts(self, since=None):
+        """Cabezas por ubicación según el último avistamiento de cada animal (desde `since`)"""
+        with self._lock:
+            heads = self.occupancy.heads if since is None else self.occupancy.heads_since(since)
+            return {self.locations.decode(code): int(count)
+                    for code, count in enumerate(heads[:len(self.locations)].tolist()) if count}
+
+    def last_seen(self, animal_row):
+        """Fila de la última lectura válida del animal, o None si no tiene lecturas en memoria"""
+        with self._lock:
+            return self.occupancy.last_seen(animal_row)
+
+    def query(self, start, end, reader=None, location=None, limit=100, before=None):
+        """
+        Lecturas en [start, end) de la más reciente a la más antigua, filtradas
+        por lector y ubicación. Retorna (filas, lecturas que quedan desde `before`,
+        clave de la última fila si hay más).
+        """
+        reader_code = self.readers.lookup(reader) if reader else None
+        location_code = self.locations.lookup(location) if location else None
+        if (reader and reader_code is None) or (location and location_code is None):
+            return [], 0, None
+        rows, total = [], 0
+        with self._lock:
+            for block in self.partitions.scan(start, end, before):
+                if reader or location:
+                    block_rows = (block & ROW_MASK).astype(np.int64)
+                    keep = np.ones(len(block), dtype=bool)
+                    if reader:
+                        keep &= self._table['reader'][block_rows] == reader_code
+                    if location:
+                        keep &= self._table['location'][block_rows] == location_code
+                    block = block[keep]
+                total += len(block)
+                if len(rows) < limit:
+                    rows.extend(block[:limit - len(rows)].tolist())
+        last_key = rows[-1] if rows and total > len(rows) else None
+        return [key & 0xFFFFFFFF for key in rows], total, last_key
+
+    def window(self, offset, limit, text='', statuses=None, event=None):
+        """
+        Página de lecturas de la más reciente a la más antigua, filtrada por
+        texto (arete, animal, ubicación, lector), clases de estado y tipo de
+        evento. Retorna (filas, total que cumple los filtros).
+        """
+        t = self._table
+        filters = []
+        if statuses:
+            codes = [code for code, name in enumerate(self.statuses.values)
+                     if self._status_info[name]['class'] in statuses]
+            filters.append(lambda rows: np.isin(t['status'][rows], codes))
+        if event:
+            code = self.events.lookup(event)
+            filters.append(lambda rows: t['event'][rows] == code)
+        if text:
+            needle = text.strip().lower()
+            animals = self.herd.search(needle)
+            locations = [code for code, name in enumerate(self.locations.values) if needle in name.lower()]
+            readers = [code for code, name in enumerate(self.readers.values) if needle in name.lower()]
+            tag = needle.upper().encode('utf-8')
+            filters.append(lambda rows: (
+                (np.char.find(t['tag'][rows], tag) >= 0) | np.isin(t['animal'][rows], animals) |
+                np.isin(t['location'][rows], locations) | np.isin(t['reader'][rows], readers)
+            ))
+        if not filters:
+            return self.latest(offset + limit)[offset:], len(self)
+        found, total = [], 0
+        with self._lock:
+            for block in self.partitions.scan(0, MAX_TIMESTAMP):
+                rows = (block & ROW_MASK).astype(np.int64)
+                for keep in filters:
+                    rows = rows[keep(rows)]
+                if total + len(rows) > offset and len(found) < limit:
+                    found.extend(rows[max(offset - total, 0):][:limit - len(found)].tolist())
+                total += len(rows)
+        return found, total
+
+    def latest(self, count):
+        """Filas de las `count` lecturas más recientes"""
+        rows = []
+        with self._lock:
+            for block in self.partitions.scan(0, MAX_TIMESTAMP):
+                rows.extend((block[:count - len(rows)] & ROW_MASK).tolist())
+                if len(rows) >= count:
+                    break
+        return rows
+
+    def count_between(self, start, end):
+        with self._lock:
+            return self.partitions.count_between(start, end)
+
+    def export_rows(self, start=None, end=None, owners=None, chunk=5000):
+        """
+        Filas en [start, end) en orden cronológico, por bloques de `chunk`.
+        Cada bloque se copia bajo el lock y se retoma desde la última clave,
+        así la exportación no retiene el lock ni particiones completas.
+        Solo incluye las lecturas existentes al iniciar.
+        """
+        start = 0 if start is None else start
+        end = MAX_TIMESTAMP if end is None else end
+        with self._lock:
+            days = self.partitions.days_between(start, end)
+            count = len(self._table)
+        high = np.uint64(min(max(int(end), 0), MAX_TIMESTAMP)) << np.uint64(32)
+        for day in days:
+            low = np.uint64(min(max(int(start), 0), MAX_TIMESTAMP)) << np.uint64(32)
+            while True:
+                with self._lock:
+                    block = self.partitions.slice(day, low, high, chunk)
+                if not len(block):
+                    break
+                low = block[-1] + np.uint64(1)
+                rows = (block & ROW_MASK).astype(np.int64)
+                rows = rows[rows < count]
+                if owners is not None:
+                    rows = rows[self.herd.owned_by(self._table['animal'][rows], owners)]
+                if len(rows):
+                    yield rows
+
+    def archive(self, start, end, reader=None, location=None, limit=100, before=None, fields=None):
+        """
+        Lecturas archivadas en [start, min(end, horizon)) de la más reciente a la
+        más antigua. `before` es la clave (timestamp << 32 | id) de la última
+        lectura entregada. Retorna (dicts con `fields`, clave de la última si hay más).
+        """
+        start, end = int(np.ceil(start)), int(np.ceil(min(end, self.horizon)))
+        if self.db is None or start >= end:
+            return [], None
+        where, params = ['timestamp >= ?', 'timestamp < ?', 'id < ?'], [start, end, self.archived_below]
+        if reader:
+            where.append('reader_id = ?')
+            params.append(reader)
+        if location:
+            where.append('location = ?')
+            params.append(location)
+        if before is not None:
+            where.append('(timestamp, id) < (?, ?)')
+            params += [before >> 32, before & 0xFFFFFFFF]
+        rows = self.db.query(
+            f"SELECT {', '.join(Database.COLUMNS['rfid_readings'])} FROM rfid_readings "
+            f"WHERE {' AND '.join(where)} ORDER BY timestamp DESC, id DESC LIMIT ?", (*params, limit + 1)
+        )
+        last_key = (rows[limit - 1][1] << 32 | rows[limit - 1][0]) if len(rows) > limit else None
+        return self._from_db(rows[:limit], fields), last_key
+
+    def export_archive(self, start=None, end=None, owners=None, chunk=5000, fields=None):
+        """Dicts de las lecturas archivadas en [start, end) en orden cronológico, por bloques"""
+        start = 0 if start is None else int(np.ceil(start))
+        end = self.horizon if end is None else int(np.ceil(min(end, self.horizon)))
+        if self.db is None or start >= end:
+            return
+        owner_filter, names = '', []
+        if owners is not None:
+            names = self.herd.category_values('owner', owners)
+            owner_filter = f"AND animal_id IN (SELECT id FROM animals WHERE owner IN ({', '.join('?' * len(names))}))"
+        last = (start, -1)
+        while True:
+            rows = self.db.query(
+                f"SELECT {', '.join(Database.COLUMNS['rfid_readings'])} FROM rfid_readings "
+                f"WHERE (timestamp, id) > (?, ?) AND timestamp < ? AND id < ? {owner_filter} "
+                f"ORDER BY timestamp, id LIMIT ?", (*last, end, self.archived_below, *names, chunk)
+            )
+            if not rows:
+                return
+            last = (rows[-1][1], rows[-1][0])
+            yield self._from_db(rows, fields)
+
+    def daily_counts(self, days):
+        """Lecturas por día local de los últimos `days` días, incluido hoy"""
+        today = self.partitions.day_of(time.time())
+        with self._lock:
+            counts = self.partitions.daily_counts(today - days + 1, today)
+        return [(datetime.fromtimestamp(self.partitions.day_start(day)), count)
+                for day, count in zip(range(today - days + 1, today + 1), counts)]
+
+    def to_dict(self, row):
+        """Construye el dict de una lectura con el formato que espera la plantilla"""
+        return self.to_dicts([row])[0]
+
+    def to_dicts(self, rows, fields=None):
+        """Serializa lecturas en memoria; con `fields` solo lee y formatea esos campos"""
+        t = self._table
+        rows = np.asarray(rows, dtype=np.int64)
+        dictionaries = {'reader': self.readers, 'location': self.locations, 'event': self.events,
+                        'status': self.statuses, 'notes': self.notes}
+
+        def column(name):
+            values = t[name][rows].tolist()
+            if name == 'tag':
+                return [value.decode('utf-8') for value in values]
+            if name in dictionaries:
+                return [dictionaries[name].decode(code) for code in values]
+            return values
+
+        return self._records(column, len(rows), fields)
+
+    def _from_db(self, rows, fields=None):
+        """Dicts de lecturas archivadas (filas de `rfid_readings`)"""
+        names = Database.COLUMNS['rfid_readings']
+
+        def column(name):
+            index = names.index(self.DB_NAMES.get(name, name))
+            values = [row[index] for row in rows]
+            if name == 'animal':
+                found = (None if value is None else self.herd.row_of(value) for value in values)
+                return [-1 if animal is None else animal for animal in found]
+            return values
+
+        return self._records(column, len(rows), fields)
+
+    def _records(self, column, count, fields):
+        """Registros con los campos pedidos; `column(nombre)` da los valores de una columna de la tabla"""
+        names = self.FIELDS if fields is None else [name for name in self.FIELDS if name in fields]
+        values, animals = [], None
+        for name in names:
+            if name in self.HERD_FIELDS:
+                if animals is None:
+                    animals = column('animal')
+                values.append(self.herd.joined(animals, *self.HERD_FIELDS[name]))
+                continue
+            raw = column(self.SOURCES.get(name, name))
+            if name == 'event_type':
+                raw = [dict(self._event_info[event]) for event in raw]
+            elif name == 'status':
+                raw = [dict(self._status_info[status]) for status in raw]
+            elif name == 'scan_timestamp':
+                raw = [datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S') for value in raw]
+            elif name in ('tag_temperature', 'distance_meters'):
+                raw = [round(value, 1) for value in raw]
+            values.append(raw)
+        return make_records(names, values, count)
+
+
+# ============================================================================
+# REGISTROS DE SALUD
+# ============================================================================
+
+class CheckupSchedule:
+    """
+    Calendario de próximos controles: para cada animal vale el `next_checkup`
+    de su registro más reciente. Las entradas vigentes se guardan como claves
+    ordenadas (next_checkup << 32 | fila), así una ventana de fechas se ubica
+    con búsqueda binaria y se recorren solo las k entradas que se devuelven.
+    Los registros nuevos esperan en `_pending` y se intercalan en bloque en
+    la siguiente consulta, descartando las entradas que quedaron obsoletas.
+    """
+
+    def __init__(self, table):
+        self._table = table
+        self._keys = np.zeros(0, dtype=np.uint64)
+        self._pending = []
+        self._stale = set()
+        # Fila del animal → filas de sus registros, y registro vigente de cada animal
+        self._by_animal = {}
+        self._current = {}
+
+    def add(self, rows):
+        """Agenda un bloque de registros recién agregados (rango de filas)"""
+        rows = np.arange(rows.start, rows.stop)
+        animals = self._table['animal'][rows]
+        known = animals >= 0
+        rows, animals = rows[known], animals[known]
+        if not len(rows):
+            return
+        checkups = self._table['checkup_date'][rows]
+        order = np.lexsort((rows, checkups, animals))
+        rows, animals = rows[order], animals[order]
+        bounds = np.flatnonzero(np.diff(animals)) + 1
+        for animal, group in zip(animals[np.r_[0, bounds]].tolist(), np.split(rows, bounds)):
+            records = self._by_animal.get(animal)
+            if records is None:
+                records = self._by_animal[animal] = array('I')
+            records.extend(group.tolist())
+            latest = int(group[-1])
+            current = self._current.get(animal)
+            if current is not None:
+                if (self._table['checkup_date'][current], current) > (self._table['checkup_date'][latest], latest):
+                    continue
+                self._stale.add(current)
+            self._current[animal] = latest
+            self._pending.append(latest)
+
+    def records_of(self, animal):
+        """Filas de los registros de un animal, del control más reciente al más antiguo"""
+        rows = np.frombuffer(self._by_animal.get(animal, array('I')), dtype=np.uint32).astype(np.int64)
+        return rows[np.lexsort((rows, self._table['checkup_date'][rows]))[::-1]]
+
+    def _merge(self):
+        if self._stale:
+            stale = np.fromiter(self._stale, dtype=np.uint64, count=len(self._stale))
+            self._keys = self._keys[~np.isin(self._keys & ROW_MASK, stale)]
+            # Un registro reemplazado antes de intercalarse también sale de los pendientes
+            self._pending = [row for row in self._pending if row not in self._stale]
+            self._stale = set()
+        if self._pending:
+            rows = np.array(self._pending, dtype=np.uint64)
+            dates = self._table['next_checkup'][rows.astype(np.int64)]
+            fresh = np.sort(np.clip(dates, 0, MAX_TIMESTAMP).astype(np.uint64) << np.uint64(32) | rows)
+            self._keys = np.insert(self._keys, np.searchsorted(self._keys, fresh), fresh)
+            self._pending = []
+
+    def window(self, start, end, after=None, limit=50, accept=None):
+        """
+        Registros vigentes con next_checkup en [start, end), en orden de fecha.
+        `after` es la clave de la última entrada entregada y `accept` filtra
+        las filas de la ventana. Retorna (filas, total en la ventana, clave de
+        la última fila si hay más).
+        """
+        self._merge()
+        low = np.uint64(min(max(int(start), 0), MAX_TIMESTAMP)) << np.uint64(32)
+        high = np.uint64(min(max(int(end), 0), MAX_TIMESTAMP)) << np.uint64(32)
+        keys = self._keys[np.searchsorted(self._keys, low):np.searchsorted(self._keys, high)]
+        if accept is not None:
+            keys = keys[accept((keys & ROW_MASK).astype(np.int64))]
+        total = len(keys)
+        if after is not None:
+            keys = keys[np.searchsorted(keys, np.uint64(after), side='right'):]
+        found = keys[:limit + 1].tolist()
+        more = len(found) > limit
+        found = found[:limit]
+        return [key & 0xFFFFFFFF for key in found], total, (found[-1] if more and found else None)
+
+
+class HealthStore:
+    """
+    Registros veterinarios en columnas; los datos del animal se unen al
+    serializar, igual que en las lecturas RFID.
+    """
+
+    SCHEMA = {
+        'id': np.int64,
+        'animal': np.int32,
+        'checkup_date': np.int64,
+        'next_checkup': np.int64,
+        'weight': np.float32,
+        'temperature': np.float32,
+        'heart_rate': np.uint8,
+        'respiratory_rate': np.uint8,
+        'status': np.uint8,
+        'vaccine': np.uint8,
+        'treatment': np.uint8,
+        'veterinarian': np.uint8,
+        'observations': np.uint8,
+        'diagnosis': np.uint8,
+        'cost': np.float64,
+    }
+
+    CATEGORIES = ('vaccine', 'treatment', 'veterinarian', 'observations', 'diagnosis')
+
+    # Campos de los registros serializados, en orden (proyectables con ?fields=)
+    FIELDS = ('id', 'animal_id', 'animal_name', 'animal_code', 'rfid', 'breed', 'checkup_date', 'checkup_timestamp',
+              'next_checkup', 'weight', 'temperature', 'heart_rate', 'respiratory_rate', 'status', 'vaccine',
+              'treatment', 'veterinarian', 'observations', 'diagnosis', 'cost', 'avatarColor')
+
+    # Campos que vienen del animal: campo del hato y valor si el registro no tiene animal
+    HERD_FIELDS = {
+        'animal_id': ('id', None), 'animal_name': ('name', 'Desconocido'), 'animal_code': ('code', ''),
+        'rfid': ('rfid', ''), 'breed': ('breed', ''), 'avatarColor': ('avatarColor', '#6B7280'),
+    }
+
+    # Fechas serializadas: columna y formato
+    DATES = {'checkup_date': ('checkup_date', '%Y-%m-%d'), 'checkup_timestamp': ('checkup_date', '%Y-%m-%d %H:%M:%S'),
+             'next_checkup': ('next_checkup', '%Y-%m-%d')}
+
+    SHARED_MUTABLE = ()
+
+    def __init__(self, herd, capacity=1024):
+        self.herd = herd
+        self._lock = threading.RLock()
+        self._table = ColumnTable(self.SCHEMA, capacity)
+        self._dicts = {name: Dictionary() for name in self.CATEGORIES}
+        self.statuses = Dictionary(status['class'] for status in HEALTH_STATUSES)
+        self._status_info = {status['class']: status for status in HEALTH_STATUSES}
+        self.db = None
+        self.next_id = 1
+        self.schedule = CheckupSchedule(self._table)
+
+    def __len__(self):
+        return len(self._table)
+
+    def column(self, name):
+        return self._table[name]
+
+    @property
+    def version(self):
+        return self._table.version
+
+    def row_versions(self, rows):
+        """Versión de la fila junto con la del animal, que también se serializa"""
+        rows = np.asarray(rows, dtype=np.int64)
+        animals = self.herd.animal_versions(self._table['animal'][rows])
+        return list(zip(self._table.row_versions(rows).tolist(), animals.tolist()))
+
+    def add_many(self, records):
+        """Carga registros con el formato del generador de datos"""
+        columns = {name: [] for name in self.SCHEMA}
+        for record in records:
+            checkup = datetime.strptime(f"{record['checkup_date']} {record['checkup_time']}", '%Y-%m-%d %H:%M')
+            animal = self.herd.row_of(record['animal_id'])
+            columns['animal'].append(-1 if animal is None else animal)
+            columns['checkup_date'].append(_to_epoch(checkup))
+            columns['next_checkup'].append(_to_epoch(datetime.strptime(record['next_checkup'], '%Y-%m-%d')))
+            columns['status'].append(self.statuses.encode(record['status']['class']))
+            for name in self.CATEGORIES:
+                columns[name].append(self._dicts[name].encode(record[name]))
+            for name in ('weight', 'temperature', 'heart_rate', 'respiratory_rate', 'cost'):
+                columns[name].append(record[name])
+        if columns['animal']:
+            self.append(columns)
+
+    def add_batch(self, batch):
+        """Agrega un bloque de registros por columnas (BatchGenerator)"""
+        columns = {name: batch[name] for name in ('checkup_date', 'next_checkup', 'weight', 'temperature',
+                                                   'heart_rate', 'respiratory_rate', 'cost')}
+        columns['animal'] = self.herd.rows_of(batch['animal_id'])
+        columns['status'] = _recode(self.statuses, batch['status'])
+        for name in self.CATEGORIES:
+            columns[name] = _recode(self._dicts[name], batch[name])
+        return self.append(columns)
+
+    def append(self, columns):
+        """
+        Agrega un bloque de registros ya codificados; retorna el rango de filas.
+        Si el bloque no trae ids se asignan a continuación del último.
+        """
+        columns = {name: np.asarray(values) for name, values in columns.items()}
+        with self._lock:
+            count = len(columns['animal'])
+            if len(columns.get('id', ())) != count:
+                columns['id'] = np.arange(self.next_id, self.next_id + count)
+            rows = self._table.extend(columns)
+            if count:
+                self.next_id = max(self.next_id, int(columns['id'].max()) + 1)
+            self.schedule.add(rows)
+            if self.db is not None:
+                self.db.insert('health_records', self._db_rows(rows))
+        self.herd.vitals.observe(columns['animal'], columns['checkup_date'],
+                                 {sign: columns[sign] for sign in VitalsMonitor.SIGNS})
+        return rows
+
+    def shared_state(self):
+        """Columnas, versión y estado auxiliar para la instantánea compartida"""
+        with self._lock:
+            state = {
+                'dictionaries': {name: list(dictionary.values) for name, dictionary in self._dicts.items()},
+                'statuses': list(self.statuses.values),
+                'next_id': self.next_id,
+            }
+            return {name: self._table[name] for name in self.SCHEMA}, self._table.version, state
+
+    def map_shared(self, columns, size, version, state):
+        """Adopta una versión de la instantánea compartida y agenda solo los registros nuevos"""
+        with self._lock:
+            start = len(self._table)
+            if state is not None:
+                self._dicts = {name: Dictionary(values) for name, values in state['dictionaries'].items()}
+                self.statuses = Dictionary(state['statuses'])
+                self.next_id = state['next_id']
+            self._table.map(columns, size, version)
+            if size > start:
+                self.schedule.add(range(start, size))
+
+    def load(self, rows):
+        """Agrega filas leídas de la tabla `health_records`"""
+        (ids, animals, checkup, next_checkup, weight, temperature, heart_rate, respiratory_rate,
+         statuses, *categories, cost) = zip(*rows)
+        columns = {
+            'id': ids,
+            'animal': self.herd.rows_of(animals),
+            'checkup_date': checkup,
+            'next_checkup': next_checkup,
+            'weight': weight,
+            'temperature': temperature,
+            'heart_rate': heart_rate,
+            'respiratory_rate': respiratory_rate,
+            'status': [self.statuses.encode(value) for value in statuses],
+            'cost': cost,
+        }
+        for name, values in zip(self.CATEGORIES, categories):
+            columns[name] = [self._dicts[name].encode(value) for value in values]
+        self.append(columns)
+
+    def save(self, db):
+        for offset in range(0, len(self._table), 5000):
+            db.insert('health_records', self._db_rows(range(offset, min(offset + 5000, len(self._table)))))
+
+    def _db_rows(self, rows):
+        """Registros como tuplas de la tabla `health_records`"""
+        t = self._table
+        rows = np.arange(rows.start, rows.stop) if isinstance(rows, range) else np.asarray(rows)
+        animals = t['animal'][rows]
+        animal_ids = self.herd.column('id')[np.maximum(animals, 0)] if len(self.herd) else np.zeros(len(rows))
+        return zip(
+            t['id'][rows].tolist(),
+            [int(animal_id) if animal >= 0 else None for animal, animal_id in zip(animals.tolist(), animal_ids.tolist())],
+            t['checkup_date'][rows].tolist(), t['next_checkup'][rows].tolist(),
+            [round(value, 1) for value in t['weight'][rows].tolist()],
+            [round(value, 1) for value in t['temperature'][rows].tolist()],
+            t['heart_rate'][rows].tolist(), t['respiratory_rate'][rows].tolist(),
+            [self.statuses.values[code] for code in t['status'][rows].tolist()],
+            *([self._dicts[name].values[code] for code in t[name][rows].tolist()] for name in self.CATEGORIES),
+            [round(value, 2) for value in t['cost'][rows].tolist()],
+        )
+
+    def status_counts(self):
+        """Conteo de registros por clase de estado"""
+        counts = np.bincount(self._table['status'], minlength=len(self.statuses))
+        return {self.statuses.decode(code): int(count) for code, count in enumerate(counts)}
+
+    def export_rows(self, start=None, end=None, owners=None, chunk=5000):
+        """Filas de registros por bloques, filtradas por fecha de control y propietario"""
+        count = len(self._table)
+        for offset in range(0, count, chunk):
+            rows = np.arange(offset, min(offset + chunk, count))
+            checkup = self._table['checkup_date'][rows]
+            keep = np.ones(len(rows), dtype=bool)
+            if start is not None:
+                keep &= checkup >= start
+            if end is not None:
+                keep &= checkup < end
+            if owners is not None:
+                keep &= self.herd.owned_by(self._table['animal'][rows], owners)
+            if keep.any():
+                yield rows[keep]
+
+    def window(self, offset, limit, text='', statuses=None):
+        """
+        Página de registros del control más reciente al más antiguo, filtrada
+        por texto (animal, vacuna, tratamiento, veterinario) y clases de estado.
+        Retorna (filas, total que cumple los filtros).
+        """
+        t = self._table
+        if not text and not statuses:
+            return self.latest(offset + limit)[offset:].tolist(), len(self)
+        keep = np.ones(len(t), dtype=bool)
+        if statuses:
+            codes = [self.statuses.lookup(status) for status in statuses]
+            keep &= np.isin(t['status'], [code for code in codes if code is not None])
+        if text:
+            needle = text.strip().lower()
+            matched = np.isin(t['animal'], self.herd.search(needle))
+            for name in ('vaccine', 'treatment', 'veterinarian'):
+                values = self._dicts[name].values
+                matched |= np.isin(t[name], [code for code, value in enumerate(values) if needle in value.lower()])
+            keep &= matched
+        rows = np.flatnonzero(keep)
+        rows = rows[np.argsort(t['checkup_date'][rows], kind='stable')[::-1]]
+        return rows[offset:offset + limit].tolist(), len(rows)
+
+    def checkups(self, start, end, statuses=None, after=None, limit=50):
+        """
+        Controles programados con fecha en [start, end) según el registro más
+        reciente de cada animal, filtrados por clases de estado.
+        Retorna (filas, total, clave de la última fila si hay más).
+        """
+        accept = None
+        if statuses:
+            codes = [code for code in (self.statuses.lookup(status) for status in statuses) if code is not None]
+            accept = lambda rows: np.isin(self._table['status'][rows], codes)
+        with self._lock:
+            return self.schedule.window(start, end, after=after, limit=limit, accept=accept)
+
+    def records_of(self, animal_id):
+        """Filas de los registros de un animal, del más reciente al más antiguo"""
+        row = self.herd.row_of(animal_id)
+        with self._lock:
+            return np.zeros(0, dtype=np.int64) if row is None else self.schedule.records_of(row)
+
+    def count_since(self, since):
+        """Registros con control desde `since` (epoch)"""
+        return int(np.count_nonzero(self._table['checkup_date'] >= since))
+
+    def latest(self, count):
+        """Filas de los `count` registros con control más reciente"""
+        dates = self._table['checkup_date']
+        if len(dates) > count:
+            rows = np.argpartition(dates, len(dates) - count)[-count:]
+        else:
+            rows = np.arange(len(dates))
+        return rows[np.argsort(dates[rows], kind='stable')[::-1]]
+
+    def to_dict(self, row):
+        """Construye el dict de un registro de salud"""
+        return self.to_dicts([row])[0]
+
+    def values(self, name, rows):
+        """Valores serializados del campo `name` (de FIELDS) para las filas `rows`, leyendo solo sus columnas"""
+        t = self._table
+        if name in self.HERD_FIELDS:
+            return self.herd.joined(t['animal'][rows], *self.HERD_FIELDS[name])
+        if name in self.DATES:
+            column, pattern = self.DATES[name]
+            return [datetime.fromtimestamp(value).strftime(pattern) for value in t[column][rows].tolist()]
+        if name in self.CATEGORIES:
+            return [self._dicts[name].decode(code) for code in t[name][rows].tolist()]
+        if name in ('id', 'heart_rate', 'respiratory_rate'):
+            return t[name][rows].tolist()
+        if name == 'weight':
+            return [_to_number(value) for value in t['weight'][rows].tolist()]
+        if name == 'temperature':
+            return [round(value, 1) for value in t['temperature'][rows].tolist()]
+        if name == 'cost':
+            return [round(value, 2) for value in t['cost'][rows].tolist()]
+        if name == 'status':
+            return [dict(self._status_info[self.statuses.decode(code)]) for code in t['status'][rows].tolist()]
+        raise KeyError(name)
+
+    def to_dicts(self, rows, fields=None):
+        """Serializa registros; con `fields` solo lee y formatea esos campos"""
+        rows = np.asarray(rows, dtype=np.int64)
+        names = self.FIELDS if fields is None else [name for name in self.FIELDS if name in fields]
+        return make_records(names, [self.values(name, rows) for name in names], len(rows))
+
+
+# ============================================================================
+# SERIES DE PESO
+# ============================================================================
+
+def lttb(x, y, threshold):
+    """
+    Índices de los puntos que conserva Largest-Triangle-Three-Buckets: el
+    primero, el último y en cada cubeta intermedia el que forma el triángulo
+    de mayor área con el punto elegido antes y el promedio de la cubeta siguiente
+    """
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.int64)
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0], picked[-1] = 0, count - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        following = edges[bucket + 2] if bucket + 2 < len(edges) else count
+        next_x, next_y = x[stop:following].mean(), y[stop:following].mean()
+        areas = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                       - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = picked[bucket + 1] = start + int(np.argmax(areas))
+    return picked
+
+
+class WeightSeries:
+    """
+    Pesajes de la báscula (eventos Pesaje) como serie de tiempo por animal.
+    Las claves (fila del animal << 32 | fila del pesaje) se mantienen
+    ordenadas para ubicar la serie de un animal con búsqueda binaria, y cada
+    pesaje se suma a un acumulado diario por raza (conteo, suma, mínimo y
+    máximo), así las curvas del hato o de una raza se arman con un valor por
+    día sin recorrer los pesajes crudos.
+    """
+
+    SCHEMA = {
+        'id': np.int64,
+        'animal': np.int32,
+        'timestamp': np.int64,
+        'weight': np.float32,
+    }
+
+    SHARED_MUTABLE = ()
+
+    def __init__(self, herd, capacity=1024):
+        self.herd = herd
+        self._lock = threading.RLock()
+        self._table = ColumnTable(self.SCHEMA, capacity)
+        self._keys = np.zeros(0, dtype=np.uint64)
+        self._pending = []
+        # Último pesaje de cada fila del hato y su fecha (-1 = sin pesajes)
+        self._latest = np.full(64, -1, dtype=np.int64)
+        self._latest_time = np.full(64, -1, dtype=np.int64)
+        # Acumulados diarios: día → fila de las matrices [día, código de raza]
+        self._slots = {}
+        self._days = np.zeros(64, dtype=np.int64)
+        self._count = np.zeros((64, 16), dtype=np.int64)
+        self._sum = np.zeros((64, 16), dtype=np.float64)
+        self._min = np.full((64, 16), np.inf, dtype=np.float32)
+        self._max = np.full((64, 16), -np.inf, dtype=np.float32)
+        self.db = None
+        self.next_id = 1
+
+    def __len__(self):
+        return len(self._table)
+
+    @property
+    def version(self):
+        return self._table.version
+
+    def add_batch(self, batch):
+        """Agrega un bloque de pesajes por columnas (BatchGenerator)"""
+        return self.append({
+            'animal': self.herd.rows_of(batch['animal_id']),
+            'timestamp': batch['timestamp'],
+            'weight': batch['weight'],
+        })
+
+    def append(self, columns):
+        """
+        Agrega un bloque de pesajes de animales registrados; retorna las filas
+        de los animales cuyo último pesaje cambió
+        """
+        columns = {name: np.asarray(values) for name, values in columns.items()}
+        with self._lock:
+            count = len(columns['animal'])
+            if len(columns.get('id', ())) != count:
+                columns['id'] = np.arange(self.next_id, self.next_id + count)
+            rows = self._table.extend(columns)
+            if not count:
+                return []
+            self.next_id = max(self.next_id, int(columns['id'].max()) + 1)
+            changed = self._index(rows)
+            if self.db is not None:
+                self.db.insert('weighings', self._db_rows(rows))
+        return changed
+
+    def _index(self, rows):
+        """Agrega un rango de pesajes nuevos a las claves, los acumulados y el último pesaje"""
+        block = slice(rows.start, rows.stop)
+        animals = self._table['animal'][block]
+        self._pending.append(np.arange(rows.start, rows.stop, dtype=np.uint64)
+                             | animals.astype(np.uint64) << np.uint64(32))
+        self._roll(animals, self._table['timestamp'][block], self._table['weight'][block])
+        return self._update_latest(rows)
+
+    def shared_state(self):
+        """Columnas, versión y estado auxiliar para la instantánea compartida"""
+        with self._lock:
+            return {name: self._table[name] for name in self.SCHEMA}, self._table.version, {'next_id': self.next_id}
+
+    def map_shared(self, columns, size, version, state):
+        """Adopta una versión de la instantánea compartida e indexa solo los pesajes nuevos"""
+        with self._lock:
+            start = len(self._table)
+            if state is not None:
+                self.next_id = state['next_id']
+            self._table.map(columns, size, version)
+            if size > start:
+                self._index(range(start, size))
+
+    def _update_latest(self, rows):
+        animals = self._table['animal'][rows.start:rows.stop]
+        stamps = self._table['timestamp'][rows.start:rows.stop]
+        needed = int(animals.max()) + 1
+        if needed > len(self._latest):
+            size = max(len(self._latest) * 2, needed)
+            for name in ('_latest', '_latest_time'):
+                grown = np.full(size, -1, dtype=np.int64)
+                grown[:len(getattr(self, name))] = getattr(self, name)
+                setattr(self, name, grown)
+        np.maximum.at(self._latest_time, animals, stamps)
+        hit = stamps == self._latest_time[animals]
+        self._latest[animals[hit]] = np.arange(rows.start, rows.stop)[hit]
+        return np.unique(animals[hit]).tolist()
+
+    def _roll(self, animals, timestamps, weights):
+        """Suma un bloque de pesajes a los acumulados diarios por raza"""
+        days, inverse = np.unique(day_start(timestamps), return_inverse=True)
+        slots = np.array([self._slot(day) for day in days.tolist()], dtype=np.int64)[inverse]
+        breeds = self.herd.column('breed')[animals].astype(np.int64)
+        self._grow(len(self._slots), int(breeds.max()) + 1)
+        np.add.at(self._count, (slots, breeds), 1)
+        np.add.at(self._sum, (slots, breeds), weights.astype(np.float64))
+        np.minimum.at(self._min, (slots, breeds), weights.astype(np.float32))
+        np.maximum.at(self._max, (slots, breeds), weights.astype(np.float32))
+
+    def _slot(self, day):
+        slot = self._slots.get(day)
+        if slot is None:
+            slot = self._slots[day] = len(self._slots)
+            self._grow(slot + 1, 0)
+            self._days[slot] = day
+        return slot
+
+    def _grow(self, days, breeds):
+        """Agranda las matrices de acumulados por duplicación (días y razas)"""
+        rows, columns = self._count.shape
+        if days <= rows and breeds <= columns:
+            return
+        while rows < days:
+            rows *= 2
+        while columns < breeds:
+            columns *= 2
+        used_rows, used_columns = self._count.shape
+        for name, fill in (('_count', 0), ('_sum', 0), ('_min', np.inf), ('_max', -np.inf)):
+            current = getattr(self, name)
+            grown = np.full((rows, columns), fill, dtype=current.dtype)
+            grown[:used_rows, :used_columns] = current
+            setattr(self, name, grown)
+        days_grown = np.zeros(rows, dtype=np.int64)
+        days_grown[:used_rows] = self._days
+        self._days = days_grown
+
+    def _merge(self):
+        if self._pending:
+            fresh = np.sort(np.concatenate(self._pending))
+            self._keys = np.insert(self._keys, np.searchsorted(self._keys, fresh), fresh)
+            self._pending = []
+
+    def latest(self, animal):
+        """Peso del último pesaje de una fila del hato, o None"""
+        row = self._latest[animal] if animal < len(self._latest) else -1
+        return None if row < 0 else _to_number(self._table['weight'][row])
+
+    def series(self, animal, start=0, end=MAX_TIMESTAMP):
+        """Pesajes de una fila del hato en [start, end): (timestamps, pesos) en orden de fecha"""
+        t = self._table
+        with self._lock:
+            self._merge()
+            low = np.uint64(animal) << np.uint64(32)
+            found = self._keys[np.searchsorted(self._keys, low):np.searchsorted(self._keys, low + (np.uint64(1) << np.uint64(32)))]
+            rows = (found & ROW_MASK).astype(np.int64)
+            timestamps = t['timestamp'][rows]
+            keep = (timestamps >= start) & (timestamps < end)
+            rows = rows[keep][np.argsort(timestamps[keep], kind='stable')]
+            return t['timestamp'][rows], t['weight'][rows]
+
+    def daily(self, start=0, end=MAX_TIMESTAMP, breed=None):
+        """
+        Acumulados por día en [start, end), de una raza (código) o de todo el
+        hato: (días, conteo, suma, mínimo, máximo) solo de los días con pesajes
+        """
+        with self._lock:
+            used = len(self._slots)
+            days = self._days[:used]
+            slots = np.flatnonzero((days >= day_start(start)) & (days < end))
+            slots = slots[np.argsort(days[slots])]
+            if breed is None:
+                count = self._count[slots].sum(axis=1)
+                total = self._sum[slots].sum(axis=1)
+                low = self._min[slots].min(axis=1, initial=np.inf)
+                high = self._max[slots].max(axis=1, initial=-np.inf)
+            elif breed < self._count.shape[1]:
+                count, total = self._count[slots, breed], self._sum[slots, breed]
+                low, high = self._min[slots, breed], self._max[slots, breed]
+            else:
+                slots = slots[:0]
+                count = total = low = high = np.zeros(0)
+            keep = count > 0
+            return days[slots][keep], count[keep], total[keep], low[keep], high[keep]
+
+    def load(self, rows):
+        """Agrega filas leídas de la tabla `weighings` (se omiten animales que ya no existen)"""
+        ids, animals, timestamps, weights = (np.array(values) for values in zip(*rows))
+        animals = self.herd.rows_of(animals)
+        known = animals >= 0
+        self.append({'id': ids[known], 'animal': animals[known], 'timestamp': timestamps[known],
+                     'weight': weights[known]})
+
+    def save(self, db):
+        for offset in range(0, len(self._table), 5000):
+            db.insert('weighings', self._db_rows(range(offset, min(offset + 5000, len(self._table)))))
+
+    def _db_rows(self, rows):
+        """Pesajes como tuplas de la tabla `weighings`"""
+        t = self._table
+        rows = np.arange(rows.start, rows.stop) if isinstance(rows, range) else np.asarray(rows)
+        return zip(
+            t['id'][rows].tolist(),
+            self.herd.column('id')[t['animal'][rows]].tolist(),
+            t['timestamp'][rows].tolist(),
+            [round(value, 1) for value in t['weight'][rows].tolist()],
+        )
+
+
+# ============================================================================
+# SIGNOS VITALES
+# ============================================================================
+
+class VitalsMonitor:
+    """
+    Detección en línea de signos vitales anómalos. Por animal y por signo se
+    guardan conteo, media y M2 (Welford) y un promedio móvil exponencial; por
+    raza, los mismos acumulados como referencia del grupo. Cada valor se
+    compara con la línea base previa del animal y con la de su raza antes de
+    sumarse a ambas, así la memoria es fija por animal y nunca se relee el
+    historial. Mientras `live` es falso (carga inicial) solo se aprende.
+    """
+
+    # Etiqueta y unidad de cada signo en los mensajes de alerta
+    SIGNS = {
+        'temperature': ('temperatura', '°C'),
+        'heart_rate': ('frecuencia cardíaca', 'lpm'),
+        'respiratory_rate': ('frecuencia respiratoria', 'rpm'),
+    }
+
+    # Rango fisiológicamente plausible de cada signo; fuera de él (o no finito)
+    # la medición se rechaza y no entra a las líneas base
+    RANGES = {
+        'temperature': (30.0, 45.0),
+        'heart_rate': (20.0, 300.0),
+        'respiratory_rate': (5.0, 150.0),
+    }
+
+    # Muestras mínimas para confiar en una línea base, desviaciones estándar
+    # que disparan la alerta, peso del EWMA y segundos entre alertas de un animal
+    MIN_SAMPLES = 5
+    MIN_BREED_SAMPLES = 30
+    THRESHOLD = 3.0
+    BREED_THRESHOLD = 4.0
+    ALPHA = 0.2
+    COOLDOWN = 3600
+
+    def __init__(self, herd):
+        self.herd = herd
+        self.live = False
+        self._lock = threading.Lock()
+        # Por signo: filas conteo, media, M2 y EWMA por fila del hato; conteo, media y M2 por raza
+        self._animals = {sign: np.zeros((4, 64)) for sign in self.SIGNS}
+        self._breeds = {sign: np.zeros((3, 256)) for sign in self.SIGNS}
+        self._last_alert = np.full(64, -np.inf)
+        self.alerts = deque(maxlen=200)
+        # Aumenta con cada bloque observado
+        self.version = 0
+
+    def _grow(self, size):
+        current = len(self._last_alert)
+        if size <= current:
+            return
+        while current < size:
+            current *= 2
+        for sign, stats in self._animals.items():
+            grown = np.zeros((4, current))
+            grown[:, :stats.shape[1]] = stats
+            self._animals[sign] = grown
+        last_alert = np.full(current, -np.inf)
+        last_alert[:len(self._last_alert)] = self._last_alert
+        self._last_alert = last_alert
+
+    @classmethod
+    def check(cls, sign, value):
+        """Valor de una medición; lanza ValueError si no es finito o está fuera de rango"""
+        value = float(value)
+        low, high = cls.RANGES[sign]
+        if not math.isfinite(value) or not low <= value <= high:
+            raise ValueError(f'{sign} fuera de rango ({low:g} a {high:g})')
+        return value
+
+    def observe(self, rows, timestamps, values):
+        """
+        Evalúa y aprende un bloque de mediciones: filas del hato, epoch y un
+        dict signo → valores (NaN = sin medición; los valores fuera de
+        RANGES se descartan). Retorna las alertas nuevas.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = {sign: np.asarray(column, dtype=np.float64) for sign, column in values.items()}
+        for sign, column in values.items():
+            low, high = self.RANGES[sign]
+            with np.errstate(invalid='ignore'):
+                values[sign] = np.where((column >= low) & (column <= high), column, np.nan)
+        known = rows >= 0
+        if not known.any():
+            return []
+        rows, timestamps = rows[known], timestamps[known]
+        values = {sign: column[known] for sign, column in values.items()}
+        breeds = self.herd.column('breed')[rows].astype(np.int64)
+        # Número de aparición de cada animal en el bloque: cada ronda toma a lo
+        # sumo una medición por animal para que Welford y EWMA sigan en orden
+        order = np.argsort(rows, kind='stable')
+        starts = np.r_[0, np.flatnonzero(np.diff(rows[order])) + 1]
+        occurrence = np.empty(len(rows), dtype=np.int64)
+        occurrence[order] = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+        found = []
+        with self._lock:
+            self._grow(int(rows.max()) + 1)
+            for round_ in range(int(occurrence.max()) + 1):
+                pick = np.flatnonzero(occurrence == round_)
+                for sign, column in values.items():
+                    measured = pick[~np.isnan(column[pick])]
+                    if len(measured):
+                        found += self._update(sign, rows[measured], breeds[measured], column[measured],
+                                              timestamps[measured])
+            alerts = self._throttle(found) if self.live else []
+            self.alerts.extend(alerts)
+            self.version += 1
+        if alerts:
+            template = ACTIVITY_TYPES['health']['template']
+            self.herd.activity.publish_many(
+                ('health', f"{template.format(alert['animal_name'])}: {alert['message']}", 'Sistema',
+                 datetime.fromtimestamp(alert['timestamp']))
+                for alert in alerts
+            )
+        return alerts
+
+    def _update(self, sign, rows, breeds, x, timestamps):
+        """Compara con las líneas base y actualiza los acumulados (una medición por animal)"""
+        count, mean, m2, ewma = self._animals[sign]
+        breed_count, breed_mean, breed_m2 = self._breeds[sign]
+        # Desviación respecto del propio animal y de su raza, antes de aprender el valor
+        previous = count[rows]
+        std = np.sqrt(m2[rows] / np.maximum(previous - 1, 1))
+        z_self = np.where((previous >= self.MIN_SAMPLES) & (std > 0), np.abs(x - mean[rows]) / np.where(std > 0, std, 1), 0)
+        breed_std = np.sqrt(breed_m2[breeds] / np.maximum(breed_count[breeds] - 1, 1))
+        z_breed = np.where((breed_count[breeds] >= self.MIN_BREED_SAMPLES) & (breed_std > 0),
+                           np.abs(x - breed_mean[breeds]) / np.where(breed_std > 0, breed_std, 1), 0)
+        baseline_self, baseline_breed = mean[rows], breed_mean[breeds]
+        # Welford por animal y EWMA
+        delta = x - mean[rows]
+        count[rows] = previous + 1
+        mean[rows] += delta / count[rows]
+        m2[rows] += delta * (x - mean[rows])
+        ewma[rows] = np.where(previous == 0, x, ewma[rows] + self.ALPHA * (x - ewma[rows]))
+        # Acumulados por raza: se combina el bloque completo (Chan et al.)
+        size = np.bincount(breeds, minlength=256)
+        block_mean = np.bincount(breeds, weights=x, minlength=256) / np.maximum(size, 1)
+        block_m2 = np.bincount(breeds, weights=(x - block_mean[breeds]) ** 2, minlength=256)
+        total = breed_count + size
+        delta = block_mean - breed_mean
+        breed_m2 += block_m2 + delta ** 2 * breed_count * size / np.maximum(total, 1)
+        breed_mean += delta * size / np.maximum(total, 1)
+        breed_count[:] = total
+        flagged = np.flatnonzero((z_self >= self.THRESHOLD) | (z_breed >= self.BREED_THRESHOLD))
+        return [
+            (int(rows[i]), sign, float(x[i]), int(timestamps[i]),
+             ('animal', float(baseline_self[i]), float(z_self[i])) if z_self[i] >= self.THRESHOLD
+             else ('breed', float(baseline_breed[i]), float(z_breed[i])))
+            for i in flagged.tolist()
+        ]
+
+    def _throttle(self, found):
+        """Alertas a publicar: una por animal cada COOLDOWN segundos"""
+        alerts = []
+        for row, sign, value, timestamp, (reference, baseline, deviation) in found:
+            if timestamp - self._last_alert[row] < self.COOLDOWN:
+                continue
+            self._last_alert[row] = timestamp
+            brief = self.herd.brief(row)
+            label, unit = self.SIGNS[sign]
+            source = 'habitual' if reference == 'animal' else f"promedio de {brief['breed']}"
+            alerts.append({
+                'animal_id': brief['id'],
+                'animal_name': brief['name'],
+                'sign': sign,
+                'value': round(value, 1),
+                'baseline': round(baseline, 1),
+                'deviation': round(deviation, 1),
+                'reference': reference,
+                'timestamp': timestamp,
+                'message': f'{label} {value:g} {unit} ({source} {baseline:.1f})',
+            })
+        return alerts
+
+    def baseline(self, row):
+        """Línea base de un animal por signo: mediciones, media, desviación y EWMA"""
+        with self._lock:
+            result = {}
+            for sign, (count, mean, m2, ewma) in self._animals.items():
+                if row >= len(count) or not count[row]:
+                    continue
+                result[sign] = {
+                    'samples': int(count[row]),
+                    'mean': round(float(mean[row]), 2),
+                    'std': round(float(np.sqrt(m2[row] / max(count[row] - 1, 1))), 2),
+                    'ewma': round(float(ewma[row]), 2),
+                }
+            return result
+
+    def recent(self, limit=50):
+        """Últimas alertas, de la más reciente a la más antigua"""
+        with self._lock:
+            return list(self.alerts)[-limit:][::-1]
+
+    def shared_state(self):
+        """Copia de los acumulados por animal y por raza, versión y últimas alertas"""
+        with self._lock:
+            return ({sign: (self._animals[sign].copy(), self._breeds[sign].copy()) for sign in self.SIGNS},
+                    self.version, list(self.alerts))
+
+    def map_shared(self, stats, version, alerts):
+        """Adopta los acumulados (arreglos de solo lectura) y alertas publicados por el proceso escritor"""
+        with self._lock:
+            for sign, (animals, breeds) in stats.items():
+                self._animals[sign], self._breeds[sign] = animals, breeds
+            self.version = version
+            self.alerts = deque(alerts, maxlen=self.alerts.maxlen)
+
+
+# ============================================================================
+# INGESTA RFID
+# ============================================================================
+
+class RfidIngestor:
+    """
+    Ingesta de lecturas crudas de los lectores RFID.
+    Las repeticiones de un mismo arete en el mismo lector dentro de la
+    ventana se agrupan en un solo evento con su `read_count`; los eventos
+    nuevos se agregan al almacén en bloques.
+    """
+
+    BATCH_SIZE = 5000
+
+    def __init__(self, readings, window=2.0):
+        self.readings = readings
+        self.window = float(window)
+        self._lock = threading.Lock()
+        # (arete, lector) → (fila del evento, inicio del evento)
+        self._open = {}
+
+    def _parse(self, read, now):
+        """Normaliza una lectura cruda; lanza ValueError si es inválida"""
+        if not isinstance(read, dict):
+            raise ValueError('La lectura debe ser un objeto')
+        tag = read.get('rfid') or read.get('rfid_code') or read.get('tag')
+        reader = read.get('reader_id')
+        if not isinstance(tag, str) or not tag or not isinstance(reader, str) or not reader:
+            raise ValueError('Faltan los campos rfid y reader_id')
+        timestamp = read.get('timestamp', now)
+        timestamp = float(timestamp) if isinstance(timestamp, (int, float)) else datetime.fromisoformat(timestamp).timestamp()
+        if not 0 <= timestamp <= MAX_TIMESTAMP:
+            raise ValueError('timestamp fuera de rango')
+        location = read.get('location') or READER_LOCATIONS.get(reader, RFID_LOCATIONS[0])
+        # Solo lectores y ubicaciones registrados: cada uno ocupa un código de las columnas uint8
+        if self.readings.readers.lookup(reader) is None:
+            raise ValueError(f'Lector desconocido: {reader}')
+        if self.readings.locations.lookup(location) is None:
+            raise ValueError(f'Ubicación desconocida: {location}')
+        event = read.get('event_type') or LOCATION_EVENTS.get(location, 'Entrada')
+        if event not in self.readings._event_info:
+            raise ValueError(f'Tipo de evento desconocido: {event}')
+        signal = int(read.get('signal_strength', 100))
+        if not 0 <= signal <= 100:
+            raise ValueError('signal_strength fuera de rango')
+        status = 'Señal Débil' if signal < 35 else 'Exitoso'
+        # La báscula envía el peso junto con la lectura del arete
+        weight = read.get('weight')
+        if weight is not None:
+            weight = float(weight)
+            if event != 'Pesaje' or not 0 < weight < 2000:
+                raise ValueError('weight solo se acepta en eventos Pesaje, entre 0 y 2000 kg')
+        return (_to_bytes(tag.strip().upper(), 16), reader, timestamp, location, event, status, signal,
+                float(read.get('tag_temperature', 0.0)), int(read.get('battery_level', 100)),
+                int(read.get('duration_ms', 0)), float(read.get('distance_meters', 0.0)), weight)
+
+    def ingest(self, reads, now=None):
+        """Procesa un lote de lecturas crudas; retorna el resumen de la ingesta"""
+        now = time.time() if now is None else now
+        summary = {'received': 0, 'accepted': 0, 'merged': 0, 'rejected': 0, 'errors': []}
+        readings = self.readings
+        with self._lock:
+            block = {name: [] for name in ReadingStore.SCHEMA}
+            keys = []
+            repeats = {}
+            weighings = []
+            for index, read in enumerate(reads):
+                summary['received'] += 1
+                try:
+                    (tag, reader, timestamp, location, event, status, signal, temperature, battery, duration,
+                     distance, weight) = self._parse(read, now)
+                except (ValueError, TypeError) as exc:
+                    summary['rejected'] += 1
+                    if len(summary['errors']) < 20:
+                        summary['errors'].append({'index': index, 'error': str(exc)})
+                    continue
+                key = (tag, reader)
+                current = self._open.get(key)
+                if current is not None and 0 <= timestamp - current[1] <= self.window:
+                    # Repetición dentro de la ventana: se suma al evento abierto
+                    target = current[0]
+                    if isinstance(target, tuple):
+                        block['read_count'][target[1]] += 1
+                    else:
+                        repeats[target] = repeats.get(target, 0) + 1
+                    summary['merged'] += 1
+                    continue
+                # Evento nuevo: su fila definitiva se conoce al escribir el bloque
+                self._open[key] = (('block', len(keys)), timestamp)
+                keys.append(key)
+                block['timestamp'].append(int(timestamp))
+                animal = readings.herd.row_of_rfid(tag)
+                block['animal'].append(animal)
+                block['tag'].append(tag)
+                block['reader'].append(readings.readers.encode(reader))
+                block['location'].append(readings.locations.encode(location))
+                block['event'].append(readings.events.encode(event))
+                block['status'].append(readings.statuses.encode(status))
+                block['signal_strength'].append(signal)
+                block['tag_temperature'].append(temperature)
+                block['battery_level'].append(battery)
+                block['read_count'].append(1)
+                block['duration_ms'].append(duration)
+                block['distance_meters'].append(distance)
+                block['notes'].append(0)
+                summary['accepted'] += 1
+                if weight is not None and animal >= 0:
+                    # El pesaje es el de la primera lectura; las repeticiones solo suman lecturas
+                    weighings.append((animal, int(timestamp), weight))
+                if len(keys) >= self.BATCH_SIZE:
+                    self._flush(block, keys)
+                    block = {name: [] for name in ReadingStore.SCHEMA}
+                    keys = []
+            self._flush(block, keys)
+            if repeats:
+                readings.add_reads(list(repeats), list(repeats.values()))
+            if weighings:
+                readings.herd.record_weighings(*zip(*weighings))
+            self._expire(now)
+        return summary
+
+    def _flush(self, block, keys):
+        """Escribe un bloque de eventos nuevos y actualiza el último escaneo del hato"""
+        if not keys:
+            return
+        rows = self.readings.append(block)
+        for offset, key in enumerate(keys):
+            target, started = self._open[key]
+            if target == ('block', offset):
+                self._open[key] = (rows.start + offset, started)
+        herd = self.readings.herd
+        herd.record_scans(block['animal'], block['timestamp'])
+        template = ACTIVITY_TYPES['scan']['template']
+        herd.activity.publish_many(
+            ('scan', template.format(herd.brief(animal)['name'], self.readings.locations.decode(location)),
+             'Sistema', datetime.fromtimestamp(timestamp))
+            for animal, location, timestamp in zip(block['animal'], block['location'], block['timestamp'])
+            if animal >= 0
+        )
+
+    def _expire(self, now):
+        """Descarta los eventos cuya ventana ya cerró"""
+        if len(self._open) < 10000:
+            return
+        limit = now - self.window
+        self._open = {key: value for key, value in self._open.items() if value[1] >= limit}
+
+
+# ============================================================================
+# PASARELA DE LECTORES RFID
+# ============================================================================
+
+class RfidGateway:
+    """
+    Servidor asyncio (TCP y UDP en el mismo puerto) al que se conectan los
+    lectores físicos. Cada trama es una línea JSON con los campos de
+    /api/rfid/readings:batch o un registro binario FRAME que empieza con
+    MAGIC; en TCP se pueden mezclar y en UDP cada datagrama trae una o más.
+
+    Las lecturas esperan en una cola acotada a `max_queued` eventos (incluido
+    el micro-lote que se está ingiriendo). Con la cola llena las conexiones
+    TCP dejan de leer del socket, así el control de flujo de TCP frena al
+    lector; en UDP no hay cómo frenar y las tramas se descartan y se cuentan.
+    Un solo consumidor arma micro-lotes de hasta `batch_size` lecturas o de lo
+    que llegue en `flush_interval` segundos y los entrega a `sink` en un hilo
+    aparte para no bloquear el loop.
+    """
+
+    # Registro binario (little-endian, 43 bytes): magia, lector (n → RFID-00n),
+    # arete, epoch (0 = al recibir), evento (índice en RFID_EVENT_TYPES + 1;
+    # 0 = según la ubicación del lector), señal, temperatura del arete,
+    # batería, distancia (m), duración (ms) y peso (kg, 0 = sin peso)
+    FRAME = struct.Struct('<BB16sdBBfBfHf')
+    MAGIC = 0xA5
+
+    # Una línea sin salto de línea más larga que esto se descarta y se cierra la conexión
+    MAX_LINE = 64 * 1024
+
+    def __init__(self, sink, max_queued=50000, batch_size=2000, flush_interval=0.05):
+        self.sink = sink
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.address = None
+        self._loop = None
+        # Eventos y condición del loop de la pasarela (se crean dentro del loop)
+        self._ready = self._full = self._space = None
+        self._buffer = []
+        self._queued = 0
+        self._ingest = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rfid-gateway-ingest')
+        self._started = threading.Event()
+        self._error = None
+        self.stats = {
+            'connections': 0, 'connections_total': 0, 'frames': 0, 'malformed': 0, 'dropped': 0,
+            'backpressure_waits': 0, 'batches': 0, 'accepted': 0, 'merged': 0, 'rejected': 0,
+            'last_batch_ms': 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    # Arranque
+    # ------------------------------------------------------------------
+
+    def start(self, address):
+        """Escucha en `host:puerto` desde un hilo propio; lanza OSError si no puede abrir el puerto"""
+        host, _, port = address.rpartition(':')
+        threading.Thread(target=self._run, args=(host or '0.0.0.0', int(port)), name='rfid-gateway',
+                         daemon=True).start()
+        self._started.wait()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self, host, port):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve(host, port))
+        except OSError as error:
+            self._error = error
+            self._started.set()
+
+    async def _serve(self, host, port):
+        self._ready = asyncio.Event()
+        self._full = asyncio.Event()
+        self._space = asyncio.Condition()
+        server = await asyncio.start_server(self._handle, host, port, backlog=4096)
+        self.address = server.sockets[0].getsockname()[:2]
+        await self._loop.create_datagram_endpoint(lambda: RfidGatewayDatagrams(self), local_addr=(host, self.address[1]))
+        self._started.set()
+        async with server:
+            await self._drain()
+
+    # ------------------------------------------------------------------
+    # Tramas
+    # ------------------------------------------------------------------
+
+    def _decode(self, buffer, now):
+        """
+        Separa las tramas completas del buffer; retorna (lecturas, bytes
+        consumidos). Lo que queda es una trama incompleta.
+        """
+        reads = []
+        size = self.FRAME.size
+        position = 0
+        end = len(buffer)
+        while position < end:
+            if buffer[position] == self.MAGIC:
+                if end - position < size:
+                    break
+                (_, reader, tag, timestamp, event, signal, temperature, battery, distance, duration,
+                 weight) = self.FRAME.unpack_from(buffer, position)
+                position += size
+                read = {
+                    'rfid': tag.rstrip(b'\0').decode('ascii', 'replace'),
+                    'reader_id': f'RFID-{reader:03d}',
+                    'timestamp': timestamp or now,
+                    'signal_strength': signal,
+                    'tag_temperature': round(temperature, 1),
+                    'battery_level': battery,
+                    'distance_meters': round(distance, 2),
+                    'duration_ms': duration,
+                }
+                if 0 < event <= len(RFID_EVENT_TYPES):
+                    read['event_type'] = RFID_EVENT_TYPES[event - 1]['name']
+                if weight > 0:
+                    read['weight'] = round(weight, 1)
+                reads.append(read)
+                continue
+            newline = buffer.find(b'\n', position)
+            if newline < 0:
+                break
+            line = bytes(buffer[position:newline]).strip()
+            position = newline + 1
+            if not line:
+                continue
+            try:
+                reads.append(json.loads(line))
+            except ValueError:
+                self.stats['malformed'] += 1
+        return reads, position
+
+    async def _handle(self, reader, writer):
+        """Conexión TCP de un lector: decodifica lo que llega y espera si la cola está llena"""
+        self.stats['connections'] += 1
+        self.stats['connections_total'] += 1
+        buffer = bytearray()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                buffer += data
+                reads, consumed = self._decode(buffer, time.time())
+                del buffer[:consumed]
+                if len(buffer) > self.MAX_LINE:
+                    self.stats['malformed'] += 1
+                    break
+                if reads:
+                    await self._put(reads)
+        except ConnectionError:
+            pass
+        finally:
+            self.stats['connections'] -= 1
+            writer.close()
+
+    async def _put(self, reads):
+        """Encola lecturas de TCP; con la cola llena espera a que el consumidor libere espacio"""
+        if self._queued >= self.max_queued:
+            self.stats['backpressure_waits'] += 1
+            async with self._space:
+                await self._space.wait_for(lambda: self._queued < self.max_queued)
+        self._enqueue(reads)
+
+    def offer(self, reads):
+        """Encola lecturas de UDP sin esperar; las que no caben se descartan"""
+        room = max(self.max_queued - self._queued, 0)
+        if len(reads) > room:
+            self.stats['dropped'] += len(reads) - room
+            reads = reads[:room]
+        if reads:
+            self._enqueue(reads)
+
+    def _enqueue(self, reads):
+        self.stats['frames'] += len(reads)
+        self._buffer.extend(reads)
+        self._queued += len(reads)
+        self._ready.set()
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+
+    # ------------------------------------------------------------------
+    # Micro-lotes
+    # ------------------------------------------------------------------
+
+    async def _drain(self):
+        while True:
+            await self._ready.wait()
+            if len(self._buffer) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._buffer[:self.batch_size]
+            del self._buffer[:self.batch_size]
+            if len(self._buffer) < self.batch_size:
+                self._full.clear()
+            if not self._buffer:
+                self._ready.clear()
+            started = time.perf_counter()
+            try:
+                summary = await self._loop.run_in_executor(self._ingest, self.sink, batch)
+            except Exception:
+                app.logger.exception('La pasarela RFID no pudo ingerir un lote de %d lecturas', len(batch))
+                summary = {'rejected': len(batch)}
+            self.stats['last_batch_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            self.stats['batches'] += 1
+            for name in ('accepted', 'merged', 'rejected'):
+                self.stats[name] += summary.get(name, 0)
+            self._queued -= len(batch)
+            async with self._space:
+                self._space.notify_all()
+
+    def snapshot(self):
+        """Contadores de la pasarela para la API"""
+        return {'address': f'{self.address[0]}:{self.address[1]}' if self.address else None,
+                'queued': self._queued, 'max_queued': self.max_queued, **self.stats}
+
+
+class RfidGatewayDatagrams(asyncio.DatagramProtocol):
+    """Lecturas por UDP: cada datagrama trae tramas completas"""
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    def datagram_received(self, data, addr):
+        # La última línea JSON del datagrama puede venir sin salto de línea
+        reads, consumed = self.gateway._decode(data + b'\n', time.time())
+        if consumed < len(data) + 1:
+            self.gateway.stats['malformed'] += 1
+        self.gateway.offer(reads)
+
+
+# ============================================================================
+# INSTANTÁNEA COMPARTIDA
+# ============================================================================
+
+class SharedSnapshot:
+    """
+    Instantánea de las columnas del hato, lecturas, salud, pesajes y signos
+    vitales en archivos que los workers de gunicorn mapean en memoria sin
+    copiarlos (las páginas se comparten entre procesos). Solo el proceso que
+    toma `writer.lock` carga la base, atiende las escrituras y publica.
+
+    Las tablas son de solo inserción salvo las columnas SHARED_MUTABLE: las
+    demás se publican agregando al final de un archivo por columna, así lo
+    que un worker ya mapeó nunca cambia, y las modificables se escriben
+    completas en un archivo nuevo por versión. `current.json` se reemplaza
+    con os.replace y define la versión vigente. Cada worker construye sus
+    índices derivados y los actualiza solo con las filas nuevas.
+    """
+
+    MANIFEST = 'current.json'
+
+    # Manifiestos cuyos archivos se conservan para los workers que aún los abren
+    KEEP = 3
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.writer = False
+        self.generation = None
+        self.store = None
+        self.database = None
+        self._lock_file = None
+        self._publish_lock = threading.Lock()
+        self._published = {}
+        self._appended = {}
+        self._states = {}
+        self._history = deque()
+        self._serial = 0
+        self._mapped = None
+
+    def _path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    @staticmethod
+    def _parts(herd):
+        # El hato va primero: las demás tablas referencian sus filas y razas
+        return {'herd': herd, 'readings': herd.readings, 'health': herd.health, 'weights': herd.weights}
+
+    def elect(self):
+        """Intenta tomar el candado de escritor; True si este proceso queda como escritor"""
+        if fcntl is None:
+            raise RuntimeError('La instantánea compartida requiere fcntl (Linux/Unix)')
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(self._path('writer.lock'), 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+        self.writer = True
+        return True
+
+    # ------------------------------------------------------------------
+    # Proceso escritor
+    # ------------------------------------------------------------------
+
+    def start_writer(self, herd, interval):
+        """Publica la primera versión y luego una nueva cada `interval` segundos si hubo cambios"""
+        for name in os.listdir(self.directory):
+            if name.startswith('g-'):
+                shutil.rmtree(self._path(name), ignore_errors=True)
+        self.generation = f"g-{int(time.time())}-{os.getpid()}"
+        os.makedirs(self._path(self.generation))
+        self.store = herd
+        self.publish(herd)
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.publish(herd)
+                except Exception:
+                    app.logger.exception('No se pudo publicar la instantánea compartida')
+
+        threading.Thread(target=run, name='snapshot-publisher', daemon=True).start()
+
+    def publish(self, herd):
+        """Escribe las tablas que cambiaron desde la versión anterior y reemplaza el manifiesto"""
+        with self._publish_lock:
+            entries = dict(self._published)
+            for name, part in self._parts(herd).items():
+                entry = entries.get(name)
+                if entry is None or entry['version'] != part.version:
+                    entries[name] = self._write_table(name, part)
+            entry = entries.get('vitals')
+            if entry is None or entry['version'] != herd.vitals.version:
+                entries['vitals'] = self._write_vitals(herd.vitals)
+            entry = entries.get('activity')
+            if entry is None or entry['version'] != herd.activity.last_id:
+                last_id, events = herd.activity.shared_state()
+                entries['activity'] = {'version': last_id, 'state': self._write_json(f'activity.{last_id}.json', events)}
+            if entries == self._published:
+                return False
+            self._serial += 1
+            manifest = {'generation': self.generation, 'serial': self._serial, 'published': time.time(), **entries}
+            temporary = self._path(f'{self.MANIFEST}.{os.getpid()}')
+            with open(temporary, 'w', encoding='utf-8') as handle:
+                json.dump(manifest, handle)
+            os.replace(temporary, self._path(self.MANIFEST))
+            self._published = entries
+            self._collect(entries)
+            return True
+
+    def _write_table(self, name, part):
+        columns, version, state = part.shared_state()
+        size = len(columns['id'])
+        start = self._appended.get(name, 0)
+        files = {}
+        for column, values in columns.items():
+            if column in part.SHARED_MUTABLE:
+                files[column] = self._write(f'{name}.{column}.{version}', values)
+            else:
+                files[column] = f'{name}.{column}'
+                with open(self._path(self.generation, files[column]), 'ab') as handle:
+                    handle.write(values[start:size].tobytes())
+        self._appended[name] = size
+        return {
+            'version': version,
+            'rows': size,
+            'columns': {column: [files[column], np.dtype(part.SCHEMA[column]).str] for column in columns},
+            'state': self._write_state(name, version, state),
+        }
+
+    def _write_state(self, name, version, state):
+        """Archivo del estado auxiliar; si no cambió se reutiliza el de la versión anterior"""
+        text = json.dumps(state)
+        previous = self._states.get(name)
+        if previous is not None and previous[0] == text:
+            return previous[1]
+        filename = f'{name}.state.{version}.json'
+        with open(self._path(self.generation, filename), 'w', encoding='utf-8') as handle:
+            handle.write(text)
+        self._states[name] = (text, filename)
+        return filename
+
+    def _write_vitals(self, vitals):
+        stats, version, alerts = vitals.shared_state()
+        return {
+            'version': version,
+            'signs': {sign: [[self._write(f'vitals.{sign}.{kind}.{version}', values), list(values.shape)]
+                             for kind, values in zip(('animals', 'breeds'), arrays)]
+                      for sign, arrays in stats.items()},
+            'state': self._write_json(f'vitals.state.{version}.json', alerts),
+        }
+
+    def _write(self, filename, values):
+        with open(self._path(self.generation, filename), 'wb') as handle:
+            handle.write(np.ascontiguousarray(values).tobytes())
+        return filename
+
+    def _write_json(self, filename, value):
+        with open(self._path(self.generation, filename), 'w', encoding='utf-8') as handle:
+            json.dump(value, handle)
+        return filename
+
+    def _collect(self, entries):
+        """Borra los archivos versionados que ya no referencia ninguno de los últimos KEEP manifiestos"""
+        referenced = set()
+        for entry in entries.values():
+            referenced.add(entry['state'])
+            referenced.update(file for file, _ in entry.get('columns', {}).values())
+            referenced.update(file for arrays in entry.get('signs', {}).values() for file, _ in arrays)
+        self._history.append(referenced)
+        if len(self._history) > self.KEEP:
+            expired = self._history.popleft() - set().union(*self._history)
+            for filename in expired:
+                try:
+                    os.unlink(self._path(self.generation, filename))
+                except FileNotFoundError:
+                    pass
+
+    def serve(self, apply):
+        """Atiende en `writer.sock` las escrituras que reenvían los demás workers"""
+        path = self._path('writer.sock')
+        if os.path.exists(path):
+            os.unlink(path)
+        server = socketserver.ThreadingUnixStreamServer(path, ForwardedWriteHandler)
+        server.daemon_threads = True
+        server.apply = apply
+        threading.Thread(target=server.serve_forever, name='snapshot-writes', daemon=True).start()
+
+    # ------------------------------------------------------------------
+    # Workers lectores
+    # ------------------------------------------------------------------
+
+    def open_reader(self, database, timeout=600):
+        """
+        Espera la primera versión publicada por el escritor y la mapea.
+        La base solo se usa para las lecturas archivadas (anteriores a `horizon`).
+        """
+        self.database = database
+        deadline = time.time() + timeout
+        while True:
+            try:
+                if self.refresh():
+                    return self.store
+            except (FileNotFoundError, ValueError):
+                # Manifiesto de un escritor anterior o a medio reemplazar
+                self.store = self._mapped = None
+            if time.time() > deadline:
+                raise RuntimeError(f'No hay instantánea publicada en {self.directory}')
+            time.sleep(0.2)
+
+    def follow(self, interval, on_swap):
+        """
+        Revisa el manifiesto cada `interval` segundos. Si el escritor se
+        reinició (generación nueva) se mapea un almacén nuevo y se entrega a `on_swap`.
+        """
+        def run():
+            while True:
+                time.sleep(interval)
+                store = self.store
+                try:
+                    if self.refresh() and self.store is not store:
+                        on_swap(self.store)
+                except Exception:
+                    app.logger.exception('No se pudo mapear la instantánea compartida')
+
+        threading.Thread(target=run, name='snapshot-follower', daemon=True).start()
+
+    def refresh(self):
+        """
+        Aplica el manifiesto vigente si es más nuevo que el mapeado; True si
+        cambió algo. Las tablas reciben state None si su estado auxiliar no cambió.
+        """
+        try:
+            with open(self._path(self.MANIFEST), encoding='utf-8') as handle:
+                manifest = json.load(handle)
+        except FileNotFoundError:
+            return False
+        previous = self._mapped
+        if previous is not None and previous['generation'] == manifest['generation']:
+            if previous['serial'] >= manifest['serial']:
+                return False
+            store = self.store
+        else:
+            previous = None
+            store = HerdStore()
+            store.readings.db = self.database
+        base = os.path.join(self.directory, manifest['generation'])
+        for name, part in self._parts(store).items():
+            entry = manifest[name]
+            if previous is not None and previous[name]['version'] == entry['version']:
+                continue
+            columns = {column: self._map(base, file, dtype, (entry['rows'],))
+                       for column, (file, dtype) in entry['columns'].items()}
+            unchanged = previous is not None and previous[name]['state'] == entry['state']
+            part.map_shared(columns, entry['rows'], entry['version'],
+                            None if unchanged else self._read_json(base, entry['state']))
+        entry = manifest['vitals']
+        if previous is None or previous['vitals']['version'] != entry['version']:
+            store.vitals.map_shared({sign: tuple(self._map(base, file, np.float64, tuple(shape)) for file, shape in arrays)
+                                     for sign, arrays in entry['signs'].items()},
+                                    entry['version'], self._read_json(base, entry['state']))
+        entry = manifest['activity']
+        if previous is None or previous['activity']['version'] != entry['version']:
+            store.activity.sync(self._read_json(base, entry['state']))
+        self.store, self.generation, self._mapped = store, manifest['generation'], manifest
+        return True
+
+    @staticmethod
+    def _map(base, filename, dtype, shape):
+        if not np.prod(shape):
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(base, filename), dtype=dtype, mode='r', shape=shape)
+
+    @staticmethod
+    def _read_json(base, filename):
+        with open(os.path.join(base, filename), encoding='utf-8') as handle:
+            return json.load(handle)
+
+    def forward(self, operation, payload, timeout=30):
+        """Envía una escritura al proceso escritor y retorna su resultado"""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(timeout)
+            connection.connect(self._path('writer.sock'))
+            with connection.makefile('rwb') as stream:
+                stream.write(json.dumps({'operation': operation, 'payload': payload}).encode('utf-8') + b'\n')
+                stream.flush()
+                line = stream.readline()
+        if not line:
+            raise RuntimeError('El proceso escritor cerró la conexión')
+        result = json.loads(line)
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+        return result['data']
+
+
+class ForwardedWriteHandler(socketserver.StreamRequestHandler):
+    """Escrituras reenviadas al proceso escritor: una línea JSON por solicitud y otra por respuesta"""
+
+    def handle(self):
+        for line in self.rfile:
+            request_data = json.loads(line)
+            try:
+                result = {'data': self.server.apply(request_data['operation'], request_data['payload'])}
+            except (KeyError, ValueError, TypeError, RuntimeError) as error:
+                result = {'error': str(error)}
+            self.wfile.write(json.dumps(result, default=str).encode('utf-8') + b'\n')
+
+
+def _swap_herd_store(store):
+    """Reemplaza el almacén global cuando el escritor se reinicia con una generación nueva"""
+    global herd_store, rfid_ingestor
+    herd_store = store
+    rfid_ingestor = RfidIngestor(store.readings, window=app.config['RFID_DEDUP_WINDOW'])
+    response_cache.clear()
+    row_cache.clear()
+
+
+# Instancia global de la base, el hato y la ingesta RFID. Con SNAPSHOT_DIR solo
+# el worker que toma el candado carga la base; los demás mapean su instantánea
+database = Database(app.config['DATABASE'])
+shared_snapshot = SharedSnapshot(app.config['SNAPSHOT_DIR']) if app.config['SNAPSHOT_DIR'] else None
+if shared_snapshot is not None and not shared_snapshot.elect():
+    herd_store = shared_snapshot.open_reader(database)
+    shared_snapshot.follow(app.config['SNAPSHOT_INTERVAL'], _swap_herd_store)
+else:
+    herd_store = HerdStore.open(database, BatchGenerator(app.config['DATA_SEED']), app.config['HERD_SIZE'],
+                                app.config['READINGS_MEMORY_DAYS'])
+    if shared_snapshot is not None:
+        shared_snapshot.start_writer(herd_store, app.config['SNAPSHOT_INTERVAL'])
+rfid_ingestor = RfidIngestor(herd_store.readings, window=app.config['RFID_DEDUP_WINDOW'])
+
+# ============================================================================
+# EXPORTACIÓN
+# ============================================================================
+
+# Filas serializadas por bloque: la memoria depende del bloque, no del total
+EXPORT_CHUNK = 5000
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Nivel de gzip de las descargas .gz (archivos que se guardan, se prioriza el tamaño)
+EXPORT_GZIP_LEVEL = 6
+
+def _flat_value(value):
+    """Los valores anidados (estado, tipo de evento) se exportan por nombre"""
+    return value.get('name') if isinstance(value, dict) else value
+
+def export_csv(batches):
+    """CSV por bloques de registros; el encabezado sale de las claves del primer registro"""
+    header = None
+    for records in batches:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if header is None:
+            header = list(records[0])
+            writer.writerow(header)
+        writer.writerows([_flat_value(record[key]) for key in header] for record in records)
+        yield buffer.getvalue()
+
+def export_ndjson(batches):
+    """Un objeto JSON por línea, por bloques de registros"""
+    for records in batches:
+        yield b''.join(dump_json(record) + b'\n' for record in records)
+
+def dump_json(obj, default=None):
+    """JSON compacto en bytes UTF-8, con orjson si está instalado"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default).encode('utf-8')
+
+
+# ============================================================================
+# COMPRESIÓN DE RESPUESTAS
+# ============================================================================
+
+# Codificaciones en orden de preferencia cuando el cliente acepta varias
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Tipos que se comprimen; los eventos SSE quedan fuera porque cada uno debe
+# llegar en cuanto ocurre
+COMPRESSIBLE_TYPES = frozenset({
+    'application/json', 'application/x-ndjson', 'application/javascript', 'image/svg+xml',
+    'text/html', 'text/csv', 'text/plain', 'text/css', 'text/javascript',
+})
+
+
+class BrotliStream:
+    """Compresor brotli incremental con la interfaz de zlib.compressobj"""
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def negotiate_encoding(size, mimetype):
+    """Codificación que acepta el cliente para una respuesta de `size` bytes (None si no conviene)"""
+    if mimetype not in COMPRESSIBLE_TYPES or (size is not None and size < app.config['COMPRESS_MIN_SIZE']):
+        return None
+    return request.accept_encodings.best_match(ENCODINGS)
+
+def compressor(encoding, level=None):
+    if encoding == 'br':
+        return BrotliStream(level or app.config['COMPRESS_BROTLI_QUALITY'])
+    return zlib.compressobj(level or app.config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+
+def compress_body(data, encoding):
+    """Cuerpo completo comprimido en br o gzip"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+    stream = compressor(encoding)
+    return stream.compress(data) + stream.flush()
+
+def compress_stream(chunks, encoding='gzip', level=None):
+    """Comprime un flujo de texto o bytes sin acumularlo"""
+    stream = compressor(encoding, level)
+    try:
+        for chunk in chunks:
+            data = stream.compress(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+            if data:
+                yield data
+        yield stream.flush()
+    finally:
+        # Cierra el generador original (stream_with_context libera ahí el contexto)
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+# ============================================================================
+# SERIALIZACIÓN
+# ============================================================================
+
+class DisplayFormat:
+    """
+    Formatos de presentación de un idioma. Los registros solo llevan valores
+    canónicos (fechas ISO, números); los textos para mostrar se calculan al
+    serializar y únicamente los que pide la solicitud.
+    """
+
+    LOCALES = {
+        'es': {'date': '%d/%m/%Y', 'datetime': '%d/%m/%Y %H:%M', 'day_time': '%d/%m %H:%M',
+               'time': '%H:%M', 'time_seconds': '%H:%M:%S', 'years': 'a', 'months': 'm'},
+        'en': {'date': '%m/%d/%Y', 'datetime': '%m/%d/%Y %I:%M %p', 'day_time': '%m/%d %I:%M %p',
+               'time': '%I:%M %p', 'time_seconds': '%I:%M:%S %p', 'years': 'y', 'months': 'mo'},
+    }
+
+    DEFAULT = 'es'
+
+    def __init__(self, locale=DEFAULT):
+        self.locale = locale if locale in self.LOCALES else self.DEFAULT
+        self.formats = self.LOCALES[self.locale]
+
+    def format(self, value, style):
+        """Texto de un valor canónico: edad en meses o fecha ISO según `style`"""
+        if style == 'age':
+            years, months = divmod(int(value), 12)
+            return f"{years}{self.formats['years']} {months}{self.formats['months']}" if years else \
+                f"{months}{self.formats['months']}"
+        return datetime.fromisoformat(value).strftime(self.formats[style])
+
+
+DISPLAY_FORMATS = {locale: DisplayFormat(locale) for locale in DisplayFormat.LOCALES}
+
+# Campos de presentación de cada tipo de registro: campo → (campo canónico, estilo)
+DISPLAY_FIELDS = {
+    'animals': {
+        'age_display': ('age_months', 'age'),
+        'last_scan_display': ('last_scan', 'datetime'),
+        'lastCheck': ('last_scan', 'day_time'),
+    },
+    'health': {
+        'checkup_date_display': ('checkup_timestamp', 'date'),
+        'checkup_time': ('checkup_timestamp', 'time'),
+        'next_checkup_display': ('next_checkup', 'date'),
+    },
+    'rfid': {
+        'scan_date': ('scan_timestamp', 'date'),
+        'scan_time': ('scan_timestamp', 'time_seconds'),
+        'scan_datetime_display': ('scan_timestamp', 'datetime'),
+    },
+}
+
+def display_format():
+    """Formato de la solicitud: ?locale= o, si no, Accept-Language"""
+    if 'display_format' not in g:
+        locale = request.args.get('locale') or request.accept_languages.best_match(DISPLAY_FORMATS)
+        g.display_format = DISPLAY_FORMATS.get(locale, DISPLAY_FORMATS[DisplayFormat.DEFAULT])
+    return g.display_format
+
+def display_fields(kind, default='none'):
+    """Campos de presentación pedidos con ?display= (all, none o lista de campos)"""
+    requested = request.args.get('display', default)
+    fields = DISPLAY_FIELDS[kind]
+    if requested == 'all':
+        return list(fields.items())
+    return [(name, fields[name]) for name in requested.split(',') if name in fields]
+
+# Campos de los registros de cada tipo, en el orden en que se serializan
+RECORD_FIELDS = {'animals': HerdStore.FIELDS, 'health': HealthStore.FIELDS, 'rfid': ReadingStore.FIELDS}
+
+class Projection:
+    """
+    Campos pedidos con ?fields= (solo esos) o ?exclude= (todos menos esos),
+    canónicos o de presentación y separados por coma; `id` siempre se
+    incluye. `columns` son los campos que lee y formatea el almacén (None =
+    todos), incluidos los que solo hacen falta para calcular los campos de
+    presentación pedidos, que se quitan al serializar (`hidden`). `extra`
+    son campos que la ruta agrega por su cuenta.
+    """
+
+    def __init__(self, kind, default='none', extra=()):
+        fields = RECORD_FIELDS[kind]
+        requested = [name for name in request.args.get('fields', '', type=str).split(',') if name]
+        excluded = [name for name in request.args.get('exclude', '', type=str).split(',') if name]
+        known = set(fields) | set(DISPLAY_FIELDS[kind]) | set(extra)
+        for name in requested + excluded:
+            if name not in known:
+                raise ValueError(f'Campo desconocido: {name}')
+        display = dict(display_fields(kind, default))
+        self.output = None
+        if requested:
+            self.output = set(requested) - set(excluded) | {'id'}
+            display = {name: spec for name, spec in DISPLAY_FIELDS[kind].items() if name in self.output}
+        elif excluded:
+            self.output = (set(fields) | set(display) | set(extra)) - set(excluded) | {'id'}
+            display = {name: spec for name, spec in display.items() if name in self.output}
+        self.display = list(display.items())
+        if self.output is None:
+            self.columns, self.hidden = None, ()
+        else:
+            sources = {source for source, _ in display.values()}
+            self.columns = [name for name in fields if name in self.output or name in sources]
+            self.hidden = frozenset(sources - self.output)
+
+    def wants(self, name):
+        """Si la respuesta lleva el campo `name`"""
+        return self.output is None or name in self.output
+
+
+def serialize(kind, records, default='none', projection=None):
+    """
+    Agrega a los registros los campos de presentación pedidos (con
+    `projection`, los de la proyección, y quita los que solo se leyeron para
+    calcularlos). Los registros canónicos (p. ej. los de `row_cache`) no se
+    modifican.
+    """
+    if projection is None:
+        fields, hidden = display_fields(kind, default), ()
+    else:
+        fields, hidden = projection.display, projection.hidden
+    if not fields and not hidden:
+        return records
+    formatter = display_format()
+    if hidden:
+        return [{**{name: value for name, value in record.items() if name not in hidden},
+                 **{name: formatter.format(record[source], style) for name, (source, style) in fields}}
+                for record in records]
+    return [{**record, **{name: formatter.format(record[source], style) for name, (source, style) in fields}}
+            for record in records]
+
+
+# ============================================================================
+# ANALÍTICA
+# ============================================================================
+
+# Pool de hilos para los recorridos grandes: numpy suelta el GIL en las
+# operaciones vectorizadas, así que los bloques se procesan en paralelo
+analytics_pool = ThreadPoolExecutor(max_workers=app.config['ANALYTICS_WORKERS'], thread_name_prefix='analytics')
+
+class GroupByQuery:
+    """
+    Agrupación vectorizada sobre las columnas del hato o de las lecturas.
+    Cada combinación de dimensiones se codifica como un entero (códigos
+    mezclados en base mixta) y conteos y sumas salen de np.bincount por
+    bloques de filas, que se reparten en el pool cuando la tabla es grande.
+    """
+
+    # Filas por bloque del recorrido y límite de combinaciones del resultado
+    CHUNK = 1 << 18
+    MAX_CELLS = 1 << 20
+
+    # Dimensiones y métricas por fuente; las de la fuente rfid que vienen del
+    # hato se unen por la fila del animal (las lecturas sin animal se omiten)
+    SOURCES = {
+        'animals': {
+            'dimensions': ('breed', 'location', 'owner', 'status', 'day'),
+            'metrics': ('count', 'avg_weight', 'avg_health_score', 'vaccination_rate'),
+        },
+        'rfid': {
+            'dimensions': ('reader', 'location', 'status', 'event', 'day', 'breed', 'owner'),
+            'metrics': ('count', 'success_rate', 'avg_signal', 'avg_weight', 'avg_health_score'),
+        },
+    }
+
+    def __init__(self, herd, source, dimensions, metrics, filters=None, start=None, end=None):
+        spec = self.SOURCES[source]
+        for name in dimensions + list(filters or ()):
+            if name not in spec['dimensions']:
+                raise ValueError(f'Dimensión no soportada para {source}: {name}')
+        for name in metrics:
+            if name not in spec['metrics']:
+                raise ValueError(f'Métrica no soportada para {source}: {name}')
+        self.herd = herd
+        self.source = source
+        self.dimensions = list(dimensions)
+        self.metrics = list(metrics)
+        self.start, self.end = start, end
+        if source == 'animals':
+            self.count = len(herd)
+            self.time = herd.column('last_scan')
+            self.animals = None
+        else:
+            readings = herd.readings
+            self.count = len(readings)
+            self.time = readings.column('timestamp')
+            self.animals = readings.column('animal')
+        self.first_day = self._first_day()
+        self.labels = {name: self._labels(name) for name in set(self.dimensions) | set(filters or ())}
+        # Filtros: códigos aceptados de cada dimensión (los valores desconocidos no coinciden)
+        self.filters = {}
+        for name, values in (filters or {}).items():
+            codes = {label: code for code, label in enumerate(self.labels[name])}
+            self.filters[name] = np.array([codes[value] for value in values if value in codes], dtype=np.int64)
+        self.cells = 1
+        for name in self.dimensions:
+            self.cells *= max(len(self.labels[name]), 1)
+        if self.cells > self.MAX_CELLS:
+            raise ValueError('Demasiadas combinaciones de dimensiones; acota el rango o las dimensiones')
+
+    def _first_day(self):
+        if self.start is not None:
+            return local_day(self.start)
+        return local_day(self.time.min()) if self.count else 0
+
+    def _labels(self, name):
+        """Etiquetas de una dimensión en orden de código"""
+        if name == 'day':
+            last = self.end if self.end is not None else (int(self.time.max()) + 1 if self.count else 0)
+            days = local_day(last - 1) - self.first_day + 1 if last > local_midnight(self.first_day) else 0
+            return [datetime.fromtimestamp(local_midnight(self.first_day + day)).strftime('%Y-%m-%d')
+                    for day in range(days)]
+        if self.source == 'rfid' and name in ('reader', 'location', 'status', 'event'):
+            readings = self.herd.readings
+            dictionary = {'reader': readings.readers, 'location': readings.locations,
+                          'status': readings.statuses, 'event': readings.events}[name]
+            return list(dictionary.values)
+        return self.herd.labels(name)
+
+    def _codes(self, name, chunk, animals):
+        """Códigos de una dimensión para las filas del bloque"""
+        if name == 'day':
+            return local_days(self.time[chunk]) - self.first_day
+        if self.source == 'rfid' and name in ('reader', 'location', 'status', 'event'):
+            return self.herd.readings.column(name)[chunk].astype(np.int64)
+        column = self.herd.column(name)
+        return (column[chunk] if animals is None else column[animals]).astype(np.int64)
+
+    def _values(self, name, chunk, animals):
+        """Valores por fila de una métrica (el conteo no necesita valores)"""
+        if name == 'success_rate':
+            success = self.herd.readings.statuses.lookup(RFID_READ_STATUSES[0]['name'])
+            return (self.herd.readings.column('status')[chunk] == success) * 100.0
+        if name == 'avg_signal':
+            return self.herd.readings.column('signal_strength')[chunk]
+        if name == 'vaccination_rate':
+            return self.herd.column('vaccinated')[chunk] * 100.0
+        column = self.herd.column({'avg_weight': 'weight', 'avg_health_score': 'health_score'}[name])
+        return column[chunk] if animals is None else column[animals]
+
+    def _needs_animal(self):
+        """Si la consulta sobre lecturas usa columnas del hato"""
+        herd_columns = {'breed', 'owner', 'avg_weight', 'avg_health_score'}
+        return self.source == 'rfid' and bool(herd_columns & set(self.dimensions + self.metrics + list(self.filters)))
+
+    def _scan(self, chunk):
+        """Conteos y sumas por combinación de un bloque de filas"""
+        keep = np.ones(chunk.stop - chunk.start, dtype=bool)
+        if self.start is not None:
+            keep &= self.time[chunk] >= self.start
+        if self.end is not None:
+            keep &= self.time[chunk] < self.end
+        animals = None
+        if self._needs_animal():
+            animals = self.animals[chunk]
+            keep &= animals >= 0
+            animals = np.maximum(animals, 0)
+        for name, codes in self.filters.items():
+            keep &= np.isin(self._codes(name, chunk, animals), codes)
+        key = np.zeros(int(keep.sum()), dtype=np.int64)
+        for name in self.dimensions:
+            codes = self._codes(name, chunk, animals)[keep]
+            key = key * max(len(self.labels[name]), 1) + codes
+        counts = np.bincount(key, minlength=self.cells)
+        sums = {
+            name: np.bincount(key, weights=np.asarray(self._values(name, chunk, animals), dtype=np.float64)[keep],
+                              minlength=self.cells)
+            for name in self.metrics if name != 'count'
+        }
+        return counts, sums
+
+    def run(self):
+        """Filas del resultado (una por combinación con datos) y total de filas agrupadas"""
+        chunks = [slice(offset, min(offset + self.CHUNK, self.count)) for offset in range(0, self.count, self.CHUNK)]
+        parts = list(analytics_pool.map(self._scan, chunks)) if len(chunks) > 1 else [self._scan(chunk) for chunk in chunks]
+        counts = np.zeros(self.cells, dtype=np.int64)
+        sums = {name: np.zeros(self.cells) for name in self.metrics if name != 'count'}
+        for part_counts, part_sums in parts:
+            counts += part_counts
+            for name, values in part_sums.items():
+                sums[name] += values
+        cells = np.flatnonzero(counts)
+        # Códigos de cada dimensión a partir de la clave combinada
+        columns = {}
+        rest = cells
+        for name in reversed(self.dimensions):
+            size = max(len(self.labels[name]), 1)
+            columns[name] = rest % size
+            rest = rest // size
+        rows = []
+        for position, cell in enumerate(cells.tolist()):
+            row = {name: self.labels[name][int(columns[name][position])] for name in self.dimensions}
+            for name in self.metrics:
+                row[name] = int(counts[cell]) if name == 'count' else round(float(sums[name][cell] / counts[cell]), 2)
+            rows.append(row)
+        return rows, int(counts.sum())
+
+
+# ============================================================================
+# CACHÉ DE RESPUESTAS
+# ============================================================================
+
+class ResponseCache:
+    """
+    Caché LRU de respuestas ya serializadas. Cada entrada guarda la versión
+    de los datos con que se generó y vence por TTL o al cambiar la versión.
+    """
+
+    def __init__(self, max_entries=256, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """Entrada vigente para la clave y versión, o None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['version'] != version or entry['expires'] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, body, mimetype):
+        """Guarda un cuerpo serializado con su ETag fuerte (hash del contenido)"""
+        entry = {
+            'version': version,
+            'expires': time.monotonic() + self.ttl,
+            'etag': hashlib.blake2b(body, digest_size=16).hexdigest(),
+            'body': body,
+            'mimetype': mimetype,
+            # Cuerpos comprimidos por codificación, se llenan al pedirlos
+            'encoded': {},
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache(app.config['RESPONSE_CACHE_SIZE'], app.config['RESPONSE_CACHE_TTL'])
+
+class RowCache:
+    """
+    LRU de registros ya serializados (dicts) para las páginas de las vistas.
+    Cada entrada se valida con la versión de su fila, así que un cambio en
+    un animal o lectura solo invalida ese registro.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def dicts(self, name, store, rows):
+        """Serializa `rows` de `store`, reutilizando los registros vigentes"""
+        rows = [int(row) for row in rows]
+        versions = store.row_versions(rows)
+        result = []
+        with self._lock:
+            for row, version in zip(rows, versions):
+                entry = self._entries.get((name, row))
+                if entry is not None and entry[0] == version:
+                    self._entries.move_to_end((name, row))
+                    result.append(entry[1])
+                else:
+                    result.append(None)
+        missing = [i for i, record in enumerate(result) if record is None]
+        if missing:
+            # Las filas que faltan se serializan juntas, por columnas
+            records = store.to_dicts([rows[i] for i in missing])
+            with self._lock:
+                for i, record in zip(missing, records):
+                    result[i] = record
+                    self._entries[(name, rows[i])] = (versions[i], record)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+row_cache = RowCache(app.config['ROW_CACHE_SIZE'])
+
+def current_minute():
+    """Período de los cuerpos con conteos relativos a ahora (últimas 24 horas)"""
+    return int(time.time()) // 60
+
+def current_day():
+    """Período de los cuerpos con ventanas que terminan hoy"""
+    return local_day(time.time())
+
+def cached_response(view=None, *, clock=None):
+    """
+    Sirve la vista desde la caché mientras los datos del hato no cambien.
+    La respuesta lleva ETag; si el navegador envía If-None-Match con el
+    mismo valor se responde 304 sin recalcular ni serializar. Cada entrada
+    guarda también el cuerpo comprimido en cada codificación que se pidió,
+    con su propio ETag, así los aciertos no vuelven a comprimir. Si el
+    cuerpo depende de la hora, `clock` da el período actual y la entrada
+    vence al cambiar de período aunque el hato no cambie.
+    """
+    if view is None:
+        return lambda view: cached_response(view, clock=clock)
+    
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        version = herd_store.version if clock is None else (herd_store.version, clock())
+        entry = response_cache.get(key, version)
+        if entry is None:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            entry = response_cache.put(key, version, response.get_data(), response.mimetype)
+        encoding = negotiate_encoding(len(entry['body']), entry['mimetype'])
+        etag = f"{entry['etag']}-{encoding}" if encoding else entry['etag']
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif encoding:
+            body = entry['encoded'].get(encoding)
+            if body is None:
+                with phase('compress'):
+                    body = entry['encoded'][encoding] = compress_body(entry['body'], encoding)
+            response = Response(body, mimetype=entry['mimetype'])
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = Response(entry['body'], mimetype=entry['mimetype'])
+        if entry['mimetype'] in COMPRESSIBLE_TYPES:
+            response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        # Los clientes pueden guardarla pero deben revalidar cada vez
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
+
+# ============================================================================
+# MÉTRICAS
+# ============================================================================
+
+# Límites de los histogramas: latencia en segundos y tamaño de respuesta en bytes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """Histograma acumulativo con límites fijos, por combinación de etiquetas"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def expose(self, name, label_names):
+        lines = []
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            base = ','.join(f'{key}="{value}"' for key, value in zip(label_names, labels))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{base}}} {total}')
+            lines.append(f'{name}_count{{{base}}} {count}')
+        return lines
+
+
+class Metrics:
+    """
+    Métricas de solicitudes en memoria: latencia, fases, tamaño de respuesta,
+    conteo por estado y solicitudes en curso, en formato de texto Prometheus.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.phases = Histogram(LATENCY_BUCKETS)
+        self.sizes = Histogram(SIZE_BUCKETS)
+        self.requests = {}
+        self.in_flight = 0
+        self.profiles = 0
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self, endpoint, method, status, elapsed, size, phases):
+        with self._lock:
+            self.in_flight -= 1
+            self.latency.observe((endpoint, method), elapsed)
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if size is not None:
+                self.sizes.observe((endpoint,), size)
+            for name, seconds in phases.items():
+                self.phases.observe((endpoint, name), seconds)
+
+    def profile_saved(self):
+        with self._lock:
+            self.profiles += 1
+
+    def expose(self, herd):
+        with self._lock:
+            lines = [
+                '# HELP agrotrace_http_request_duration_seconds Latencia de las solicitudes por endpoint',
+                '# TYPE agrotrace_http_request_duration_seconds histogram',
+                *self.latency.expose('agrotrace_http_request_duration_seconds', ('endpoint', 'method')),
+                '# HELP agrotrace_request_phase_seconds Tiempo por fase (data, aggregate, render, serialize, compress)',
+                '# TYPE agrotrace_request_phase_seconds histogram',
+                *self.phases.expose('agrotrace_request_phase_seconds', ('endpoint', 'phase')),
+                '# HELP agrotrace_http_response_size_bytes Tamaño de las respuestas por endpoint',
+                '# TYPE agrotrace_http_response_size_bytes histogram',
+                *self.sizes.expose('agrotrace_http_response_size_bytes', ('endpoint',)),
+                '# HELP agrotrace_http_requests_total Solicitudes atendidas',
+                '# TYPE agrotrace_http_requests_total counter',
+                *(f'agrotrace_http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}'
+                  for (endpoint, method, status), count in sorted(self.requests.items())),
+                '# HELP agrotrace_http_requests_in_flight Solicitudes en curso',
+                '# TYPE agrotrace_http_requests_in_flight gauge',
+                f'agrotrace_http_requests_in_flight {self.in_flight}',
+                '# HELP agrotrace_profiles_captured_total Perfiles guardados de solicitudes lentas',
+                '# TYPE agrotrace_profiles_captured_total counter',
+                f'agrotrace_profiles_captured_total {self.profiles}',
+            ]
+        lines += [
+            '# HELP agrotrace_herd_rows Filas en memoria por almacén',
+            '# TYPE agrotrace_herd_rows gauge',
+            f'agrotrace_herd_rows{{store="animals"}} {len(herd)}',
+            f'agrotrace_herd_rows{{store="readings"}} {len(herd.readings)}',
+            f'agrotrace_herd_rows{{store="health"}} {len(herd.health)}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class phase:
+    """
+    Cronómetro de una fase de la solicitud actual: `with phase('data'): ...`.
+    Las fases con el mismo nombre se acumulan.
+    """
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
 
-# ============================================================================
-# CONFIGURACIÓN DE LA APLICACIÓN
-# ============================================================================
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'agrotrace-2025-secret-key-dev'
-app.config['JSON_AS_ASCII'] = False
+    def __exit__(self, *exc):
+        phases = g.get('phases')
+        if phases is not None:
+            phases[self.name] = phases.get(self.name, 0.0) + time.perf_counter() - self.start
 
-# ============================================================================
-# CONTEXT PROCESSOR - Variables globales para templates
-# ============================================================================
 
-@app.context_processor
-def inject_globals():
+class TimedJSONProvider(DefaultJSONProvider):
     """
-    Inyecta variables globales en todos los templates
-    Esto evita el error 'undefined' en Jinja2
+    Proveedor JSON de jsonify: serializa con dump_json (orjson si está
+    instalado) en UTF-8 sin escapar y registra la serialización como fase.
+    Un arreglo de al menos JSON_STREAM_MIN_ITEMS elementos, en la raíz o en
+    una clave de la raíz, se serializa por bloques mientras se envía.
     """
-    return {
-        'app_name': 'AgroTrace',
-        'app_version': '3.0.0',
-        'current_year': datetime.now().year
-    }
 
-# ============================================================================
-# MODELO DE DATOS
-# ============================================================================
+    # Elementos del arreglo por bloque al serializar por partes
+    STREAM_CHUNK = 500
 
-class DataGenerator:
-    """Generador de datos simulados para el dashboard"""
-    
-    @staticmethod
-    def generate_animals(count=155):
-        """Genera lista de animales con datos realistas"""
-        breeds = ['Holstein', 'Brahman', 'Angus', 'Simmental', 'Charolais', 'Hereford', 'Jersey']
-        statuses = [
-            {'name': 'Saludable', 'class': 'success', 'color': 'green'},
-            {'name': 'En Observación', 'class': 'warning', 'color': 'yellow'},
-            {'name': 'Tratamiento', 'class': 'danger', 'color': 'red'},
-            {'name': 'Cuarentena', 'class': 'info', 'color': 'blue'}
-        ]
-        locations = [
-            'Sector A - Pastoreo', 'Sector B - Pastoreo', 'Sector C - Alimentación',
-            'Corral 1', 'Corral 2', 'Corral 3', 'Zona Norte', 'Zona Sur'
-        ]
-        
-        animals = []
-        for i in range(1, count + 1):
-            last_scan = datetime.now() - timedelta(minutes=random.randint(1, 4320))
-            status = random.choices(statuses, weights=[75, 12, 8, 5])[0]
-            weight = random.randint(180, 650)
-            age_months = random.randint(8, 84)
-            
-            animal = {
-                'id': i,
-                'code': f'AG{i:04d}',
-                'rfid': f'RF-{uuid.uuid4().hex[:8].upper()}',
-                'name': f'Animal-{i:03d}',
-                'breed': random.choice(breeds),
-                'age_months': age_months,
-                'age': age_months // 12,  # Edad en años
-                'age_display': f"{age_months // 12}a {age_months % 12}m" if age_months >= 12 else f"{age_months}m",
-                'weight': weight,
-                'weight_gain': round(random.uniform(-2, 5), 1),
-                'status': status,
-                'location': random.choice(locations),
-                'last_scan': last_scan.isoformat(),
-                'last_scan_display': last_scan.strftime('%d/%m/%Y %H:%M'),
-                'lastCheck': last_scan.strftime('%d/%m %H:%M'),  # Para la plantilla
-                'health_score': random.randint(75, 100) if status['class'] == 'success' else random.randint(40, 85),
-                'vaccinated': random.choice([True, False]),
-                'temperature': round(random.uniform(37.5, 39.5), 1),
-                'birth_date': (datetime.now() - timedelta(days=age_months * 30)).isoformat(),
-                'owner': f'Finca {random.choice(["El Paraíso", "La Esperanza", "San José", "Villa Rica"])}',
-                'avatarColor': random.choice(['#3B82F6', '#10B981', '#F59E0B', '#EF4444', '#8B5CF6', '#EC4899', '#14B8A6', '#F97316']),
-                'observations': '',
-                'notes': random.choice([
-                    'Sin observaciones', 
-                    'Control veterinario pendiente',
-                    'Programado para vacunación',
-                    'En seguimiento',
-                    ''
-                ])
-            }
-            animals.append(animal)
-        
-        return animals
-    
-    @staticmethod
-    def generate_health_records(count=120):
-        """Genera registros de salud simulados para el módulo Health"""
-        animals = DataGenerator.generate_animals(155)
-        vaccines = [
-            'Fiebre Aftosa', 'Brucelosis', 'Rabia Bovina', 'Carbunco', 
-            'Clostridiosis', 'IBR/DVB', 'Leptospirosis', 'Triple'
-        ]
-        treatments = [
-            'Desparasitación interna', 'Desparasitación externa', 'Antibiótico general',
-            'Vitaminas y minerales', 'Tratamiento respiratorio', 'Tratamiento digestivo',
-            'Cicatrización de heridas', 'Control de garrapatas', 'Ninguno'
-        ]
-        veterinarians = ['Dr. García', 'Dra. Martínez', 'Dr. López', 'Dra. Fernández', 'Dr. Rodríguez']
-        
-        statuses = [
-            {'name': 'Completado', 'class': 'success'},
-            {'name': 'Pendiente', 'class': 'warning'},
-            {'name': 'Urgente', 'class': 'danger'},
-            {'name': 'Programado', 'class': 'info'}
-        ]
-        
-        records = []
-        for i in range(1, count + 1):
-            animal = random.choice(animals)
-            status = random.choices(statuses, weights=[60, 20, 10, 10])[0]
-            checkup_date = datetime.now() - timedelta(days=random.randint(0, 180))
-            next_checkup = datetime.now() + timedelta(days=random.randint(15, 90))
-            
-            weight = animal['weight'] + random.randint(-20, 30)
-            temperature = round(random.uniform(37.5, 39.8), 1)
-            
-            record = {
-                'id': i,
-                'animal_id': animal['id'],
-                'animal_name': animal['name'],
-                'animal_code': animal['code'],
-                'rfid': animal['rfid'],
-                'breed': animal['breed'],
-                'checkup_date': checkup_date.strftime('%Y-%m-%d'),
-                'checkup_date_display': checkup_date.strftime('%d/%m/%Y'),
-                'checkup_time': checkup_date.strftime('%H:%M'),
-                'next_checkup': next_checkup.strftime('%Y-%m-%d'),
-                'next_checkup_display': next_checkup.strftime('%d/%m/%Y'),
-                'weight': weight,
-                'temperature': temperature,
-                'heart_rate': random.randint(55, 85),
-                'respiratory_rate': random.randint(20, 40),
-                'status': status,
-                'vaccine': random.choice(vaccines),
-                'treatment': random.choice(treatments),
-                'veterinarian': random.choice(veterinarians),
-                'observations': random.choice([
-                    'Animal en condiciones óptimas',
-                    'Requiere seguimiento en 15 días',
-                    'Programar próxima vacunación',
-                    'Control de peso recomendado',
-                    'Sin observaciones',
-                    'Revisar alimentación',
-                    'Monitorear temperatura',
-                    ''
-                ]),
-                'diagnosis': random.choice([
-                    'Saludable', 'Parasitosis leve', 'En recuperación', 
-                    'Control rutinario', 'Tratamiento preventivo', 'Normal'
-                ]),
-                'cost': round(random.uniform(15000, 85000), 2),
-                'avatarColor': animal['avatarColor']
-            }
-            records.append(record)
-        
-        return sorted(records, key=lambda x: x['checkup_date'], reverse=True)
-    
-    @staticmethod
-    def generate_activity_feed(limit=15):
-        """Genera feed de actividad reciente"""
-        activity_types = [
-            {'type': 'scan', 'icon': 'wifi', 'color': 'blue', 'template': 'Escaneo RFID: {0} en {1}'},
-            {'type': 'health', 'icon': 'heart-pulse', 'color': 'red', 'template': 'Alerta de salud: {0} requiere atención'},
-            {'type': 'vaccination', 'icon': 'syringe', 'color': 'green', 'template': 'Vacunación completada: {0}'},
-            {'type': 'movement', 'icon': 'truck', 'color': 'purple', 'template': 'Traslado: {0} → {1}'},
-            {'type': 'weight', 'icon': 'weight-scale', 'color': 'yellow', 'template': 'Pesaje registrado: {0} - {1}kg'},
-            {'type': 'treatment', 'icon': 'pills', 'color': 'orange', 'template': 'Tratamiento iniciado: {0}'},
-        ]
-        
-        animals = DataGenerator.generate_animals(50)
-        activities = []
-        
-        for i in range(limit):
-            animal = random.choice(animals)
-            activity_type = random.choice(activity_types)
-            minutes_ago = random.randint(1, 720)
-            timestamp = datetime.now() - timedelta(minutes=minutes_ago)
-            
-            if activity_type['type'] == 'movement':
-                locations = ['Sector A', 'Sector B', 'Corral 1', 'Zona Norte']
-                message = activity_type['template'].format(animal['name'], random.choice(locations))
-            elif activity_type['type'] == 'weight':
-                message = activity_type['template'].format(animal['name'], animal['weight'])
-            elif activity_type['type'] == 'scan':
-                locations = ['Sector A', 'Sector B', 'Corral 1', 'Zona Norte', 'Establo']
-                message = activity_type['template'].format(animal['name'], random.choice(locations))
-            else:
-                message = activity_type['template'].format(animal['name'])
-            
-            activities.append({
-                'id': str(uuid.uuid4()),
-                'type': activity_type['type'],
-                'icon': activity_type['icon'],
-                'color': activity_type['color'],
-                'message': message,
-                'timestamp': timestamp.isoformat(),
-                'time_ago': DataGenerator.time_ago(timestamp),
-                'user': random.choice(['Admin', 'Veterinario', 'Operador', 'Sistema'])
-            })
-        
-        return sorted(activities, key=lambda x: x['timestamp'], reverse=True)
-    
-    @staticmethod
-    def time_ago(dt):
-        """Convierte datetime a formato 'hace X tiempo'"""
-        now = datetime.now()
-        diff = now - dt
-        
-        if diff.total_seconds() < 60:
-            return 'Hace unos segundos'
-        elif diff.total_seconds() < 3600:
-            minutes = int(diff.total_seconds() / 60)
-            return f'Hace {minutes} minuto{"s" if minutes > 1 else ""}'
-        elif diff.total_seconds() < 86400:
-            hours = int(diff.total_seconds() / 3600)
-            return f'Hace {hours} hora{"s" if hours > 1 else ""}'
-        else:
-            days = int(diff.total_seconds() / 86400)
-            return f'Hace {days} día{"s" if days > 1 else ""}'
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dump_json(obj, self.default).decode('utf-8')
 
-    @staticmethod
-    def generate_rfid_readings(count=200):
-        """Genera lecturas RFID simuladas para el módulo RFID"""
-        animals = DataGenerator.generate_animals(155)
-        
-        locations = [
-            'Entrada Principal', 'Sector A - Pastoreo', 'Sector B - Pastoreo', 
-            'Corral 1', 'Corral 2', 'Corral 3', 'Establo Norte', 'Establo Sur',
-            'Zona de Alimentación', 'Zona de Ordeño', 'Báscula de Pesaje', 
-            'Clínica Veterinaria', 'Zona de Cuarentena', 'Salida/Carga'
-        ]
-        
-        readers = [
-            'RFID-001', 'RFID-002', 'RFID-003', 'RFID-004', 'RFID-005',
-            'RFID-006', 'RFID-007', 'RFID-008'
-        ]
-        
-        statuses = [
-            {'name': 'Exitoso', 'class': 'success', 'icon': 'check-circle'},
-            {'name': 'Exitoso', 'class': 'success', 'icon': 'check-circle'},
-            {'name': 'Exitoso', 'class': 'success', 'icon': 'check-circle'},
-            {'name': 'Exitoso', 'class': 'success', 'icon': 'check-circle'},
-            {'name': 'Error de Lectura', 'class': 'danger', 'icon': 'exclamation-circle'},
-            {'name': 'Señal Débil', 'class': 'warning', 'icon': 'signal'}
-        ]
-        
-        event_types = [
-            {'name': 'Entrada', 'icon': 'sign-in-alt', 'color': '#10B981'},
-            {'name': 'Salida', 'icon': 'sign-out-alt', 'color': '#EF4444'},
-            {'name': 'Pesaje', 'icon': 'weight', 'color': '#F59E0B'},
-            {'name': 'Control', 'icon': 'clipboard-check', 'color': '#3B82F6'},
-            {'name': 'Alimentación', 'icon': 'utensils', 'color': '#8B5CF6'},
-            {'name': 'Ordeño', 'icon': 'droplet', 'color': '#06B6D4'}
-        ]
-        
-        readings = []
-        for i in range(1, count + 1):
-            animal = random.choice(animals)
-            status = random.choice(statuses)
-            event = random.choice(event_types)
-            location = random.choice(locations)
-            reader = random.choice(readers)
-            
-            # Generar timestamp aleatorio en los últimos 7 días
-            days_ago = random.randint(0, 7)
-            hours = random.randint(0, 23)
-            minutes = random.randint(0, 59)
-            seconds = random.randint(0, 59)
-            scan_time = datetime.now() - timedelta(days=days_ago, hours=hours, minutes=minutes, seconds=seconds)
-            
-            # Simular intensidad de señal
-            signal_strength = random.randint(45, 100) if status['class'] == 'success' else random.randint(20, 60)
-            
-            # Simular temperatura del tag
-            tag_temperature = round(random.uniform(18.0, 32.0), 1)
-            
-            reading = {
-                'id': i,
-                'rfid_code': animal['rfid'],
-                'animal_id': animal['id'],
-                'animal_name': animal['name'],
-                'animal_code': animal['code'],
-                'breed': animal['breed'],
-                'weight': animal['weight'],
-                'status_animal': animal['status'],
-                'location': location,
-                'reader_id': reader,
-                'event_type': event,
-                'scan_timestamp': scan_time.strftime('%Y-%m-%d %H:%M:%S'),
-                'scan_date': scan_time.strftime('%d/%m/%Y'),
-                'scan_time': scan_time.strftime('%H:%M:%S'),
-                'scan_datetime_display': scan_time.strftime('%d/%m/%Y %H:%M'),
-                'status': status,
-                'signal_strength': signal_strength,
-                'tag_temperature': tag_temperature,
-                'battery_level': random.randint(60, 100),
-                'read_count': random.randint(1, 50),
-                'duration_ms': random.randint(50, 500),
-                'distance_meters': round(random.uniform(0.5, 5.0), 1),
-                'notes': random.choice([
-                    'Lectura exitosa', 
-                    'Animal identificado correctamente',
-                    'Requiere mantenimiento del tag',
-                    'Señal óptima',
-                    'Tag en buen estado',
-                    ''
-                ]),
-                'avatarColor': animal['avatarColor']
-            }
-            readings.append(reading)
-        
-        return sorted(readings, key=lambda x: x['scan_timestamp'], reverse=True)
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            # Salida indentada para depurar
+            with phase('serialize'):
+                return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        with phase('serialize'):
+            parts = self._split(obj)
+            if parts is None:
+                return self._app.response_class(dump_json(obj, self.default) + b'\n', mimetype=self.mimetype)
+        return self._app.response_class(self._stream(*parts), mimetype=self.mimetype)
+
+    def _split(self, obj):
+        """(inicio, arreglo, cierre) si `obj` es o contiene en su raíz un arreglo grande, o None"""
+        minimum = self._app.config['JSON_STREAM_MIN_ITEMS']
+        if isinstance(obj, list):
+            return (b'', obj, b'') if len(obj) >= minimum else None
+        if not isinstance(obj, dict):
+            return None
+        for key, value in obj.items():
+            if isinstance(value, list) and len(value) >= minimum:
+                rest = {name: item for name, item in obj.items() if name != key}
+                start = dump_json(rest, self.default)[:-1] + (b',' if rest else b'') + dump_json(str(key)) + b':'
+                return start, value, b'}'
+        return None
+
+    def _stream(self, start, items, end):
+        yield start + b'['
+        for offset in range(0, len(items), self.STREAM_CHUNK):
+            chunk = dump_json(items[offset:offset + self.STREAM_CHUNK], self.default)
+            yield (b',' if offset else b'') + chunk[1:-1]
+        yield b']' + end + b'\n'
+
+
+app.json_provider_class = TimedJSONProvider
+app.json = TimedJSONProvider(app)
+
+
+@before_render_template.connect_via(app)
+def _render_started(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def _render_finished(sender, template, context, **extra):
+    phases = g.get('phases')
+    if phases is not None and 'render_start' in g:
+        phases['render'] = phases.get('render', 0.0) + time.perf_counter() - g.pop('render_start')
+
+
+@app.before_request
+def _start_metrics():
+    if not app.config['METRICS_ENABLED']:
+        return
+    g.request_start = time.perf_counter()
+    g.phases = {}
+    metrics.start()
+    if app.config['PROFILE_SAMPLE_RATE'] and random.random() < app.config['PROFILE_SAMPLE_RATE']:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Otro perfilador activo (solo uno a la vez desde Python 3.12)
+            return
+        g.profiler = profiler
+
+
+@app.after_request
+def _finish_metrics(response):
+    """
+    Registra la solicitud al cerrar la respuesta, así las respuestas por
+    streaming (exportaciones, SSE) cuentan su duración completa.
+    """
+    if 'request_start' not in g:
+        return response
+    start, phases, profiler = g.request_start, g.phases, g.pop('profiler', None)
+    endpoint, method, status = request.endpoint or 'unmatched', request.method, response.status_code
+    size = None if response.is_streamed else response.content_length
+
+    def record():
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            if elapsed * 1000 >= app.config['PROFILE_SLOW_MS']:
+                _save_profile(profiler, endpoint, elapsed)
+        metrics.finish(endpoint, method, status, elapsed, size, phases)
+
+    response.call_on_close(record)
+    return response
+
+
+def _save_profile(profiler, endpoint, elapsed):
+    """Guarda el perfil de una solicitud lenta (abrir con pstats o snakeviz)"""
+    filename = f"{endpoint}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms.prof"
+    try:
+        os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+        profiler.dump_stats(os.path.join(app.config['PROFILE_DIR'], filename))
+    except OSError as error:
+        app.logger.warning('No se pudo guardar el perfil %s: %s', filename, error)
+        return
+    metrics.profile_saved()
+
+
+@app.after_request
+def _compress_response(response):
+    """
+    Comprime en br o gzip, según Accept-Encoding, las respuestas de texto y
+    JSON de al menos COMPRESS_MIN_SIZE bytes; las que van por streaming
+    (exportaciones) se comprimen por bloques mientras se envían. Se registra
+    después de _finish_metrics para que corra antes y se mida el tamaño que
+    realmente viaja.
+    """
+    if (response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(None if response.is_streamed else response.content_length, response.mimetype)
+    if encoding is None:
+        return response
+    with phase('compress'):
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compress_body(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
 
-# Instancia global del generador
-data_gen = DataGenerator()
 
 # ============================================================================
 # RUTAS PRINCIPALES
 # ============================================================================
 
+def view_window(kind, page=1, per_page=None, args=None, projection=None):
+    """
+    Página de registros de una vista (animals, health, rfid) con sus filtros.
+    Las vistas renderizan la primera página y piden las siguientes a
+    /api/fragments/<kind>; los registros se sirven desde `row_cache` y
+    llevan todos los campos de presentación salvo que se pida ?display=.
+    Con una proyección de campos se serializan directo del almacén.
+    """
+    args = args or {}
+    per_page = per_page or app.config['PAGE_SIZE']
+    search = args.get('search', '').strip()
+    statuses = [status for status in args.get('status', '').split(',') if status]
+    store = {'animals': herd_store, 'rfid': herd_store.readings, 'health': herd_store.health}[kind]
+    # Ninguna página empieza después del último registro del almacén
+    offset = min((max(page, 1) - 1) * per_page, len(store))
+    if kind == 'animals':
+        rows = herd_store.search(search, status=args.get('status') or None, breed=args.get('breed') or None)
+        window, total = rows[offset:offset + per_page], len(rows)
+    elif kind == 'rfid':
+        window, total = store.window(offset, per_page, search, statuses, args.get('event') or None)
+    else:
+        window, total = store.window(offset, per_page, search, statuses)
+    if projection is None or projection.columns is None:
+        records = row_cache.dicts(kind, store, window)
+    else:
+        records = store.to_dicts(window, projection.columns)
+    return serialize(kind, records, default='all', projection=projection), total
+
 @app.route('/')
 def index():
     """Dashboard principal"""
     # Generar estadísticas
-    animals = data_gen.generate_animals()
-    total = len(animals)
-    healthy = len([a for a in animals if a['status']['class'] == 'success'])
-    warning = len([a for a in animals if a['status']['class'] == 'warning'])
-    critical = len([a for a in animals if a['status']['class'] == 'danger'])
-    
-    stats = {
-        'total': total,
-        'healthy': healthy,
-        'warning': warning,
-        'critical': critical,
-        'healthy_percentage': round((healthy / total * 100) if total > 0 else 0)
-    }
+    with phase('aggregate'):
+        stats = herd_store.aggregates.snapshot()
     
     return render_template('index.html', stats=stats)
 
 @app.route('/animals')
 def animals():
     """Vista de gestión de animales"""
-    animals_list = data_gen.generate_animals()
-    total = len(animals_list)
-    healthy = len([a for a in animals_list if a['status']['class'] == 'success'])
-    warning = len([a for a in animals_list if a['status']['class'] == 'warning'])
-    critical = len([a for a in animals_list if a['status']['class'] == 'danger'])
-    
-    stats = {
-        'total': total,
-        'healthy': healthy,
-        'warning': warning,
-        'critical': critical,
-        'healthy_percentage': round((healthy / total * 100) if total > 0 else 0)
-    }
+    with phase('aggregate'):
+        stats = herd_store.aggregates.snapshot()
     
-    return render_template('animals.html', stats=stats, animals_list=animals_list)
+    with phase('data'):
+        animals_list, total = view_window('animals')
+    
+    return render_template('animals.html', stats=stats, animals_list=animals_list,
+                           animals_total=total, page_size=app.config['PAGE_SIZE'])
 
 @app.route('/health')
 def health():
     """Vista de historial de salud animal"""
-    # Generar registros de salud simulados
-    health_records = data_gen.generate_health_records()
-    animals_list = data_gen.generate_animals()
-    
-    # Calcular estadísticas de salud
-    total_records = len(health_records)
-    pending_checkups = len([r for r in health_records if r['status']['class'] == 'warning'])
-    completed_checkups = len([r for r in health_records if r['status']['class'] == 'success'])
-    critical_cases = len([r for r in health_records if r['status']['class'] == 'danger'])
-    
-    # Calcular estadísticas de animales para el layout
-    healthy_animals = len([a for a in animals_list if a['status']['class'] == 'success'])
-    warning_animals = len([a for a in animals_list if a['status']['class'] == 'warning'])
-    critical_animals = len([a for a in animals_list if a['status']['class'] == 'danger'])
-    
-    stats = {
-        # Estadísticas de registros de salud
-        'total_records': total_records,
-        'pending_checkups': pending_checkups,
-        'completed_checkups': completed_checkups,
-        'critical_cases': critical_cases,
-        'vaccination_rate': round((completed_checkups / total_records * 100) if total_records > 0 else 0),
+    health_store = herd_store.health
+    today = start_of_day()
+    
+    with phase('aggregate'):
+        # Calcular estadísticas de salud
+        total_records = len(health_store)
+        counts = health_store.status_counts()
+        pending_checkups = counts['warning']
+        completed_checkups = counts['success']
+        critical_cases = counts['danger']
+    
+        stats = {
+            # Estadísticas de animales (para el layout)
+            **herd_store.aggregates.snapshot(),
         
-        # Estadísticas de animales (para el layout)
-        'total': len(animals_list),
-        'healthy': healthy_animals,
-        'warning': warning_animals,
-        'critical': critical_animals,
-        'healthy_percentage': round((healthy_animals / len(animals_list) * 100) if len(animals_list) > 0 else 0)
-    }
+            # Estadísticas de registros de salud
+            'total_records': total_records,
+            'pending_checkups': pending_checkups,
+            'completed_checkups': completed_checkups,
+            'critical_cases': critical_cases,
+            'vaccination_rate': round((completed_checkups / total_records * 100) if total_records > 0 else 0),
+            'recent_checkups': health_store.count_since(time.time() - 30 * 86400),
+            'due_checkups': health_store.checkups(today, local_midnight(local_day(today) + 8), limit=0)[1],
+            'overdue_checkups': health_store.checkups(0, today, limit=0)[1]
+        }
+    
+    with phase('data'):
+        health_records, total = view_window('health')
     
-    return render_template('health.html', stats=stats, health_records=health_records, animals_list=animals_list)
+    return render_template('health.html', stats=stats, health_records=health_records,
+                           records_total=total, page_size=app.config['PAGE_SIZE'])
 
 @app.route('/rfid')
 def rfid():
     """Vista de gestión de lecturas RFID"""
     # Generar lecturas RFID simuladas
-    rfid_readings = data_gen.generate_rfid_readings(200)
-    animals_list = data_gen.generate_animals()
-    
-    # Calcular estadísticas de lecturas RFID
-    total_readings = len(rfid_readings)
-    successful_readings = len([r for r in rfid_readings if r['status']['class'] == 'success'])
-    error_readings = len([r for r in rfid_readings if r['status']['class'] == 'danger'])
-    weak_signal = len([r for r in rfid_readings if r['status']['class'] == 'warning'])
-    
-    # Lecturas por ubicación (top 5)
-    location_counts = {}
-    for reading in rfid_readings:
-        loc = reading['location']
-        location_counts[loc] = location_counts.get(loc, 0) + 1
-    top_locations = sorted(location_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-    
-    # Lecturas de hoy
-    today = datetime.now().date()
-    today_readings = len([r for r in rfid_readings if datetime.strptime(r['scan_timestamp'], '%Y-%m-%d %H:%M:%S').date() == today])
-    
-    # Calcular estadísticas de animales para el layout
-    healthy_animals = len([a for a in animals_list if a['status']['class'] == 'success'])
-    warning_animals = len([a for a in animals_list if a['status']['class'] == 'warning'])
-    critical_animals = len([a for a in animals_list if a['status']['class'] == 'danger'])
-    
-    stats = {
-        # Estadísticas de lecturas RFID
-        'total_readings': total_readings,
-        'successful_readings': successful_readings,
-        'error_readings': error_readings,
-        'weak_signal': weak_signal,
-        'success_rate': round((successful_readings / total_readings * 100) if total_readings > 0 else 0),
-        'today_readings': today_readings,
-        'top_locations': top_locations,
+    readings = herd_store.readings
+    
+    with phase('aggregate'):
+        # Calcular estadísticas de lecturas RFID
+        total_readings = len(readings)
+        counts = readings.status_counts()
+        successful_readings = counts['success']
+        error_readings = counts['danger']
+        weak_signal = counts['warning']
+    
+        # Lecturas por ubicación (top 5)
+        location_counts = readings.location_counts()
+        top_locations = sorted(location_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+    
+        # Lecturas de hoy
+        midnight = datetime.combine(datetime.now().date(), datetime.min.time()).timestamp()
+        today_readings = readings.count_between(midnight, time.time() + 1)
+    
+        stats = {
+            # Estadísticas de animales (para el layout)
+            **herd_store.aggregates.snapshot(),
         
-        # Estadísticas de animales (para el layout)
-        'total': len(animals_list),
-        'healthy': healthy_animals,
-        'warning': warning_animals,
-        'critical': critical_animals,
-        'healthy_percentage': round((healthy_animals / len(animals_list) * 100) if len(animals_list) > 0 else 0)
-    }
+            # Estadísticas de lecturas RFID
+            'total_readings': total_readings,
+            'successful_readings': successful_readings,
+            'error_readings': error_readings,
+            'weak_signal': weak_signal,
+            'success_rate': round((successful_readings / total_readings * 100) if total_readings > 0 else 0),
+            'today_readings': today_readings,
+            'top_locations': top_locations
+        }
     
-    return render_template('rfid.html', stats=stats, rfid_readings=rfid_readings, animals_list=animals_list)
+    with phase('data'):
+        rfid_readings, total = view_window('rfid')
+    
+    return render_template('rfid.html', stats=stats, rfid_readings=rfid_readings,
+                           readings_total=total, page_size=app.config['PAGE_SIZE'])
 
 @app.route('/reports')
 def reports():
     """Vista de reportes"""
-    animals_list = data_gen.generate_animals()
-    total = len(animals_list)
-    healthy = len([a for a in animals_list if a['status']['class'] == 'success'])
-    warning = len([a for a in animals_list if a['status']['class'] == 'warning'])
-    critical = len([a for a in animals_list if a['status']['class'] == 'danger'])
-    
-    stats = {
-        'total': total,
-        'healthy': healthy,
-        'warning': warning,
-        'critical': critical,
-        'healthy_percentage': round((healthy / total * 100) if total > 0 else 0)
-    }
+    stats = herd_store.aggregates.snapshot()
     
     return render_template('index.html', stats=stats, view='reports')
 
 @app.route('/settings')
 def settings():
     """Vista de configuración"""
-    animals_list = data_gen.generate_animals()
-    total = len(animals_list)
-    healthy = len([a for a in animals_list if a['status']['class'] == 'success'])
-    warning = len([a for a in animals_list if a['status']['class'] == 'warning'])
-    critical = len([a for a in animals_list if a['status']['class'] == 'danger'])
-    
-    stats = {
-        'total': total,
-        'healthy': healthy,
-        'warning': warning,
-        'critical': critical,
-        'healthy_percentage': round((healthy / total * 100) if total > 0 else 0)
-    }
+    stats = herd_store.aggregates.snapshot()
     
     return render_template('index.html', stats=stats, view='settings')
 
@@ -502,19 +5253,7 @@ def settings():
 def analytics():
     """Vista de analíticas - En desarrollo"""
     # Generar stats mínimo para el layout
-    animals_list = data_gen.generate_animals()
-    total = len(animals_list)
-    healthy = len([a for a in animals_list if a['status']['class'] == 'success'])
-    warning = len([a for a in animals_list if a['status']['class'] == 'warning'])
-    critical = len([a for a in animals_list if a['status']['class'] == 'danger'])
-    
-    stats = {
-        'total': total,
-        'healthy': healthy,
-        'warning': warning,
-        'critical': critical,
-        'healthy_percentage': round((healthy / total * 100) if total > 0 else 0)
-    }
+    stats = herd_store.aggregates.snapshot()
     
     return render_template('analytics.html', stats=stats)
 
@@ -522,19 +5261,7 @@ def analytics():
 def history():
     """Vista de historial - En desarrollo"""
     # Generar stats mínimo para el layout
-    animals_list = data_gen.generate_animals()
-    total = len(animals_list)
-    healthy = len([a for a in animals_list if a['status']['class'] == 'success'])
-    warning = len([a for a in animals_list if a['status']['class'] == 'warning'])
-    critical = len([a for a in animals_list if a['status']['class'] == 'danger'])
-    
-    stats = {
-        'total': total,
-        'healthy': healthy,
-        'warning': warning,
-        'critical': critical,
-        'healthy_percentage': round((healthy / total * 100) if total > 0 else 0)
-    }
+    stats = herd_store.aggregates.snapshot()
     
     return render_template('history.html', stats=stats)
 
@@ -542,35 +5269,69 @@ def history():
 # API ENDPOINTS
 # ============================================================================
 
+# Límite de filas por página en las APIs de listas
+MAX_PER_PAGE = 100
+
+def encode_cursor(key, sort, order):
+    """Cursor opaco con la última entrada de la página y el orden que la produjo"""
+    raw = f"{sort or 'id'}:{order}:{int(key)}".encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def parse_time_arg(value, default):
+    """
+    Epoch a partir de un parámetro numérico o de fecha ISO, acotado a
+    [0, MAX_TIMESTAMP]; lanza ValueError si no es una fecha finita
+    """
+    if not value:
+        return default
+    try:
+        moment = float(value)
+    except ValueError:
+        try:
+            moment = datetime.fromisoformat(value).timestamp()
+        except (OverflowError, OSError):
+            raise ValueError(f'Fecha fuera de rango: {value}') from None
+    if not math.isfinite(moment):
+        raise ValueError(f'Fecha inválida: {value}')
+    return min(max(moment, 0), MAX_TIMESTAMP)
+
+def decode_cursor(cursor, sort, order):
+    """Entrada del cursor, o None si es inválido o de otro orden"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        cursor_sort, cursor_order, key = raw.split(':')
+        key = int(key)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if cursor_sort != (sort or 'id') or cursor_order != order or not 0 <= key < 1 << 64:
+        return None
+    return key
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Métricas de solicitudes en formato de texto Prometheus"""
+    return Response(metrics.expose(herd_store), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/dashboard/stats')
+@cached_response(clock=current_minute)
 def api_dashboard_stats():
     """Estadísticas principales del dashboard"""
-    animals = data_gen.generate_animals()
-    
-    total = len(animals)
-    healthy = len([a for a in animals if a['status']['class'] == 'success'])
-    warning = len([a for a in animals if a['status']['class'] == 'warning'])
-    critical = len([a for a in animals if a['status']['class'] in ['danger', 'info']])
-    
-    recent_scans = len([a for a in animals if 
-        datetime.fromisoformat(a['last_scan']) > datetime.now() - timedelta(hours=24)])
-    
-    avg_weight = round(sum(a['weight'] for a in animals) / total, 1)
-    avg_health_score = round(sum(a['health_score'] for a in animals) / total, 1)
-    vaccination_rate = round(len([a for a in animals if a['vaccinated']]) / total * 100, 1)
+    with phase('aggregate'):
+        stats = herd_store.aggregates.snapshot()
+    total = stats['total']
     
     return jsonify({
         'success': True,
         'data': {
             'total_animals': total,
-            'healthy': healthy,
-            'warning': warning,
-            'critical': critical,
-            'health_percentage': round((healthy / total) * 100, 1),
-            'recent_scans_24h': recent_scans,
-            'avg_weight': avg_weight,
-            'avg_health_score': avg_health_score,
-            'vaccination_rate': vaccination_rate,
+            'healthy': stats['healthy'],
+            'warning': stats['warning'],
+            'critical': stats['critical'] + stats['quarantine'],
+            'health_percentage': round((stats['healthy'] / total) * 100, 1) if total else 0,
+            'recent_scans_24h': stats['recent_scans_24h'],
+            'avg_weight': stats['avg_weight'],
+            'avg_health_score': stats['avg_health_score'],
+            'vaccination_rate': stats['vaccination_rate'],
             'locations': 8,
             'system_uptime': '99.8%',
             'last_sync': datetime.now().strftime('%H:%M:%S')
@@ -579,41 +5340,54 @@ def api_dashboard_stats():
 
 @app.route('/api/animals')
 def api_animals():
-    """Lista de animales con paginación y filtros"""
+    """
+    Lista de animales con paginación por cursor, orden y filtros. Los campos
+    de presentación se piden con ?display= (all o lista) y ?locale=, y la
+    proyección con ?fields= o ?exclude=
+    """
     # Parámetros de consulta
     page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 15, type=int)
+    per_page = min(max(request.args.get('per_page', 15, type=int), 1), MAX_PER_PAGE)
     search = request.args.get('search', '', type=str)
     status_filter = request.args.get('status', '', type=str)
     breed_filter = request.args.get('breed', '', type=str)
     location_filter = request.args.get('location', '', type=str)
+    fuzzy = request.args.get('fuzzy', '', type=str).lower() in ('1', 'true')
+    sort = request.args.get('sort', '', type=str) or None
+    order = request.args.get('order', 'asc', type=str).lower()
+    cursor = request.args.get('cursor', '', type=str)
     
-    animals = data_gen.generate_animals()
-    
-    # Aplicar filtros
-    if search:
-        search_lower = search.lower()
-        animals = [a for a in animals if 
-                  search_lower in a['name'].lower() or 
-                  search_lower in a['rfid'].lower() or 
-                  search_lower in a['breed'].lower() or
-                  search_lower in a['code'].lower()]
-    
-    if status_filter:
-        animals = [a for a in animals if a['status']['class'] == status_filter]
+    if sort is not None and sort not in HerdStore.SORT_KEYS:
+        return jsonify({'success': False, 'error': f'Orden no soportado: {sort}'}), 400
+    if order not in ('asc', 'desc'):
+        return jsonify({'success': False, 'error': f'Dirección no soportada: {order}'}), 400
+    if page < 1:
+        return jsonify({'success': False, 'error': f'Página inválida: {page}'}), 400
+    try:
+        projection = Projection('animals')
+    except ValueError as error:
+        return jsonify({'success': False, 'error': str(error)}), 400
     
-    if breed_filter:
-        animals = [a for a in animals if a['breed'] == breed_filter]
+    after = None
+    if cursor:
+        after = decode_cursor(cursor, sort, order)
+        if after is None:
+            return jsonify({'success': False, 'error': 'Cursor inválido'}), 400
     
-    if location_filter:
-        animals = [a for a in animals if location_filter.lower() in a['location'].lower()]
-    
-    # Paginación
-    total = len(animals)
-    pages = (total + per_page - 1) // per_page
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated = animals[start:end]
+    with phase('data'):
+        # Búsqueda y filtros resueltos con los índices del almacén
+        rows = herd_store.search(search, status=status_filter, breed=breed_filter,
+                                 location=location_filter, fuzzy=fuzzy)
+        
+        # Paginación: por cursor si se envía, por número de página si no
+        total = len(rows)
+        pages = (total + per_page - 1) // per_page
+        # Más allá de la última página la respuesta es una página vacía
+        page = min(page, pages + 1)
+        offset = 0 if cursor else (page - 1) * per_page
+        page_rows, last_key = herd_store.page(rows, sort=sort, descending=order == 'desc',
+                                              after=after, limit=per_page, offset=offset)
+        paginated = serialize('animals', herd_store.to_dicts(page_rows, projection.columns), projection=projection)
     
     return jsonify({
         'success': True,
@@ -623,37 +5397,480 @@ def api_animals():
             'per_page': per_page,
             'total': total,
             'pages': pages,
-            'has_next': page < pages,
-            'has_prev': page > 1
+            'has_next': last_key is not None,
+            'has_prev': bool(cursor) or page > 1,
+            'sort': sort or 'id',
+            'order': order,
+            'next_cursor': encode_cursor(last_key, sort, order) if last_key is not None else None
+        }
+    })
+
+@app.route('/api/fragments/<kind>')
+def api_fragments(kind):
+    """Páginas de las vistas de animales, salud y RFID (search, status, breed, event; fields o exclude)"""
+    if kind not in ('animals', 'health', 'rfid'):
+        return jsonify({'success': False, 'error': 'Vista no encontrada'}), 404
+    page = request.args.get('page', 1, type=int)
+    per_page = min(max(request.args.get('per_page', app.config['PAGE_SIZE'], type=int), 1), MAX_PER_PAGE)
+    if page < 1:
+        return jsonify({'success': False, 'error': f'Página inválida: {page}'}), 400
+    try:
+        projection = Projection(kind, default='all')
+    except ValueError as error:
+        return jsonify({'success': False, 'error': str(error)}), 400
+    with phase('data'):
+        records, total = view_window(kind, page, per_page, request.args, projection)
+    pages = (total + per_page - 1) // per_page
+    
+    return jsonify({
+        'success': True,
+        'data': records,
+        'pagination': {
+            'page': min(page, pages + 1),
+            'per_page': per_page,
+            'total': total,
+            'pages': pages
+        }
+    })
+
+@app.route('/api/rfid/readings')
+def api_rfid_readings():
+    """Lecturas RFID por rango de tiempo, lector y ubicación (más recientes primero; fields o exclude)"""
+    readings = herd_store.readings
+    try:
+        start = parse_time_arg(request.args.get('from'), default=0)
+        end = parse_time_arg(request.args.get('to'), default=time.time() + 1)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Fecha inválida en from/to'}), 400
+    try:
+        projection = Projection('rfid')
+    except ValueError as error:
+        return jsonify({'success': False, 'error': str(error)}), 400
+    reader = request.args.get('reader_id', '', type=str)
+    location = request.args.get('location', '', type=str)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), MAX_PER_PAGE)
+    cursor = request.args.get('cursor', '', type=str)
+    
+    # Las páginas recorren primero la memoria y siguen con el archivo en la base;
+    # el cursor indica en cuál de los dos está la última lectura entregada
+    before = archived = None
+    if cursor:
+        before = decode_cursor(cursor, 'timestamp', 'desc')
+        archived = decode_cursor(cursor, 'archive', 'desc') if before is None else None
+        if before is None and archived is None:
+            return jsonify({'success': False, 'error': 'Cursor inválido'}), 400
+    
+    with phase('data'):
+        data, remaining, next_cursor = [], None, None
+        if archived is None:
+            rows, remaining, last_key = readings.query(start, end, reader=reader, location=location,
+                                                       limit=limit, before=before)
+            data = readings.to_dicts(rows, projection.columns)
+            if last_key is not None:
+                next_cursor = encode_cursor(last_key, 'timestamp', 'desc')
+            elif start < readings.horizon:
+                # Memoria agotada: el resto del rango está archivado
+                remaining = None
+                archived = min(int(np.ceil(end)), readings.horizon) << 32
+        if archived is not None and len(data) < limit:
+            records, last_key = readings.archive(start, end, reader=reader, location=location,
+                                                 limit=limit - len(data), before=archived, fields=projection.columns)
+            data += records
+            next_cursor = encode_cursor(last_key, 'archive', 'desc') if last_key is not None else None
+        elif archived is not None and next_cursor is None:
+            next_cursor = encode_cursor(archived, 'archive', 'desc')
+        data = serialize('rfid', data, projection=projection)
+    
+    return jsonify({
+        'success': True,
+        'data': data,
+        'pagination': {
+            'limit': limit,
+            'remaining': remaining,
+            'has_next': next_cursor is not None,
+            'next_cursor': next_cursor
+        }
+    })
+
+def start_of_day(moment=None):
+    """Epoch de la medianoche local del día de `moment` (hoy por defecto)"""
+    return local_midnight(local_day(time.time() if moment is None else moment))
+
+def checkup_worklist(start, end):
+    """Respuesta paginada de controles programados en [start, end)"""
+    statuses = [value for value in request.args.get('status', '', type=str).split(',') if value]
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_PER_PAGE)
+    cursor = request.args.get('cursor', '', type=str)
+    try:
+        projection = Projection('health', extra=('days_until',))
+    except ValueError as error:
+        return jsonify({'success': False, 'error': str(error)}), 400
+    
+    after = None
+    if cursor:
+        after = decode_cursor(cursor, 'next_checkup', 'asc')
+        if after is None:
+            return jsonify({'success': False, 'error': 'Cursor inválido'}), 400
+    
+    health_store = herd_store.health
+    today = start_of_day()
+    with phase('data'):
+        rows, total, last_key = health_store.checkups(start, end, statuses=statuses, after=after, limit=limit)
+        data = serialize('health', health_store.to_dicts(rows, projection.columns), projection=projection)
+        if projection.wants('days_until'):
+            next_checkups = health_store.column('next_checkup')[rows].tolist()
+            for record, next_checkup in zip(data, next_checkups):
+                record['days_until'] = local_day(next_checkup) - local_day(today)
+    
+    return jsonify({
+        'success': True,
+        'data': data,
+        'pagination': {
+            'limit': limit,
+            'total': total,
+            'has_next': last_key is not None,
+            'next_cursor': encode_cursor(last_key, 'next_checkup', 'asc') if last_key is not None else None
+        }
+    })
+
+@app.route('/api/health/due')
+def api_health_due():
+    """
+    Controles que vencen desde hoy hasta dentro de ?days= días (7 por defecto),
+    según el registro más reciente de cada animal; ?status= filtra por clase
+    """
+    days = min(max(request.args.get('days', 7, type=int), 0), 365)
+    today = start_of_day()
+    return checkup_worklist(today, local_midnight(local_day(today) + days + 1))
+
+@app.route('/api/health/overdue')
+def api_health_overdue():
+    """Controles vencidos antes de hoy, del más atrasado al más reciente"""
+    return checkup_worklist(0, start_of_day())
+
+@app.route('/api/animals/<int:animal_id>/health')
+def api_animal_health(animal_id):
+    """Historial de salud de un animal, del control más reciente al más antiguo (fields o exclude)"""
+    if herd_store.row_of(animal_id) is None:
+        return jsonify({'success': False, 'error': 'Animal no encontrado'}), 404
+    try:
+        projection = Projection('health')
+    except ValueError as error:
+        return jsonify({'success': False, 'error': str(error)}), 400
+    health_store = herd_store.health
+    with phase('data'):
+        records = health_store.to_dicts(health_store.records_of(animal_id), projection.columns)
+        data = serialize('health', records, projection=projection)
+    return jsonify({'success': True, 'data': data})
+
+@app.route('/api/animals/<animal>/last-seen')
+def api_animal_last_seen(animal):
+    """Último avistamiento RFID de un animal, por id numérico o por código (ej. AG0042)"""
+    row = herd_store.row_of(int(animal)) if animal.isdigit() else herd_store.row_of_code(animal)
+    if row is None:
+        return jsonify({'success': False, 'error': 'Animal no encontrado'}), 404
+    readings = herd_store.readings
+    reading = readings.last_seen(row)
+    if reading is None:
+        return jsonify({'success': False, 'error': 'El animal no tiene lecturas recientes'}), 404
+    data = serialize('rfid', readings.to_dicts([reading]))[0]
+    data['seconds_ago'] = max(int(time.time()) - int(readings.column('timestamp')[reading]), 0)
+    return jsonify({'success': True, 'data': data})
+
+@app.route('/api/locations/occupancy')
+def api_locations_occupancy():
+    """
+    Cabezas por ubicación según la última lectura de cada animal, con el
+    total de lecturas; ?within= (minutos) cuenta solo a los vistos en ese
+    lapso y ?location= devuelve una sola ubicación
+    """
+    within = request.args.get('within', type=int)
+    location = request.args.get('location', '', type=str)
+    readings = herd_store.readings
+    if location and readings.locations.lookup(location) is None:
+        return jsonify({'success': False, 'error': f'Ubicación desconocida: {location}'}), 400
+    
+    with phase('aggregate'):
+        heads = readings.occupancy_counts(None if within is None else time.time() - within * 60)
+        reads = readings.location_counts()
+        located = sum(heads.values())
+        data = sorted(({'location': name, 'heads': heads.get(name, 0), 'reads': reads.get(name, 0)}
+                       for name in ([location] if location else readings.locations.values)),
+                      key=lambda item: item['heads'], reverse=True)
+    
+    return jsonify({
+        'success': True,
+        'data': data,
+        'herd': {
+            'total': len(herd_store),
+            'located': located,
+            'unlocated': len(herd_store) - located
         }
     })
 
+def ingest_vitals(items):
+    """Valida y registra un lote de mediciones de sensores; retorna el resumen"""
+    now = time.time()
+    summary = {'received': len(items), 'accepted': 0, 'rejected': 0, 'alerts': 0, 'errors': []}
+    rows, timestamps = [], []
+    values = {sign: [] for sign in VitalsMonitor.SIGNS}
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('La medición debe ser un objeto')
+            if item.get('animal_id') is not None:
+                row = herd_store.row_of(int(item['animal_id']))
+            else:
+                row = herd_store.row_of_rfid(str(item.get('rfid', '')))
+                row = None if row < 0 else row
+            if row is None:
+                raise ValueError('Animal no encontrado')
+            measured = {sign: VitalsMonitor.check(sign, item[sign]) for sign in VitalsMonitor.SIGNS
+                        if item.get(sign) is not None}
+            if not measured:
+                raise ValueError('Sin signos vitales: temperature, heart_rate o respiratory_rate')
+            timestamp = item.get('timestamp', now)
+            timestamp = float(timestamp) if isinstance(timestamp, (int, float)) else datetime.fromisoformat(timestamp).timestamp()
+            if not 0 <= timestamp <= MAX_TIMESTAMP:
+                raise ValueError('timestamp fuera de rango')
+        except (ValueError, TypeError) as exc:
+            summary['rejected'] += 1
+            if len(summary['errors']) < 20:
+                summary['errors'].append({'index': index, 'error': str(exc)})
+            continue
+        rows.append(row)
+        timestamps.append(int(timestamp))
+        for sign, column in values.items():
+            column.append(measured.get(sign, np.nan))
+        summary['accepted'] += 1
+    
+    if rows:
+        summary['alerts'] = len(herd_store.record_vitals(rows, timestamps, values))
+    return summary
+
+def apply_write(operation, payload):
+    """
+    Ejecuta una escritura (ingesta RFID o signos vitales). En los workers que
+    solo mapean la instantánea compartida se reenvía al proceso escritor.
+    """
+    if shared_snapshot is not None and not shared_snapshot.writer:
+        return shared_snapshot.forward(operation, payload)
+    if operation == 'rfid':
+        return rfid_ingestor.ingest(payload)
+    if operation == 'vitals':
+        return ingest_vitals(payload)
+    raise ValueError(f"Operación desconocida: {operation}")
+
+# Las escrituras reenviadas y la pasarela de lectores corren en el proceso que escribe
+if shared_snapshot is not None and shared_snapshot.writer:
+    shared_snapshot.serve(apply_write)
+rfid_gateway = None
+if app.config['RFID_GATEWAY'] and (shared_snapshot is None or shared_snapshot.writer):
+    rfid_gateway = RfidGateway(lambda reads: apply_write('rfid', reads), app.config['RFID_GATEWAY_QUEUE'],
+                               app.config['RFID_GATEWAY_BATCH'], app.config['RFID_GATEWAY_FLUSH'])
+    rfid_gateway.start(app.config['RFID_GATEWAY'])
+
+@app.route('/api/vitals', methods=['POST'])
+def api_vitals():
+    """
+    Mediciones de sensores en lote: arreglo de objetos con animal_id o rfid,
+    timestamp opcional y temperature, heart_rate y/o respiratory_rate.
+    Cada medición se evalúa contra la línea base del animal y de su raza.
+    """
+    payload = request.get_json(silent=True)
+    items = payload.get('vitals') if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        return jsonify({'success': False, 'error': 'Se esperaba un arreglo de mediciones'}), 400
+    
+    try:
+        summary = apply_write('vitals', items)
+    except (OSError, RuntimeError):
+        return jsonify({'success': False, 'error': 'El proceso escritor no está disponible'}), 503
+    status_code = 400 if summary['received'] and not summary['accepted'] else 202
+    return jsonify({'success': status_code == 202, 'data': summary}), status_code
+
+@app.route('/api/health/alerts')
+def api_health_alerts():
+    """Últimas alertas de signos vitales fuera de la línea base del animal o de su raza"""
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_PER_PAGE)
+    return jsonify({'success': True, 'data': herd_store.vitals.recent(limit)})
+
+@app.route('/api/animals/<int:animal_id>/vitals')
+def api_animal_vitals(animal_id):
+    """Línea base de signos vitales de un animal (media, desviación y EWMA)"""
+    row = herd_store.row_of(animal_id)
+    if row is None:
+        return jsonify({'success': False, 'error': 'Animal no encontrado'}), 404
+    return jsonify({'success': True, 'data': herd_store.vitals.baseline(row)})
+
+@app.route('/api/rfid/readings:batch', methods=['POST'])
+def api_rfid_readings_batch():
+    """Ingesta en lote de lecturas RFID (arreglo JSON o NDJSON)"""
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+        try:
+            reads = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError:
+            return jsonify({'success': False, 'error': 'NDJSON inválido'}), 400
+    else:
+        payload = request.get_json(silent=True)
+        reads = payload.get('readings') if isinstance(payload, dict) else payload
+        if not isinstance(reads, list):
+            return jsonify({'success': False, 'error': 'Se esperaba un arreglo de lecturas'}), 400
+    
+    try:
+        summary = apply_write('rfid', reads)
+    except (OSError, RuntimeError):
+        return jsonify({'success': False, 'error': 'El proceso escritor no está disponible'}), 503
+    status_code = 400 if summary['received'] and summary['rejected'] == summary['received'] else 202
+    return jsonify({'success': status_code == 202, 'data': summary}), status_code
+
+@app.route('/api/rfid/gateway')
+def api_rfid_gateway():
+    """Estado de la pasarela de lectores: conexiones, cola, descartes y micro-lotes ingeridos"""
+    if rfid_gateway is None:
+        return jsonify({'success': False, 'error': 'La pasarela RFID no está activa en este proceso'}), 404
+    return jsonify({'success': True, 'data': rfid_gateway.snapshot()})
+
+@app.route('/api/export/<kind>')
+def api_export(kind):
+    """
+    Exportación completa en CSV o NDJSON, generada por bloques mientras se
+    envía. Filtros: from/to (último escaneo, lectura o control) y farm;
+    campos de presentación con ?display= y ?locale=, y proyección con
+    ?fields= o ?exclude=.
+    """
+    stores = {'animals': herd_store, 'rfid': herd_store.readings, 'health': herd_store.health}
+    store = stores.get(kind)
+    if store is None:
+        return jsonify({'success': False, 'error': 'Exportación no encontrada'}), 404
+    export_format = request.args.get('format', 'csv', type=str)
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'error': 'Formato inválido (csv o ndjson)'}), 400
+    try:
+        start = parse_time_arg(request.args.get('from'), default=None)
+        end = parse_time_arg(request.args.get('to'), default=None)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Fecha inválida en from/to'}), 400
+    try:
+        projection = Projection(kind)
+    except ValueError as error:
+        return jsonify({'success': False, 'error': str(error)}), 400
+    farm = request.args.get('farm', '', type=str).strip().lower()
+    owners = herd_store.category_codes('owner', lambda owner: farm in owner.lower()) if farm else None
+    
+    blocks = store.export_rows(start, end, owners=owners, chunk=EXPORT_CHUNK)
+    batches = (store.to_dicts(rows, projection.columns) for rows in blocks)
+    if kind == 'rfid':
+        # Primero las lecturas archivadas, que son anteriores a las que están en memoria
+        archived = store.export_archive(start, end, owners=owners, chunk=EXPORT_CHUNK, fields=projection.columns)
+        batches = chain(archived, batches)
+    batches = (serialize(kind, batch, projection=projection) for batch in batches)
+    body = (export_csv if export_format == 'csv' else export_ndjson)(batches)
+    filename = f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    mimetype = EXPORT_FORMATS[export_format]
+    if request.args.get('gzip') in ('1', 'true'):
+        body = compress_stream(body, level=EXPORT_GZIP_LEVEL)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 @app.route('/api/activity/feed')
 def api_activity_feed():
     """Feed de actividad reciente"""
-    limit = request.args.get('limit', 15, type=int)
-    activities = data_gen.generate_activity_feed(limit)
+    limit = min(max(request.args.get('limit', 15, type=int), 1), MAX_PER_PAGE)
+    activities = herd_store.activity_feed(limit)
     
     return jsonify({
         'success': True,
         'data': activities
     })
 
+@app.route('/api/activity/stream')
+def api_activity_stream():
+    """
+    Feed de actividad en vivo por Server-Sent Events.
+    Al reconectar, el navegador envía Last-Event-ID y se reenvían los
+    eventos pendientes desde el buffer del bus.
+    """
+    bus = herd_store.activity
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id', '')
+    last_id = int(last_id) if last_id.isdigit() else bus.last_id
+    
+    def stream(last_id):
+        yield 'retry: 5000\n\n'
+        while True:
+            events = bus.wait(last_id)
+            if events is None:
+                # El cliente quedó atrás del buffer: debe recargar el feed completo
+                last_id = bus.last_id
+                yield f'id: {last_id}\nevent: reset\ndata: {{}}\n\n'
+            elif not events:
+                yield ': ping\n\n'
+            for event in events or []:
+                last_id = event['id']
+                payload = json.dumps(ActivityBus.to_dict(event), ensure_ascii=False)
+                yield f'id: {last_id}\nevent: activity\ndata: {payload}\n\n'
+    
+    return Response(stream_with_context(stream(last_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/analytics/query')
+@cached_response
+def api_analytics_query():
+    """
+    Agrupación ad hoc: ?source=animals|rfid, ?group= y ?metrics= separados
+    por coma, ?from=/?to= sobre el último escaneo o la fecha de lectura y un
+    filtro por dimensión (?breed=Angus,Jersey). Las lecturas consultadas son
+    las que están en memoria.
+    """
+    source = request.args.get('source', 'animals', type=str)
+    if source not in GroupByQuery.SOURCES:
+        return jsonify({'success': False, 'error': f'Fuente no soportada: {source}'}), 400
+    try:
+        start = parse_time_arg(request.args.get('from'), default=None)
+        end = parse_time_arg(request.args.get('to'), default=None)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Fecha inválida en from/to'}), 400
+    group = [name for name in request.args.get('group', '', type=str).split(',') if name]
+    metrics = [name for name in request.args.get('metrics', '', type=str).split(',') if name] or ['count']
+    filters = {name: request.args[name].split(',') for name in GroupByQuery.SOURCES[source]['dimensions']
+               if request.args.get(name)}
+    try:
+        query = GroupByQuery(herd_store, source, group, metrics, filters, start=start, end=end)
+    except ValueError as exc:
+        return jsonify({'success': False, 'error': str(exc)}), 400
+    
+    with phase('aggregate'):
+        rows, total = query.run()
+    
+    return jsonify({
+        'success': True,
+        'data': rows,
+        'query': {
+            'source': source,
+            'group': group,
+            'metrics': metrics,
+            'filters': filters,
+            'total': total
+        }
+    })
+
 @app.route('/api/charts/scans-timeline')
+@cached_response(clock=current_day)
 def api_scans_timeline():
     """Datos para gráfico de escaneos en el tiempo"""
-    labels = []
-    data = []
-    
-    for i in range(7, 0, -1):
-        date = datetime.now() - timedelta(days=i)
-        labels.append(date.strftime('%d/%m'))
-        data.append(random.randint(80, 200))
+    days = min(max(request.args.get('days', 7, type=int), 1), 366)
+    timeline = herd_store.readings.daily_counts(days)
+    labels = [day.strftime('%d/%m') for day, _ in timeline]
+    data = [count for _, count in timeline]
     
     return jsonify({
         'success': True,
         'data': {
             'labels': labels,
+            'values': data,
             'datasets': [{
                 'label': 'Escaneos RFID',
                 'data': data,
@@ -665,14 +5882,10 @@ def api_scans_timeline():
     })
 
 @app.route('/api/charts/health-distribution')
+@cached_response
 def api_health_distribution():
     """Distribución de estados de salud"""
-    animals = data_gen.generate_animals()
-    
-    distribution = {}
-    for animal in animals:
-        status = animal['status']['name']
-        distribution[status] = distribution.get(status, 0) + 1
+    distribution = herd_store.status_distribution()
     
     return jsonify({
         'success': True,
@@ -691,23 +5904,106 @@ def api_health_distribution():
     })
 
 @app.route('/api/charts/weight-trends')
+@cached_response
 def api_weight_trends():
-    """Tendencias de peso promedio"""
-    months = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun']
-    weights = [round(random.uniform(400, 500), 1) for _ in range(6)]
+    """
+    Curva de peso a partir de los pesajes de báscula. Con ?animal= (id) es la
+    serie del animal reducida con LTTB; si no, el promedio diario del hato o
+    de ?breed= con mínimo y máximo, agrupado en cubetas de igual duración.
+    ?points= limita los puntos (300 por defecto); ?from= y ?to= el rango.
+    """
+    try:
+        start = parse_time_arg(request.args.get('from'), default=0)
+        end = parse_time_arg(request.args.get('to'), default=time.time() + 1)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Fecha inválida en from/to'}), 400
+    points = min(max(request.args.get('points', 300, type=int), 3), 2000)
+    animal_id = request.args.get('animal', type=int)
+    breed = request.args.get('breed', '', type=str)
+    weights = herd_store.weights
+    
+    with phase('aggregate'):
+        if animal_id is not None:
+            row = herd_store.row_of(animal_id)
+            if row is None:
+                return jsonify({'success': False, 'error': 'Animal no encontrado'}), 404
+            timestamps, values = weights.series(row, start, end)
+            picked = lttb(timestamps, values, points)
+            timestamps, values = timestamps[picked], values[picked]
+            label = f"Peso de {herd_store.brief(row)['name']} (kg)"
+            datasets = [{'label': label, 'data': [_to_number(value) for value in values.tolist()],
+                         'backgroundColor': 'rgba(16, 185, 129, 0.8)'}]
+        else:
+            code = herd_store.category_code('breed', breed) if breed else None
+            if breed and code is None:
+                return jsonify({'success': False, 'error': f'Raza desconocida: {breed}'}), 400
+            days, count, total, low, high = weights.daily(start, end, breed=code)
+            if len(days) > points:
+                # Cubetas de igual duración sobre los acumulados diarios
+                bucket = (days - days[0]) * points // (days[-1] - days[0] + 86400)
+                starts = np.r_[0, np.flatnonzero(np.diff(bucket)) + 1]
+                days = days[starts]
+                count, total = np.add.reduceat(count, starts), np.add.reduceat(total, starts)
+                low, high = np.minimum.reduceat(low, starts), np.maximum.reduceat(high, starts)
+            timestamps = days
+            mean = total / np.maximum(count, 1)
+            datasets = [
+                {'label': 'Peso Promedio (kg)', 'data': np.round(mean, 1).tolist(),
+                 'backgroundColor': 'rgba(16, 185, 129, 0.8)'},
+                {'label': 'Peso Mínimo (kg)', 'data': np.round(low.astype(np.float64), 1).tolist(),
+                 'backgroundColor': 'rgba(59, 130, 246, 0.5)'},
+                {'label': 'Peso Máximo (kg)', 'data': np.round(high.astype(np.float64), 1).tolist(),
+                 'backgroundColor': 'rgba(245, 158, 11, 0.5)'},
+            ]
     
     return jsonify({
         'success': True,
         'data': {
-            'labels': months,
-            'datasets': [{
-                'label': 'Peso Promedio (kg)',
-                'data': weights,
-                'backgroundColor': 'rgba(16, 185, 129, 0.8)'
-            }]
+            'labels': [datetime.fromtimestamp(value).strftime('%Y-%m-%d') for value in timestamps.tolist()],
+            'timestamps': timestamps.tolist(),
+            'datasets': datasets
         }
     })
 
+# ============================================================================
+# COMANDOS DE ADMINISTRACIÓN
+# ============================================================================
+
+@app.cli.command('seed')
+@click.option('--animals', default=155, show_default=True, help='Animales del hato simulado')
+@click.option('--health', type=int, default=None, help='Registros de salud (por defecto proporcional al hato)')
+@click.option('--readings', type=int, default=None, help='Lecturas RFID (por defecto proporcional al hato)')
+@click.option('--days', default=7, show_default=True, help='Días hacia atrás en los que se reparten las lecturas')
+@click.option('--weighings', type=int, default=None, help='Pesajes de báscula de los últimos dos años (por defecto 24 por animal)')
+@click.option('--seed', type=int, default=None, help='Semilla del generador (por defecto AGROTRACE_SEED)')
+def seed_command(animals, health, readings, days, weighings, seed):
+    """Reemplaza los datos de la base con un hato simulado"""
+    started = time.perf_counter()
+    generator = BatchGenerator(app.config['DATA_SEED'] if seed is None else seed)
+    health = max(120, animals * 120 // 155) if health is None else health
+    readings = max(200, animals * 200 // 155) if readings is None else readings
+    weighings = animals * 24 if weighings is None else weighings
+    database.clear()
+    store = HerdStore(capacity=animals)
+    store.attach(database)
+    with database.bulk_load():
+        herd = generator.animals(animals)
+        store.add_batch(herd)
+        for batch in generator.health_records(health, herd):
+            store.health.add_batch(batch)
+        for batch in generator.weighings(weighings, herd):
+            store.weights.add_batch(batch)
+        # Las lecturas se escriben en la base por bloques sin retenerlas en memoria
+        next_id = 1
+        for batch in generator.rfid_readings(readings, herd, days=days, chunk=200_000):
+            block = ReadingStore(store, capacity=len(batch['timestamp']))
+            block.db, block.next_id = database, next_id
+            block.add_batch(batch)
+            next_id = block.next_id
+        store.activity.publish_many(generator.activity(15, herd))
+    click.echo(f"Base {app.config['DATABASE']}: {animals} animales, {health} registros de salud, "
+               f"{weighings} pesajes, {readings} lecturas en {time.perf_counter() - started:.1f}s")
+
 # ============================================================================
 # MANEJO DE ERRORES
 # ============================================================================
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AgroTrace System - Benchmark de rutas por tamaño de hato
+
+Recorre todas las páginas y endpoints /api/* con el cliente de pruebas de
+Flask, con mezclas de consultas realistas (búsqueda, filtros, páginas
+profundas), para cada tamaño de hato. Cada tamaño corre en un proceso
+aparte (AGROTRACE_HERD_SIZE) para que la memoria de uno no contamine al otro.
+
+Uso:
+    python benchmark.py                                   # 155, 10k, 100k y 1M
+    python benchmark.py --sizes 155,10000 --output base.json
+    python benchmark.py --sizes 155,10000 --compare base.json
+    python benchmark.py --compare base.json --current nuevo.json
+    python benchmark.py --encoding identity               # sin compresión
+
+Por endpoint se reporta p50/p95/p99 (ms), throughput (req/s), bytes promedio
+de la respuesta tal como viaja (comprimida según --encoding) y cuánto creció
+la RSS del proceso durante ese endpoint (MB); el pico de RSS se reporta una
+vez por tamaño de hato. El modo de comparación marca como regresión un
+aumento de p95, bytes, crecimiento de RSS o pico, o una caída de throughput,
+mayor al umbral; el proceso termina con código 1 si hay regresiones.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+DEFAULT_SIZES = (155, 10000, 100000, 1000000)
+
+# Diferencias de latencia y de memoria por debajo de estos valores se consideran ruido
+MIN_DELTA_MS = 1.0
+MIN_DELTA_MB = 1.0
+
+
+def percentile(values, pct):
+    """Percentil por rango más cercano sobre valores ordenados"""
+    if not values:
+        return 0.0
+    index = max(int(round(pct / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def peak_rss_mb():
+    """Pico de memoria residente del proceso (ru_maxrss: KB en Linux, bytes en macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def current_rss_mb():
+    """Memoria residente actual (/proc/self/statm); sin /proc se usa el pico"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return peak_rss_mb()
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+# ============================================================================
+# MEZCLAS DE CONSULTAS
+# ============================================================================
+
+def build_scenarios(app_module):
+    """
+    Endpoints a medir con su mezcla de consultas. Cada escenario es
+    (nombre, método, lista de URLs o función que genera el cuerpo, repeticiones relativas).
+    """
+    store = app_module.herd_store
+    size = len(store)
+    per_page = 15
+    deep_page = max((size // per_page) // 2, 1)
+    breed = store.to_dict(0)['breed']
+    rfids = [value.decode('utf-8') for value in store.column('rfid')[:min(size, 5000)]]
+    readers = list(app_module.RFID_READERS)
+    day_ago = int(time.time()) - 86400
+
+    def batch_body():
+        now = time.time()
+        return [{'rfid': random.choice(rfids), 'reader_id': random.choice(readers),
+                 'timestamp': now - random.random() * 60} for _ in range(100)]
+
+    return [
+        # Páginas
+        ('page /', 'GET', ['/'], 1),
+        ('page /animals', 'GET', ['/animals'], 1),
+        ('page /health', 'GET', ['/health'], 1),
+        ('page /rfid', 'GET', ['/rfid'], 1),
+        ('page /reports', 'GET', ['/reports'], 1),
+        ('page /settings', 'GET', ['/settings'], 1),
+        ('page /analytics', 'GET', ['/analytics'], 1),
+        ('page /history', 'GET', ['/history'], 1),
+        # API
+        ('api dashboard stats', 'GET', ['/api/dashboard/stats'], 1),
+        ('api animals list', 'GET', ['/api/animals', '/api/animals?page=2'], 1),
+        ('api animals search', 'GET', [
+            '/api/animals?search=Animal-1',
+            '/api/animals?search=ang',
+            f'/api/animals?search={rfids[0][3:7]}',
+            '/api/animals?search=anmal&fuzzy=1',
+        ], 1),
+        ('api animals filters', 'GET', [
+            '/api/animals?status=warning',
+            f'/api/animals?breed={breed}',
+            f'/api/animals?breed={breed}&location=Corral&status=success',
+        ], 1),
+        ('api animals sorted', 'GET', [
+            '/api/animals?sort=weight&order=desc',
+            '/api/animals?sort=last_scan&order=desc',
+            '/api/animals?sort=health_score',
+        ], 1),
+        ('api animals deep page', 'GET', [
+            f'/api/animals?page={deep_page}',
+            f'/api/animals?page={deep_page}&sort=weight',
+        ], 1),
+        ('api rfid readings', 'GET', [
+            '/api/rfid/readings',
+            f'/api/rfid/readings?from={day_ago}',
+            '/api/rfid/readings?location=Zona de Ordeño',
+            '/api/rfid/readings?reader_id=RFID-006&limit=50',
+        ], 1),
+        ('api rfid batch', 'POST', batch_body, 1),
+        ('api fragments', 'GET', [
+            '/api/fragments/animals?page=3',
+            '/api/fragments/animals?search=ang&status=success',
+            '/api/fragments/rfid?page=5&status=danger,warning',
+            '/api/fragments/health?search=garc',
+        ], 1),
+        ('api export rfid', 'GET', [f'/api/export/rfid?from={day_ago}', f'/api/export/rfid?format=ndjson&from={day_ago}'], 0.1),
+        ('api export health', 'GET', ['/api/export/health?farm=esperanza'], 0.1),
+        ('api export animals', 'GET', ['/api/export/animals?gzip=1&farm=san'], 0.1),
+        ('api activity feed', 'GET', ['/api/activity/feed', '/api/activity/feed?limit=50'], 1),
+        ('api vitals', 'GET', ['/api/health/alerts', '/api/animals/1/vitals'], 1),
+        ('api occupancy', 'GET', ['/api/locations/occupancy', '/api/animals/AG0042/last-seen'], 1),
+        ('api analytics query', 'GET', [
+            '/api/analytics/query?group=breed,status&metrics=count,avg_weight,vaccination_rate',
+            '/api/analytics/query?source=rfid&group=reader,day&metrics=count,success_rate',
+        ], 1),
+        ('api charts scans timeline', 'GET', ['/api/charts/scans-timeline', '/api/charts/scans-timeline?days=30'], 1),
+        ('api charts health distribution', 'GET', ['/api/charts/health-distribution'], 1),
+        ('api charts weight trends', 'GET', [
+            '/api/charts/weight-trends',
+            '/api/charts/weight-trends?breed=Angus&points=100',
+            '/api/charts/weight-trends?animal=1',
+        ], 1),
+        ('metrics', 'GET', ['/metrics'], 1),
+    ]
+
+
+def run_scenario(client, method, requests, count, warmup, encoding):
+    """Ejecuta `count` solicitudes rotando la mezcla; retorna latencias (ms), bytes de cada respuesta y errores"""
+    latencies, sizes, errors = [], [], 0
+    headers = {'Accept-Encoding': encoding}
+    for i in range(warmup + count):
+        if callable(requests):
+            start = time.perf_counter()
+            response = client.post('/api/rfid/readings:batch', json=requests(), headers=headers)
+        else:
+            url = requests[i % len(requests)]
+            start = time.perf_counter()
+            response = client.open(url, method=method, headers=headers)
+        body = response.get_data()
+        elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code >= 400:
+            errors += 1
+        if i >= warmup:
+            latencies.append(elapsed)
+            sizes.append(len(body))
+        response.close()
+    return latencies, sizes, errors
+
+
+def run_worker(size, requests, warmup, only, encoding):
+    """Mide todos los escenarios con un hato de `size` animales (proceso hijo)"""
+    os.environ['AGROTRACE_HERD_SIZE'] = str(size)
+    os.environ['AGROTRACE_DATABASE'] = ':memory:'
+    os.environ.setdefault('AGROTRACE_SEED', '42')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    start = time.perf_counter()
+    import app as app_module
+    startup = time.perf_counter() - start
+    client = app_module.app.test_client()
+    results = {}
+    for name, method, mix, weight in build_scenarios(app_module):
+        if only and only not in name:
+            continue
+        count = max(int(requests * weight), 5)
+        rss_before = current_rss_mb()
+        started = time.perf_counter()
+        latencies, sizes, errors = run_scenario(client, method, mix, count, warmup, encoding)
+        total = time.perf_counter() - started
+        rss_growth = current_rss_mb() - rss_before
+        latencies.sort()
+        results[name] = {
+            'requests': count,
+            'errors': errors,
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'throughput_rps': round(len(latencies) / (sum(latencies) / 1000), 1) if sum(latencies) else 0.0,
+            'mean_bytes': round(sum(sizes) / len(sizes)),
+            'rss_growth_mb': round(rss_growth, 1),
+        }
+        print(f"  {name:<34} p50 {results[name]['p50_ms']:>9.2f}  p95 {results[name]['p95_ms']:>9.2f}  "
+              f"p99 {results[name]['p99_ms']:>9.2f} ms  {results[name]['throughput_rps']:>9.1f} req/s  "
+              f"{results[name]['mean_bytes'] / 1024:>9.1f} KB  "
+              f"{results[name]['rss_growth_mb']:>+8.1f} MB  ({total:.1f}s)", file=sys.stderr)
+    return {'herd_size': size, 'startup_s': round(startup, 2), 'peak_rss_mb': peak_rss_mb(), 'endpoints': results}
+
+
+# ============================================================================
+# COMPARACIÓN CONTRA LÍNEA BASE
+# ============================================================================
+
+def compare(baseline, current, threshold):
+    """Lista de regresiones (tamaño, endpoint, métrica, antes, después)"""
+    regressions = []
+    for size, run in current['runs'].items():
+        base_run = baseline['runs'].get(size)
+        if base_run is None:
+            continue
+        # Pico de RSS del proceso: uno por tamaño de hato
+        if 'peak_rss_mb' in base_run and run.get('peak_rss_mb', 0) > base_run['peak_rss_mb'] * (1 + threshold):
+            regressions.append((size, 'proceso', 'peak_rss_mb', base_run['peak_rss_mb'], run['peak_rss_mb']))
+        for name, now in run['endpoints'].items():
+            before = base_run['endpoints'].get(name)
+            if before is None:
+                continue
+            if now['p95_ms'] > before['p95_ms'] * (1 + threshold) and now['p95_ms'] - before['p95_ms'] > MIN_DELTA_MS:
+                regressions.append((size, name, 'p95_ms', before['p95_ms'], now['p95_ms']))
+            if now['throughput_rps'] < before['throughput_rps'] * (1 - threshold):
+                regressions.append((size, name, 'throughput_rps', before['throughput_rps'], now['throughput_rps']))
+            # Resultados anteriores a la medición de bytes no la traen
+            if 'mean_bytes' in before and now.get('mean_bytes', 0) > before['mean_bytes'] * (1 + threshold):
+                regressions.append((size, name, 'mean_bytes', before['mean_bytes'], now['mean_bytes']))
+            # Resultados anteriores guardaban el pico acumulado por endpoint, que no es comparable
+            if 'rss_growth_mb' in before and 'rss_growth_mb' in now:
+                if now['rss_growth_mb'] - before['rss_growth_mb'] > max(abs(before['rss_growth_mb']) * threshold,
+                                                                        MIN_DELTA_MB):
+                    regressions.append((size, name, 'rss_growth_mb', before['rss_growth_mb'], now['rss_growth_mb']))
+    return regressions
+
+
+def print_comparison(baseline, current, threshold):
+    print(f"\n{'tamaño':>8}  {'endpoint':<34} {'p95 antes':>10} {'p95 ahora':>10} {'cambio':>8}")
+    for size, run in current['runs'].items():
+        base_run = baseline['runs'].get(size, {'endpoints': {}})
+        for name, now in run['endpoints'].items():
+            before = base_run['endpoints'].get(name)
+            if before is None:
+                continue
+            change = (now['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+            print(f"{size:>8}  {name:<34} {before['p95_ms']:>10.2f} {now['p95_ms']:>10.2f} {change:>+7.1f}%")
+    regressions = compare(baseline, current, threshold)
+    if regressions:
+        print(f"\n⚠️  {len(regressions)} regresiones (umbral {threshold:.0%}):")
+        for size, name, metric, before, now in regressions:
+            print(f"   [{size}] {name}: {metric} {before} → {now}")
+    else:
+        print(f"\n✅ Sin regresiones (umbral {threshold:.0%})")
+    return regressions
+
+
+# ============================================================================
+# PUNTO DE ENTRADA
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de rutas de AgroTrace por tamaño de hato')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='tamaños de hato separados por coma')
+    parser.add_argument('--requests', type=int, default=100, help='solicitudes medidas por endpoint')
+    parser.add_argument('--warmup', type=int, default=3, help='solicitudes de calentamiento por endpoint')
+    parser.add_argument('--only', default='', help='medir solo los endpoints cuyo nombre contenga este texto')
+    parser.add_argument('--encoding', default='gzip, deflate, br',
+                        help='Accept-Encoding de las solicitudes (identity = sin compresión)')
+    parser.add_argument('--output', default='benchmark.json', help='archivo JSON de resultados')
+    parser.add_argument('--compare', help='línea base JSON contra la cual comparar')
+    parser.add_argument('--current', help='resultados ya medidos a comparar (no ejecuta el benchmark)')
+    parser.add_argument('--threshold', type=float, default=0.10, help='umbral de regresión (0.10 = 10%%)')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        random.seed(args.worker)
+        json.dump(run_worker(args.worker, args.requests, args.warmup, args.only, args.encoding), sys.stdout)
+        return 0
+
+    if args.current:
+        with open(args.current, encoding='utf-8') as f:
+            current = json.load(f)
+    else:
+        current = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'requests_per_endpoint': args.requests,
+            'accept_encoding': args.encoding,
+            'runs': {},
+        }
+        for size in (int(value) for value in args.sizes.split(',') if value.strip()):
+            print(f"🐄 Hato de {size} animales", file=sys.stderr)
+            command = [sys.executable, os.path.abspath(__file__), '--worker', str(size),
+                       '--requests', str(args.requests), '--warmup', str(args.warmup), '--only', args.only,
+                       '--encoding', args.encoding]
+            result = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+            current['runs'][str(size)] = json.loads(result.stdout)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+        print(f"📄 Resultados en {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        return 1 if print_comparison(baseline, current, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AgroTrace System - Simulador de lectores RFID para la pasarela
+
+Abre una conexión por lector simulado contra la pasarela RFID de la app
+(AGROTRACE_RFID_GATEWAY) y envía lecturas a la tasa indicada, en tramas
+binarias o líneas JSON, por TCP o UDP. Sirve para validar miles de lectores
+concurrentes en una sola máquina sin hardware.
+
+Uso:
+    AGROTRACE_RFID_GATEWAY=127.0.0.1:7070 python app.py
+    python rfid_simulator.py --readers 2000 --rate 5 --duration 30
+    python rfid_simulator.py --protocol udp --format json --readers 500
+    python rfid_simulator.py --api http://127.0.0.1:5000   # aretes reales del hato y estado final
+
+Se reporta lo enviado, la tasa lograda y cuánto tiempo estuvieron los lectores
+bloqueados por contrapresión (TCP); con --api también los contadores de la
+pasarela (aceptadas, agrupadas, rechazadas y descartadas).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import resource
+import struct
+import sys
+import time
+import urllib.request
+
+# Mismo registro binario que RfidGateway.FRAME en app.py
+FRAME = struct.Struct('<BB16sdBBfBfHf')
+MAGIC = 0xA5
+
+READERS = 8
+SCALE_READER = 6
+
+
+def load_tags(api, limit):
+    """Aretes del hato recorriendo /api/animals por cursor; sin --api se usan aretes sintéticos"""
+    if not api:
+        return [f'RF-SIM{index:06d}' for index in range(limit)]
+    tags, cursor = [], ''
+    while len(tags) < limit:
+        url = f"{api}/api/animals?per_page=100&sort=weight" + (f"&cursor={cursor}" if cursor else '')
+        with urllib.request.urlopen(url) as response:
+            payload = json.loads(response.read())
+        tags += [animal['rfid'] for animal in payload['data']]
+        cursor = payload['pagination'].get('next_cursor')
+        if not cursor:
+            break
+    return tags[:limit]
+
+
+def make_read(tags, reader):
+    """Lectura simulada con los rangos de generate_rfid_readings"""
+    read = {
+        'rfid': random.choice(tags),
+        'reader': reader,
+        'signal_strength': random.randint(20, 100),
+        'tag_temperature': round(random.uniform(36.5, 40.0), 1),
+        'battery_level': random.randint(5, 100),
+        'distance_meters': round(random.uniform(0.1, 5.0), 2),
+        'duration_ms': random.randint(50, 500),
+        'weight': round(random.uniform(180, 750), 1) if reader == SCALE_READER else 0.0,
+    }
+    return read
+
+
+def encode(reads, binary):
+    if binary:
+        return b''.join(FRAME.pack(MAGIC, read['reader'], read['rfid'].encode('ascii')[:16], time.time(), 0,
+                                   read['signal_strength'], read['tag_temperature'], read['battery_level'],
+                                   read['distance_meters'], read['duration_ms'], read['weight'])
+                        for read in reads)
+    lines = []
+    for read in reads:
+        line = {key: value for key, value in read.items() if key not in ('reader', 'weight')}
+        line['reader_id'] = f"RFID-{read['reader']:03d}"
+        line['timestamp'] = time.time()
+        if read['weight']:
+            line['weight'] = read['weight']
+        lines.append(json.dumps(line))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+async def run_reader(index, args, tags, totals, deadline):
+    """Un lector: cada tick envía las lecturas que le tocan según la tasa"""
+    reader = index % READERS + 1
+    tick = 0.1
+    per_tick = args.rate * tick
+    carry = random.random()
+    await asyncio.sleep(random.random() * tick)
+    if args.protocol == 'tcp':
+        try:
+            _, writer = await asyncio.open_connection(args.host, args.port)
+        except OSError:
+            totals['failed'] += 1
+            return
+        transport = None
+    else:
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            asyncio.DatagramProtocol, remote_addr=(args.host, args.port))
+    totals['connected'] += 1
+    try:
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            carry += per_tick
+            count, carry = int(carry), carry - int(carry)
+            if count:
+                data = encode([make_read(tags, reader) for _ in range(count)], args.format == 'binary')
+                if transport is None:
+                    writer.write(data)
+                    before = time.monotonic()
+                    await writer.drain()
+                    totals['blocked'] += time.monotonic() - before
+                else:
+                    transport.sendto(data)
+                totals['sent'] += count
+                totals['bytes'] += len(data)
+            await asyncio.sleep(max(tick - (time.monotonic() - started), 0))
+    except ConnectionError:
+        totals['failed'] += 1
+    finally:
+        if transport is None:
+            writer.close()
+        else:
+            transport.close()
+
+
+async def simulate(args, tags):
+    totals = {'connected': 0, 'failed': 0, 'sent': 0, 'bytes': 0, 'blocked': 0.0}
+    started = time.monotonic()
+    deadline = started + args.duration
+    await asyncio.gather(*(run_reader(index, args, tags, totals, deadline) for index in range(args.readers)))
+    totals['elapsed'] = time.monotonic() - started
+    return totals
+
+
+def raise_file_limit(needed):
+    """Sube el límite de descriptores abiertos (una conexión por lector)"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard) if hard != resource.RLIM_INFINITY else needed, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulador de lectores RFID para la pasarela de AgroTrace')
+    parser.add_argument('--host', default='127.0.0.1', help='host de la pasarela')
+    parser.add_argument('--port', type=int, default=7070, help='puerto de la pasarela (TCP y UDP)')
+    parser.add_argument('--protocol', choices=('tcp', 'udp'), default='tcp')
+    parser.add_argument('--format', choices=('binary', 'json'), default='binary', help='tramas binarias o líneas JSON')
+    parser.add_argument('--readers', type=int, default=1000, help='lectores concurrentes (una conexión cada uno)')
+    parser.add_argument('--rate', type=float, default=5.0, help='lecturas por segundo de cada lector')
+    parser.add_argument('--duration', type=float, default=10.0, help='segundos de simulación')
+    parser.add_argument('--tags', type=int, default=5000, help='aretes distintos a leer')
+    parser.add_argument('--api', help='URL de la app para tomar aretes reales y mostrar el estado de la pasarela')
+    parser.add_argument('--seed', type=int, help='semilla de las lecturas simuladas')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    raise_file_limit(args.readers + 256)
+    tags = load_tags(args.api, args.tags)
+    print(f"📡 {args.readers} lectores {args.protocol.upper()}/{args.format} a {args.rate:g} lecturas/s "
+          f"durante {args.duration:g}s contra {args.host}:{args.port} ({len(tags)} aretes)", file=sys.stderr)
+    totals = asyncio.run(simulate(args, tags))
+
+    elapsed = totals['elapsed']
+    print(f"  conectados {totals['connected']}  fallidos {totals['failed']}")
+    print(f"  enviadas {totals['sent']} lecturas ({totals['bytes'] / 1e6:.1f} MB) en {elapsed:.1f}s "
+          f"→ {totals['sent'] / elapsed:,.0f} lecturas/s (objetivo {args.readers * args.rate:,.0f})")
+    if args.protocol == 'tcp':
+        print(f"  contrapresión: {totals['blocked']:.1f}s de lector bloqueado en total")
+    if args.api:
+        # Con contrapresión quedan lecturas en los sockets: se espera a que la
+        # pasarela cierre las conexiones y vacíe su cola antes de leer los contadores
+        for _ in range(150):
+            with urllib.request.urlopen(f"{args.api}/api/rfid/gateway") as response:
+                stats = json.loads(response.read())['data']
+            if not stats['queued'] and not stats['connections']:
+                break
+            time.sleep(0.2)
+        print('  pasarela: ' + '  '.join(f"{key} {stats[key]}" for key in (
+            'frames', 'accepted', 'merged', 'rejected', 'dropped', 'malformed', 'backpressure_waits', 'batches',
+            'last_batch_ms')))
+    return 0 if not totals['failed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())